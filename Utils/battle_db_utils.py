@@ -15,7 +15,7 @@ api_fights_columns = ('battle_id', 'round_id', 'damage', 'weapon', 'berserk', 'd
 logger = logging.getLogger()
 
 
-async def cache_api_battles(interaction: Interaction, server: str, battle_ids: iter, excluded_ids: set = None) -> None:
+async def cache_api_battles(interaction: Interaction | None, server: str, battle_ids: iter, excluded_ids: set = None) -> None:
     """Verify all battles are in db, if not, insert them."""
     logger.info(f"cache_api_battles: {server=}, {len(battle_ids)=}, {excluded_ids=}")
     battle_id_where = await get_battle_id_where(battle_ids, excluded_ids)
@@ -27,7 +27,7 @@ async def cache_api_battles(interaction: Interaction, server: str, battle_ids: i
     existing_battles = {x[0] for x in await execute_query(bot.pool, query, fetch=True)}  # x[0] = battle_id
 
     for battle_id in battle_ids:
-        if await bot.should_cancel(interaction):
+        if interaction is not None and await bot.should_cancel(interaction):
             break
         if battle_id not in existing_battles:
             await insert_into_api_battles(server, battle_id)
@@ -55,13 +55,13 @@ async def get_battle_id_where(battle_ids: iter, excluded_ids: set) -> str:
     return battle_id_where
 
 
-async def insert_into_api_battles(server: str, battle_id: int) -> dict:
-    """Insert_into_api_battles."""
+async def insert_into_api_battles(server: str, battle_id: int, last_verified_round: int = -1) -> dict:
+    """Insert_into_api_battles (last_verified_round can be kept when refreshing a known battle)."""
     api_battles = await utils.get_content(f'https://{server}.e-sim.org/apiBattles.html?battleId={battle_id}')
     api_battles['totalSecondsRemaining'] = (api_battles["hoursRemaining"] * 3600 +
                                             api_battles["minutesRemaining"] * 60 + api_battles["secondsRemaining"])
     api_battles['battle_id'] = battle_id
-    api_battles['lastVerifiedRound'] = -1
+    api_battles['lastVerifiedRound'] = last_verified_round
     filtered_api_battles = {k: api_battles[k] for k in api_battles_columns}
 
     placeholders = ', '.join(['%s'] * len(filtered_api_battles))
@@ -134,19 +134,7 @@ async def cache_api_fights(interaction: Interaction, server: str, api_battles_df
         if await bot.should_cancel(interaction, msg):
             break
 
-        battle_is_over = 8 in (api_battles['defenderScore'], api_battles['attackerScore'])
-        if battle_is_over:
-            current_round = api_battles["currentRound"]  # this can be 9...16 included
-        else:
-            current_round = api_battles["currentRound"] + 1  # insert the ongoing round too
-        last_verified_round = max(api_battles["lastVerifiedRound"], 0)
-        for round_id in range(last_verified_round + 1, current_round):
-            # Using int because battle_id is np.int64
-            await insert_into_api_fights(server, int(api_battles["battle_id"]), round_id)
-            await utils.custom_delay(interaction)
-        scanned_rounds += current_round
-
-        await update_last_verified_round(server, api_battles)
+        scanned_rounds += await cache_battle_fights(server, api_battles, interaction)
         msg = await utils.update_percent(scanned_rounds, total_rounds_to_be_scanned, msg)
 
     try:
@@ -156,6 +144,23 @@ async def cache_api_fights(interaction: Interaction, server: str, api_battles_df
     logger.info(f"cache_api_fights: Done caching {total_rounds_to_be_scanned} rounds from {server=}")
 
 
+async def cache_battle_fights(server: str, api_battles: dict, interaction: Interaction = None) -> int:
+    """Insert the unverified rounds of one battle (including the ongoing one), and return its current round."""
+    battle_is_over = 8 in (api_battles['defenderScore'], api_battles['attackerScore'])
+    if battle_is_over:
+        current_round = api_battles["currentRound"]  # this can be 9...16 included
+    else:
+        current_round = api_battles["currentRound"] + 1  # insert the ongoing round too
+    last_verified_round = max(api_battles["lastVerifiedRound"], 0)
+    for round_id in range(last_verified_round + 1, current_round):
+        # Using int because battle_id is np.int64
+        await insert_into_api_fights(server, int(api_battles["battle_id"]), round_id)
+        await utils.custom_delay(interaction)
+
+    await update_last_verified_round(server, api_battles)
+    return current_round
+
+
 async def update_last_verified_round(server: str, api_battles: pd.Series) -> None:
     """Update lastVerifiedRound in apiBattles.
 
@@ -202,7 +207,7 @@ async def select_many_api_fights(server: str, battle_ids: iter, columns: tuple =
 
 
 async def get_api_fights_sum(server: str, battle_ids: iter, group_by: str = "citizenId",
-                             excluded_ids: set = None) -> pd.DataFrame:
+                             excluded_ids: set = None, custom_condition: str = None) -> pd.DataFrame:
     """Get the sum of damage, hits, and quality for each citizen in the given battles.
 
     Returns a DataFrame with columns: citizenId, damage, Q0, Q1, Q2, Q3, Q4, Q5, hits
@@ -219,7 +224,8 @@ async def get_api_fights_sum(server: str, battle_ids: iter, group_by: str = "cit
              "SUM(IF(weapon = 5, IF(berserk, 5, 1), 0)) AS Q5, "
              "SUM(IF(berserk, 5, 1)) AS hits "
              f"FROM `{server}`.apiFights "
-             f"WHERE {group_by} <> 0 AND {battle_id_where} "
+             f"WHERE {group_by} <> 0 AND {battle_id_where} " +
+             ("" if not custom_condition else f"AND {custom_condition} ") +
              f"GROUP BY {group_by} "
              "ORDER BY damage DESC "  # TODO: parameter
              )
@@ -231,6 +237,40 @@ async def get_api_fights_sum(server: str, battle_ids: iter, group_by: str = "cit
     return df
 
 
+api_fights_aggregates = {
+    "damage": "SUM(damage)",
+    **{f"Q{wep_q} weps": f"SUM(IF(weapon = {wep_q}, IF(berserk, 5, 1), 0))" for wep_q in range(6)},
+    "hits": "SUM(IF(berserk, 5, 1))",
+    "max_hit": "MAX(damage)",
+}
+# 10 minutes windows (restores), without depending on the session time zone
+api_fights_window = "TIMESTAMPADD(MINUTE, TIMESTAMPDIFF(MINUTE, '2000-01-01', time) DIV 10 * 10, '2000-01-01')"
+
+
+async def select_api_fights_aggregates(server: str, battle_ids: iter, group_by: dict[str, str],
+                                       aggregates: iter = ("damage",), excluded_ids: set = None,
+                                       custom_condition: str = None) -> pd.DataFrame:
+    """Aggregate the fights in the given battles server-side.
+
+    group_by maps each result column to its sql expression, e.g. {"date": "DATE(time)"}.
+    Returns a DataFrame with the group_by columns followed by the aggregates (see api_fights_aggregates).
+    """
+    logger.info(f"select_api_fights_aggregates: {server=}, {len(battle_ids)=}, {group_by=}, {custom_condition=}")
+    battle_id_where = await get_battle_id_where(battle_ids, excluded_ids)
+    select = [f"{expression} AS `{column}`" for column, expression in group_by.items()] + [
+        f"{api_fights_aggregates[column]} AS `{column}`" for column in aggregates]
+    query = (f"SELECT {', '.join(select)} FROM `{server}`.apiFights "
+             f"WHERE {battle_id_where} " +
+             ("" if not custom_condition else f"AND {custom_condition} ") +
+             f"GROUP BY {', '.join(f'`{column}`' for column in group_by)}")
+
+    api_fights = await execute_query(bot.pool, query, fetch=True)
+    df = pd.DataFrame(api_fights, columns=[*group_by, *aggregates]).astype(
+        {column: "int64" for column in aggregates})  # SUM returns decimals
+    logger.info(f"select_api_fights_aggregates: Done selecting {len(df)} rows from {server=}")
+    return df
+
+
 async def select_one_api_fights(server: str, api: dict, round_id: int = 0) -> pd.DataFrame:
     # TODO: rewrite - not used yet
     battle_id = api["battle_id"]
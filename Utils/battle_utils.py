@@ -1,76 +1,59 @@
-import math
+import logging
 import traceback
-from asyncio import sleep
+from asyncio import gather, sleep
 from collections import defaultdict
 from io import BytesIO
 from random import randint
+from time import time
 
 import pandas as pd
-from discord import Embed, File, Interaction, TextChannel
-from matplotlib import pyplot as plt
-from matplotlib.dates import DateFormatter
-from matplotlib.gridspec import GridSpec
-from matplotlib.ticker import FixedLocator
-
-from . import battle_db_utils, utils
-
-
-def normal_pdf(x, mean, std) -> float:
-    """Probability Density Function - a good binomial approximation for big numbers.
-
-    X ~ N(mu=mean=np, sigma=std=sqrt(np(1-p))
-    PDF(X) = e^(-(x-np)^2/(2np(1-p))) / sqrt(2*PI*np(1-p))
-    """
-    return math.exp(- math.pow((x - mean) / std, 2) / 2) / (math.sqrt(2 * math.pi) * std)
-
-
-def binom_pmf(n: int, p: float) -> list[float]:
-    """Return full Binomial(n,p) PMF as a list of floats length n+1.
-    Uses a centered recurrence around the mode; falls back to log-space shift if needed.
-    """
-    if p <= 0.0:
-        probs = [1.0] + [0.0] * n
-        return probs
-    if p >= 1.0:
-        probs = [0.0] * n + [1.0]
-        return probs
-
-    # mode (an integer where PMF is maximal)
-    mode = int(math.floor((n + 1) * p))
-    mode = max(0, min(n, mode))
-
-    # log P(mode)
-    logp_mode = (math.lgamma(n + 1) - math.lgamma(mode + 1) - math.lgamma(n - mode + 1)
-                 + mode * math.log(p) + (n - mode) * math.log1p(-p))
-    try:
-        prob_mode = math.exp(logp_mode)
-    except OverflowError:
-        prob_mode = 0.0
-
-    # If we got a sane nonzero mode probability, expand outwards by recurrence
-    if prob_mode > 0.0:
-        probs = [0.0] * (n + 1)
-        probs[mode] = prob_mode
-        # downward (k -> k-1)
-        for k in range(mode, 0, -1):
-            probs[k - 1] = probs[k] * k / (n - k + 1) * ((1.0 - p) / p)
-        # upward (k -> k+1)
-        for k in range(mode, n):
-            probs[k + 1] = probs[k] * (n - k) / (k + 1) * (p / (1.0 - p))
-        s = sum(probs)
-        if s > 0.0:
-            return [v / s for v in probs]  # normalize to guard against tiny FP drift
-
-    # Fallback: compute log-PMF for all k, shift by max log to avoid underflow, exponentiate, normalize
-    log_probs = [
-        (math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
-         + k * math.log(p) + (n - k) * math.log1p(-p))
-        for k in range(n + 1)
-    ]
-    max_log = max(log_probs)
-    probs = [math.exp(lp - max_log) for lp in log_probs]
-    s = sum(probs)
-    return [v / s for v in probs]
+from discord import Embed, File, Interaction
+from discord.ext import tasks
+
+from . import battle_db_utils, battles_list, plot_utils, results_cache, utils
+from .export_utils import CsvExport
+from .transformers import get_tournament_link
+
+logger = logging.getLogger()
+cup_battle_types = ('TEAM_TOURNAMENT', "COUNTRY_TOURNAMENT", "LEAGUE", "CUP_EVENT_BATTLE",
+                    "MILITARY_UNIT_CUP_EVENT_BATTLE", "TEAM_NATIONAL_CUP_BATTLE")
+# While a cup is running, its leaderboard is refreshed every cup_refresh_interval seconds,
+#  until it's over or hasn't been requested for cup_leaderboard_ttl seconds.
+cup_refresh_interval = 300
+cup_leaderboard_ttl = 2 * 24 * 3600
+# The running tournaments are looked up every cup_prewarm_interval seconds, and their leaderboards are kept live
+cup_prewarm_interval = 1800
+# Both cup tasks share a budget of cup_requests_rate e-sim requests per second (a battle, a tournament page or
+#  a citizen), and at most cup_max_battles_per_tick battles are refreshed per tick (the others are refreshed in
+#  the next one).
+cup_requests_rate = 2
+cup_max_battles_per_tick = 40
+next_cup_request = 0.0
+# The citizens of the leaderboards' top 10 (which rarely change) are fetched again after cup_citizens_ttl seconds
+cup_citizens_ttl = 3600
+cup_citizens: dict[tuple[str, int], tuple[dict, float]] = {}  # (server, citizen id) -> (apiCitizenById, fetched at)
+
+
+async def wait_for_cup_request() -> None:
+    """Wait for the next slot of the cup tasks' rate budget."""
+    global next_cup_request
+    slot = max(next_cup_request, time())
+    next_cup_request = slot + 1 / cup_requests_rate
+    await sleep(slot - time())
+
+
+async def get_cup_citizen(interaction: Interaction | None, server: str, citizen_id: int) -> dict:
+    """apiCitizenById of a leaderboard citizen (the background refreshes are charged to the cup tasks' budget)."""
+    api_citizen, fetched_at = cup_citizens.get((server, citizen_id), (None, 0))
+    if time() - fetched_at < cup_citizens_ttl:
+        return api_citizen
+    if interaction is None:
+        await wait_for_cup_request()
+    api_citizen = await utils.get_content(f'https://{server}.e-sim.org/apiCitizenById.html?id={citizen_id}')
+    cup_citizens[(server, citizen_id)] = (api_citizen, time())
+    if interaction is not None:
+        await utils.custom_delay(interaction)
+    return api_citizen
 
 
 async def cup_func(bot, interaction: Interaction, db_key: str, server: str, battle_ids_range: range,
@@ -80,53 +63,27 @@ async def cup_func(bot, interaction: Interaction, db_key: str, server: str, batt
         base_url = f"https://{server}.e-sim.org/"
         start_id, end_id = battle_ids_range.start, battle_ids_range.stop - 1
         battle_type = (await battle_db_utils.select_one_api_battles(server, start_id))['type']
-        if battle_type not in ('TEAM_TOURNAMENT', "COUNTRY_TOURNAMENT", "LEAGUE", "CUP_EVENT_BATTLE",
-                               "MILITARY_UNIT_CUP_EVENT_BATTLE", "TEAM_NATIONAL_CUP_BATTLE"):
+        if battle_type not in cup_battle_types:
             await utils.custom_followup(interaction, f"First battle must be a cup (not `{battle_type}`)")
-            db_dict = await utils.find_one("collection", interaction.command.name)
-            del db_dict[db_key]
-            return await utils.replace_one("collection", interaction.command.name, db_dict)
+            async with utils.edit("collection", interaction.command.name) as db_dict:
+                db_dict.pop(db_key, None)
+            return
 
         bot.logger.info(f"cup_func start: {server=}, {start_id=}, {end_id=}, {db_key=}, {battle_type=}")
-        await battle_db_utils.cache_api_battles(interaction, server, battle_ids_range, excluded_ids=excluded_ids)
-        api_battles_df = await battle_db_utils.select_many_api_battles(
-            server, battle_ids_range, excluded_ids=excluded_ids, custom_condition=f"type = '{battle_type}'")
-        await battle_db_utils.cache_api_fights(interaction, server, api_battles_df)
-
-        api_fights_df = await battle_db_utils.get_api_fights_sum(server, battle_ids_range, excluded_ids=excluded_ids)
-        del api_battles_df  # free memory
-
-        output = BytesIO()
-        api_fights_df.to_csv(output, index=False)
-
-        final = defaultdict(lambda: {'hits': 0, 'damage': 0})
-        top5 = {}
-        for i, (citizen_id, row) in enumerate(api_fights_df.head(10).to_dict(orient="index").items()):
-            api_citizen = await utils.get_content(
-                f'{base_url}apiCitizenById.html?id={citizen_id}')  # TODO: cache to db
-            hyperlink = f"{utils.get_flag_code(api_citizen['citizenship'])}" \
-                        f" [{api_citizen['login'][:25]}]({base_url}profile.html?id={citizen_id})"
-            final[hyperlink]['damage'] = row['damage']
-            final[hyperlink]['hits'] = row['hits']
-            if i < 5:
-                top5[citizen_id] = api_citizen['login']
-            await utils.custom_delay(interaction)
-
-        hit_time_df = await battle_db_utils.select_many_api_fights(server, battle_ids_range,
-                                                            columns=("citizenId", "time", "damage"),
-                                                            custom_condition=f"citizenId in {tuple(top5)}")
-        output_buffer = generate_cup_plot(hit_time_df, top5)
+        api_fights_df, final, plot = await get_cup_ranking(interaction, server, battle_ids_range, excluded_ids,
+                                                           battle_type)
+        output = CsvExport()
+        output.write_df(api_fights_df, index=False)
         embed = Embed(colour=0x3D85C6, title=f"{server}, {start_id}-{end_id}")
         embed.add_field(name="**CS, Nick**", value="\n".join(final.keys()))
         embed.add_field(name="**Damage**", value="\n".join(f'{v["damage"]:,}' for v in final.values()))
         embed.add_field(name="**Hits**", value="\n".join(f'{v["hits"]:,}' for v in final.values()))
+        csv_file = output.to_file(f"Fighters_{server}_{start_id}-{end_id}.csv")
+        csv_content = csv_file.fp.read()  # every channel gets its own copy, as they are sent concurrently
         db_dict = await utils.find_one("collection", interaction.command.name) or {}
+        sends = []
         for cup_dict in db_dict.get(db_key, {}):
             for channel_id, data in cup_dict.items():
-                output_buffer.seek(0)
-                output.seek(0)
-                graph = File(fp=output_buffer, filename=f"{interaction.id}.png")
-                embed.set_thumbnail(url=f"attachment://{interaction.id}.png")
                 added_fields = False
                 if data["nick"] and data["nick"] != "-":
                     try:
@@ -142,303 +99,511 @@ async def cup_func(bot, interaction: Interaction, db_key: str, server: str, batt
                     except Exception:
                         pass
 
-                try:
-                    channel = bot.get_channel(int(channel_id))
-                    await channel.send(embed=await utils.convert_embed(int(data["author_id"]), embed),
-                                       files=[File(fp=BytesIO(output.getvalue()),
-                                                   filename=f"Fighters_{server}_{start_id}-{end_id}.csv"), graph])
-                except Exception as error:
-                    await utils.send_error(interaction, error)
+                channel = bot.get_channel(int(channel_id))
+                if channel is None:
+                    await utils.send_error(interaction, f"cup_func: {channel_id=} was not found")
+                else:
+                    sends.append(bot.notifier.send(
+                        channel, embed=await utils.convert_embed(int(data["author_id"]), embed.copy()),
+                        files=[File(fp=BytesIO(csv_content), filename=csv_file.filename)], image=plot))
                 if added_fields:
                     for _ in range(3):
                         embed.remove_field(-1)
-                await sleep(0.4)
+        if not all(await gather(*sends)):
+            await utils.send_error(interaction, f"cup_func: failed to send some of the results of {db_key=}")
 
     except Exception as error:
         await utils.send_error(interaction, error)
 
-    db_dict = await utils.find_one("collection", interaction.command.name)
-    if db_key in db_dict:
-        del db_dict[db_key]
-        await utils.replace_one("collection", interaction.command.name, db_dict)
+    async with utils.edit("collection", interaction.command.name) as db_dict:
+        db_dict.pop(db_key, None)
     bot.logger.info(f"cup_func end: {server=}, {db_key=}")
 
 
-def generate_cup_plot(df: pd.DataFrame, names: dict) -> BytesIO | None:
-    names = {k: v.replace("_", "") for k, v in names.items()}  # matplotlib ignores names that starts with _
-    # Calculate total_damage for each row
-    df['total_damage'] = df.groupby('citizenId')['damage'].cumsum()
-
-    # Identify the day changes (more than 12h) and plot them directly
-    fig, (ax0, ax1) = plt.subplots(1, 2, sharey='all', tight_layout=True)
-
-    has_second_day = False
-
-    colors = ('red', 'blue', 'green', 'orange', 'purple', 'brown', 'pink', 'gray', 'olive', 'cyan')
-
-    for i, (citizen_id, group) in enumerate(df.groupby('citizenId')):
-        color = colors[i]
-
-        # Filter and plot points corresponding to day changes
-        second_day_points = group[group['time'] - group['time'].shift() > pd.Timedelta(hours=12)]
-
-        # Plot the first subplot (before the day change)
-        if not second_day_points.empty:
-            ax0.plot(group['time'][group['time'] < second_day_points.iloc[0]['time']],
-                     group['total_damage'][group['time'] < second_day_points.iloc[0]['time']],
-                     label=names[citizen_id], color=color)
-        else:
-            ax0.plot(group['time'], group['total_damage'], label=names[citizen_id], color=color)
+async def get_cup_ranking(interaction: Interaction, server: str, battle_ids_range: range, excluded_ids: set | None,
+                          battle_type: str) -> tuple[pd.DataFrame, dict, bytes]:
+    """Get the cup leaderboard: (fights sum per citizen, top 10 {hyperlink: hits and damage}, top 5 plot).
 
-        # Plot the second subplot (after the day change)
-        if not second_day_points.empty:
-            has_second_day = True
-            ax1.plot(group['time'][group['time'] >= second_day_points.iloc[0]['time']],
-                     group['total_damage'][group['time'] >= second_day_points.iloc[0]['time']],
-                     label=names[citizen_id], color=color)
-
-    # Use FixedFormatter with existing tick positions
-    ax0.yaxis.set_major_locator(FixedLocator(ax0.get_yticks()))
-    ax0.set_yticklabels([utils.human_format(x) for x in ax0.get_yticks().tolist()])
-
-    ax0.xaxis.set_major_formatter(DateFormatter("%d-%m %H:%M"))
-    ax1.xaxis.set_major_formatter(DateFormatter("%d-%m %H:%M"))
-
-    if has_second_day:
-        ax0.spines['right'].set_visible(False)
-        ax1.spines['left'].set_visible(False)
-        ax1.yaxis.tick_right()
+    The leaderboard is kept in results_cache, and only the rounds verified since are added to it.
+    While the cup is running, refresh_cup_leaderboards keeps it up to date, so it's returned right away.
+    """
+    cache_key = results_cache.get_key("cup", server, set(battle_ids_range) - set(excluded_ids or ()),
+                                      battle_type=battle_type)
+    cached = await results_cache.load(cache_key)
+    if cached and "ranking" not in cached:
+        cached = None
+    if cached and cache_key in await utils.find_one("collection", "cup_leaderboards"):
+        async with utils.edit("collection", "cup_leaderboards") as leaderboards:
+            is_fresh = cache_key in leaderboards and (
+                    time() - leaderboards[cache_key]["refreshed"] < 2 * cup_refresh_interval)
+            if is_fresh:
+                leaderboards[cache_key]["requested"] = time()
+        if is_fresh:
+            return cached["ranking"]
+
+    await battle_db_utils.cache_api_battles(interaction, server, battle_ids_range, excluded_ids=excluded_ids)
+    api_battles_df = await battle_db_utils.select_many_api_battles(
+        server, battle_ids_range, excluded_ids=excluded_ids, custom_condition=f"type = '{battle_type}'")
+    if cached and results_cache.is_complete(cached["verified_rounds"]) and (
+            cached["verified_rounds"].keys() == set(api_battles_df["battle_id"].tolist())):
+        return cached["ranking"]
+
+    await battle_db_utils.cache_api_fights(interaction, server, api_battles_df)
+    verified_rounds = await results_cache.refresh_verified_rounds(server, api_battles_df)
+    ranking = await update_cup_ranking(interaction, server, battle_ids_range, excluded_ids, cache_key,
+                                       cached, verified_rounds)
+    if not results_cache.is_complete(verified_rounds):
+        async with utils.edit("collection", "cup_leaderboards") as leaderboards:
+            leaderboards[cache_key] = {"server": server, "first": battle_ids_range.start,
+                                       "last": battle_ids_range.stop - 1, "excluded": sorted(excluded_ids or ()),
+                                       "type": battle_type, "refreshed": time(), "requested": time()}
+    return ranking
+
+
+async def update_cup_ranking(interaction: Interaction | None, server: str, battle_ids_range: range,
+                             excluded_ids: set | None, cache_key: str, cached: dict | None,
+                             verified_rounds: dict) -> tuple[pd.DataFrame, dict, bytes]:
+    """Add the rounds verified since the cached leaderboard (if it's still valid), and rank again."""
+    base_url = f"https://{server}.e-sim.org/"
+
+    async def add_rounds(df: pd.DataFrame | None, condition: str) -> pd.DataFrame:
+        new_df = await battle_db_utils.get_api_fights_sum(
+            server, battle_ids_range, excluded_ids=excluded_ids, custom_condition=condition)
+        if df is None:
+            return new_df
+        df = (await results_cache.merge_many(([df], [new_df]), [["citizenId"]]))[0]
+        return df.sort_values("damage", ascending=False).set_index("citizenId", drop=False).rename_axis(None)
+
+    # The verified rounds are summed once, and later runs only add the rounds verified since
+    if cached and results_cache.is_valid(cached, verified_rounds):
+        verified_fights_df = cached["aggregates"]
+        new_rounds = results_cache.new_rounds_condition(cached["verified_rounds"], verified_rounds)
+        if new_rounds:
+            verified_fights_df = await add_rounds(verified_fights_df, new_rounds)
     else:
-        # remove ax1 and expand ax0
-        fig.delaxes(ax1)
-        ax0.set_subplotspec(GridSpec(1, 1)[0])
-
-    fig.suptitle('Total Damage vs Time')
-    ax0.set_ylabel('Total Damage')
-    ax0.set_xlabel('Time')
-
-    # sort legends based on tops
-    lines, labels = ax0.get_legend_handles_labels()
-    lines = tuple(lines[labels.index(label)] for label in names.values())
-    labels = tuple(labels[labels.index(label)] for label in names.values())
-    ax0.legend(lines, labels)
-
-    fig.autofmt_xdate()
-
-    return utils.plt_to_bytes(fig)
-
-
-async def motivate_func(bot, server: str, data: dict) -> None:
-    """Motivate func."""
-    base_url = f'https://{server}.e-sim.org/'
-    old_citizen_id = 0
-    while server in data:
-        updated = False
+        verified_fights_df = await add_rounds(None, results_cache.verified_condition(verified_rounds))
+    unverified_rounds = results_cache.unverified_condition(verified_rounds)
+    api_fights_df = verified_fights_df if not unverified_rounds else await add_rounds(
+        verified_fights_df, unverified_rounds)
+
+    final = defaultdict(lambda: {'hits': 0, 'damage': 0})
+    top5 = {}
+    for i, (citizen_id, row) in enumerate(api_fights_df.head(10).to_dict(orient="index").items()):
+        api_citizen = await get_cup_citizen(interaction, server, citizen_id)
+        hyperlink = f"{utils.get_flag_code(api_citizen['citizenship'])}" \
+                    f" [{api_citizen['login'][:25]}]({base_url}profile.html?id={citizen_id})"
+        final[hyperlink]['damage'] = row['damage']
+        final[hyperlink]['hits'] = row['hits']
+        if i < 5:
+            top5[citizen_id] = api_citizen['login']
+
+    hit_time_df = await battle_db_utils.select_many_api_fights(
+        server, battle_ids_range, columns=("citizenId", "time", "damage"),
+        custom_condition=f"citizenId IN ({','.join(map(str, top5)) or 'NULL'})")
+    plot = await utils.render(plot_utils.generate_cup_plot, hit_time_df, top5)
+    ranking = api_fights_df, dict(final), plot.getvalue()
+    await results_cache.save(cache_key, {"verified_rounds": verified_rounds, "aggregates": verified_fights_df,
+                                         "ranking": ranking})
+    return ranking
+
+
+@tasks.loop(seconds=cup_refresh_interval)
+async def refresh_cup_leaderboards() -> None:
+    """Keep the leaderboards of the running cups up to date, and rank them again as soon as a round closes.
+
+    A battle is fetched again only when its round may have closed (by the round timer of the previous fetch),
+    or when its last closed round isn't verified yet.
+    """
+    leaderboards = await utils.find_one("collection", "cup_leaderboards")
+    refreshed_battles = 0
+    # The leaderboards that were left behind (by cup_max_battles_per_tick) go first
+    for cache_key, leaderboard in sorted(leaderboards.items(), key=lambda item: item[1]["refreshed"]):
         try:
-            tree = await utils.get_content(f'{base_url}newCitizens.html?countryId=0')
-            try:
-                citizen_id = int(utils.get_ids_from_path(tree, "//tr[2]//td[1]/div/a")[0])
-            except IndexError:
-                await sleep(randint(500, 700))
+            server, excluded_ids = leaderboard["server"], set(leaderboard["excluded"])
+            battle_ids_range = range(leaderboard["first"], leaderboard["last"] + 1)
+            if time() - leaderboard["requested"] > cup_leaderboard_ttl:
+                leaderboard["done"] = True
                 continue
-            if old_citizen_id and citizen_id != old_citizen_id:
-                embed = Embed(colour=0x3D85C6, title="Citizens Registered In The Last 5 Minutes",
-                              url=f'{base_url}newCitizens.html?countryId=0')
-                last_citizen = min(old_citizen_id + 10, citizen_id)
-                embed.add_field(name="Motivate Link", value="\n".join(
-                    f'{base_url}motivateCitizen.html?id={i + 1}' for i in range(old_citizen_id, last_citizen)))
-                embed.set_footer(text=f"If you want to stop it, type /got servers: {server}")
-                for channel_id in list(data[server]):
-                    try:
-                        # TODO: remove old channels (1 month)
-                        channel = bot.get_channel(int(channel_id))
-                        await channel.send(embed=await utils.custom_author(embed))
-                    except Exception as e:
-                        bot.logger.error(f"Error in motivate_func, failed to send msg to {channel_id=}: {e}")
-                        updated = True
-                        data[server].remove(channel_id)
-                    await sleep(0.4)
-            old_citizen_id = citizen_id
-            if updated:
-                await utils.replace_one("collection", "motivate", data)
-            del data, tree
-        except Exception as e:
-            bot.logger.error(f"Error in motivate_func: {e}")
-            traceback.print_exc()
-        await sleep(randint(500, 700))
-        data = await utils.find_one("collection", "motivate")
-
-
-async def ping_func(channel: TextChannel, t: float, server: str, ping_id: str, country: str,
-                    role: str, author_id: int = 0) -> None:
-    """Ping func."""
+            cached = await results_cache.load(cache_key)  # None if it was prewarmed (or evicted)
+            old_verified_rounds = cached["verified_rounds"] if cached else {}
+            api_battles_df = await battle_db_utils.select_many_api_battles(
+                server, battle_ids_range, excluded_ids=excluded_ids,
+                custom_condition=f"type = '{leaderboard['type']}'")
+            next_refresh = leaderboard.setdefault("next_refresh", {})  # battle id (str) -> when to fetch it again
+            fetched, left_behind = {}, False
+            for api_battles in api_battles_df.to_dict(orient="index").values():
+                battle_id = int(api_battles["battle_id"])
+                if old_verified_rounds.get(battle_id, 0) is None:
+                    continue  # all of its rounds are in the leaderboard already
+                if next_refresh.get(str(battle_id), 0) > time():
+                    continue  # its round is still running
+                if refreshed_battles >= cup_max_battles_per_tick:
+                    left_behind = True
+                    break
+                refreshed_battles += 1
+                await wait_for_cup_request()
+                api_battles = await battle_db_utils.insert_into_api_battles(
+                    server, battle_id, api_battles["lastVerifiedRound"])
+                await battle_db_utils.cache_battle_fights(server, api_battles)
+                fetched[battle_id] = api_battles["currentRound"]
+                next_refresh[str(battle_id)] = time() + api_battles["totalSecondsRemaining"]
+            verified_rounds = await results_cache.refresh_verified_rounds(server, api_battles_df)
+            for battle_id, current_round in fetched.items():
+                if verified_rounds.get(battle_id) is None:
+                    next_refresh.pop(str(battle_id), None)
+                elif verified_rounds[battle_id] < current_round - 1:  # its last round is verified at the next fetch
+                    next_refresh[str(battle_id)] = 0
+            if not cached or verified_rounds != old_verified_rounds:  # a round has closed
+                await update_cup_ranking(None, server, battle_ids_range, excluded_ids, cache_key, cached,
+                                         verified_rounds)
+            if not left_behind:
+                leaderboard["refreshed"] = time()
+            leaderboard["done"] = results_cache.is_complete(verified_rounds)
+        except Exception as error:
+            logger.error(f"refresh_cup_leaderboards: {cache_key=}, {error=}")
+
+    # It may have changed in the meantime
+    async with utils.edit("collection", "cup_leaderboards") as db_dict:
+        for cache_key, leaderboard in leaderboards.items():
+            if cache_key in db_dict:
+                if leaderboard.get("done"):
+                    del db_dict[cache_key]
+                else:
+                    db_dict[cache_key]["refreshed"] = leaderboard["refreshed"]
+                    db_dict[cache_key]["next_refresh"] = leaderboard.get("next_refresh", {})
+
+
+async def get_tournament_battle_ids(link: str) -> set[int]:
+    """Get the ids of the battles listed in a tournament page."""
+    if "countryTournament" not in link:
+        tree = await utils.get_locked_content(link)
+        return {int(x) for x in utils.get_ids_from_path(tree, '//*[@class="battle-link"]')}
+    tree = await utils.get_locked_content(link + "&hash=%23slideShedule", method="post")
+    return {int(x) for x in utils.get_ids_from_path(tree, '//*[@class="getBattle right"]')}
+
+
+async def get_running_tournaments(server: str) -> list[str]:
+    """Get the links of the active tournaments in the events page."""
+    base_url = f"https://{server}.e-sim.org/"
+    tree = await utils.get_locked_content(f"{base_url}tournamentEvents.html")
+    links = []
+    for row in tree.xpath('//tr[position()>1]'):
+        status = "".join(row.xpath('td[4]//text()')).strip()
+        href = row.xpath('td[2]/a/@href')
+        link = get_tournament_link(base_url + href[0].lstrip("/")) if href else None
+        if status == "active" and link:
+            links.append(link)
+    return links
+
+
+@tasks.loop(seconds=cup_prewarm_interval)
+async def prewarm_cups(bot) -> None:
+    """Register the leaderboards of the running tournaments, before anyone asks for them.
+
+    refresh_cup_leaderboards then caches their fights as rounds close and renders the ranking,
+    so `cup` and `cup_plus` are served from results_cache once the tournament is over.
+    Only the servers in the cup_prewarm_servers config are prewarmed (none by default), and the tournament
+    pages share the rate budget of refresh_cup_leaderboards.
+    """
+    prewarmed = {}
+    for server in bot.config.get("cup_prewarm_servers", []):
+        try:
+            await wait_for_cup_request()
+            links = await get_running_tournaments(server)
+        except Exception as error:
+            logger.error(f"prewarm_cups: {server=}, {error=}")
+            continue
+        for link in links:
+            try:
+                await wait_for_cup_request()
+                ids = await get_tournament_battle_ids(link)
+                if not ids:
+                    continue  # no battle has started yet
+                battle_ids_range = range(min(ids), max(ids) + 1)
+                excluded_ids = set(battle_ids_range) - ids
+                await battle_db_utils.cache_api_battles(None, server, battle_ids_range, excluded_ids=excluded_ids)
+                battle_type = (await battle_db_utils.select_one_api_battles(server, min(ids)))['type']
+                if battle_type not in cup_battle_types:
+                    continue
+                cache_key = results_cache.get_key("cup", server, ids, battle_type=battle_type)
+                prewarmed[cache_key] = {
+                    "server": server, "first": battle_ids_range.start, "last": battle_ids_range.stop - 1,
+                    "excluded": sorted(excluded_ids), "type": battle_type, "refreshed": 0, "requested": time(),
+                    "link": link}
+            except Exception as error:
+                logger.error(f"prewarm_cups: {link=}, {error=}")
+
+    # It may have changed in the meantime
+    links = {leaderboard["link"] for leaderboard in prewarmed.values()}
+    async with utils.edit("collection", "cup_leaderboards") as db_dict:
+        for cache_key, leaderboard in list(db_dict.items()):
+            if leaderboard.get("link") in links and cache_key not in prewarmed:
+                del db_dict[cache_key]  # more battles were added to the tournament
+        for cache_key, leaderboard in prewarmed.items():
+            if cache_key in db_dict:
+                db_dict[cache_key]["requested"] = leaderboard["requested"]
+                db_dict[cache_key]["link"] = leaderboard["link"]
+            else:
+                db_dict[cache_key] = leaderboard
+                logger.info(f"prewarm_cups: watching {leaderboard['link']} ({cache_key=})")
+
+
+async def schedule_motivate(bot, server: str, delay: float = 0, replace: bool = True) -> None:
+    """Schedule the motivate job of the given server."""
+    await bot.scheduler.schedule(f"motivate {server}", "motivate", {"server": server}, delay, replace)
+
+
+async def motivate_func(bot, job_id: str, state: dict) -> float | None:
+    """Motivate func (a scheduler job per server, until no channel is left)."""
+    server = state["server"]
+    data = await utils.find_one("collection", "motivate")
+    if server not in data:
+        return None
+    base_url = f'https://{server}.e-sim.org/'
+    failed = []
+    try:
+        tree = await utils.get_content(f'{base_url}newCitizens.html?countryId=0')
+        try:
+            citizen_id = int(utils.get_ids_from_path(tree, "//tr[2]//td[1]/div/a")[0])
+        except IndexError:
+            return randint(500, 700)
+        old_citizen_id = state.get("old_citizen_id", 0)
+        if old_citizen_id and citizen_id != old_citizen_id:
+            embed = Embed(colour=0x3D85C6, title="Citizens Registered In The Last 5 Minutes",
+                          url=f'{base_url}newCitizens.html?countryId=0')
+            last_citizen = min(old_citizen_id + 10, citizen_id)
+            embed.add_field(name="Motivate Link", value="\n".join(
+                f'{base_url}motivateCitizen.html?id={i + 1}' for i in range(old_citizen_id, last_citizen)))
+            embed.set_footer(text=f"If you want to stop it, type /got servers: {server}")
+            channel_ids = [channel_id for channel_id in data[server] if bot.get_channel(int(channel_id))]
+            # TODO: remove old channels (1 month)
+            sends = [bot.notifier.send(bot.get_channel(int(channel_id)), embed=await utils.custom_author(embed.copy()))
+                     for channel_id in channel_ids]
+            delivered = await gather(*sends)
+            for channel_id in data[server]:
+                if channel_id not in channel_ids or not delivered[channel_ids.index(channel_id)]:
+                    bot.logger.error(f"Error in motivate_func, failed to send msg to {channel_id=}")
+                    failed.append(channel_id)
+        state["old_citizen_id"] = citizen_id
+        if failed:
+            async with utils.edit("collection", "motivate") as data:
+                if server in data:
+                    data[server] = [channel_id for channel_id in data[server] if channel_id not in failed]
+    except Exception as e:
+        bot.logger.error(f"Error in motivate_func: {e}")
+        traceback.print_exc()
+    return randint(500, 700)
+
+
+async def schedule_ping(bot, ping_id: str, ping_dict: dict, delay: float = 0, replace: bool = True) -> None:
+    """Schedule the job of a ping entry (ping_id is "{channel_id} {id}")."""
+    state = dict(ping_dict, ping_id=ping_id, channel_id=int(ping_id.split()[0]), battles=[], waiting=False)
+    await bot.scheduler.schedule(f"ping {ping_id}", "ping", state, delay, replace)
+
+
+async def ping_func(bot, job_id: str, state: dict) -> float | None:
+    """Ping func (a scheduler job per ping).
+
+    Every cycle, it pings t minutes before the end of the current round of each battle, one battle at a time.
+    """
+    ping_id, server, country, t = state["ping_id"], state["server"], state["country"], state["t"]
     base_url = f'https://{server}.e-sim.org/'
     find_ping = await utils.find_one("collection", "ping")
-    while ping_id in find_ping:
-        battles = await utils.get_battles(base_url)
-        if country:
-            battles = [x for x in battles if
-                       country.lower() in (x['defender']['name'].lower(), x['attacker']['name'].lower())]
-
+    if ping_id not in find_ping:
+        return None
+    channel = bot.get_channel(state["channel_id"])
+    if channel is None:
+        async with utils.edit("collection", "ping") as find_ping:
+            find_ping.pop(ping_id, None)
+        return None
+
+    if not state["battles"]:  # a new cycle
+        battles = (await battles_list.get(server)).get_battles(country)
         if not battles:
-            await channel.send(
-                "The program has stopped, because there are currently no active RWs or attacks in this " +
+            await bot.notifier.send(
+                channel, "The program has stopped, because there are currently no active RWs or attacks in this " +
                 (f"country (`{country}`)." if country else f"server (`{server}`)."))
-            find_ping = await utils.find_one("collection", "ping")
-            if ping_id in find_ping:
-                del find_ping[ping_id]
-                await utils.replace_one("collection", "ping", find_ping)
-            break
-        battles = sorted(battles, key=lambda k: k['time_remaining'])
-        for battle_dict in battles:
-            api_battles = await utils.get_content(f'{base_url}apiBattles.html?battleId={battle_dict["battle_id"]}')
-            if api_battles["frozen"]:
-                continue
-            sleep_time = api_battles["hoursRemaining"] * 3600 + api_battles["minutesRemaining"] * 60 + api_battles[
-                "secondsRemaining"] - t * 60
+            async with utils.edit("collection", "ping") as find_ping:
+                find_ping.pop(ping_id, None)
+            return None
+        state["battles"] = [{"battle_id": x["battle_id"], "round": x["round"]} for x in battles]
+
+    while state["battles"]:
+        snapshot = await battles_list.get(server)
+        battle_dict = snapshot.battles.get(state["battles"][0]["battle_id"])
+        if battle_dict is None or battle_dict["round"] != state["battles"][0]["round"]:
+            state["waiting"] = False  # the round was closed in the meantime
+            state["battles"].pop(0)
+            continue
+        if not state["waiting"]:
+            sleep_time = snapshot.seconds_left(battle_dict) - t * 60
             if sleep_time > 0:
-                await sleep(sleep_time)
-            find_ping = await utils.find_one("collection", "ping")
-            if ping_id in find_ping:
-                d_name, a_name = battle_dict['defender']['name'], battle_dict['attacker']['name']
-                current_round = battle_dict['defender']['score'] + battle_dict['attacker']['score'] + 1
-                api_fights = f'{base_url}apiFights.html?battleId={battle_dict["battle_id"]}&roundId={current_round}'
-                my_dict, hit_time = await utils.save_dmg_time(api_fights, a_name, d_name)
-                output_buffer = await utils.dmg_trend(hit_time, server, f'{battle_dict["battle_id"]}-{current_round}')
-                hit_time.clear()
-                attacker_dmg = my_dict[a_name]
-                defender_dmg = my_dict[d_name]
-                embed = Embed(colour=0x3D85C6, title=f"{base_url}battle.html?id={battle_dict['battle_id']}",
-                              description=f"**T{t}, Score:** "
-                                          f"{battle_dict['defender']['score']}:{battle_dict['attacker']['score']}\n"
-                                          + (f"**Total Dmg:** {battle_dict['dmg']}" if 'dmg' in battle_dict else ''))
-                embed.add_field(name=f"{utils.get_flag_code(d_name)} " + utils.shorten_country(d_name),
-                                value=f"{defender_dmg:,}")
-                embed.add_field(name=f"Battle type: {api_battles['type'].replace('_', ' ').title()}",
-                                value=utils.bar(defender_dmg, attacker_dmg, d_name, a_name))
-                embed.add_field(name=f"{utils.get_flag_code(a_name)} " + utils.shorten_country(a_name),
-                                value=f"{attacker_dmg:,}")
-                embed.set_footer(text="Type /stop if you wish to stop it.")
-                embed.set_thumbnail(url=f"attachment://{channel.id}.png")
-                try:
-                    await channel.send(role, embed=await utils.convert_embed(int(author_id), embed),
-                                       delete_after=t * 60,
-                                       file=File(fp=output_buffer, filename=f"{channel.id}.png"))
-                except Exception:
-                    find_ping = await utils.find_one("collection", "ping")
-                    if f"{channel.id} {ping_id}" in find_ping:
-                        del find_ping[f"{channel.id} {ping_id}"]
-                        await utils.replace_one("collection", "ping", find_ping)
-                        await channel.send(f"There was an error. Program `ping` for ID {ping_id} has been stopped.")
-                    return
-        await sleep(t * 60 + 30)
-        find_ping = await utils.find_one("collection", "ping")
-
-
-async def watch_should_break(link: str, channel_id: int, api_battles: dict) -> bool:
-    """Returns True if link should be removed from watch dict:
-
-        1. if battle is over
-        2. if battle is frozen
-        3. if battle is not in watch dict
-    also updates the watch dict with the current score and sides
-    """
-
+                state["waiting"] = True
+                return sleep_time
+        api_battles = await utils.get_content(f'{base_url}apiBattles.html?battleId={battle_dict["battle_id"]}')
+        state["waiting"] = False
+        state["battles"].pop(0)
+        if api_battles["frozen"]:
+            continue
+        d_name, a_name = battle_dict['defender']['name'], battle_dict['attacker']['name']
+        current_round = battle_dict["round"]
+        api_fights = f'{base_url}apiFights.html?battleId={battle_dict["battle_id"]}&roundId={current_round}'
+        my_dict, hit_time = await utils.save_dmg_time(api_fights, a_name, d_name)
+        image = (await utils.dmg_trend(hit_time, server, f'{battle_dict["battle_id"]}-{current_round}')).getvalue()
+        hit_time.clear()
+        attacker_dmg = my_dict[a_name]
+        defender_dmg = my_dict[d_name]
+        embed = Embed(colour=0x3D85C6, title=f"{base_url}battle.html?id={battle_dict['battle_id']}",
+                      description=f"**T{t}, Score:** "
+                                  f"{battle_dict['defender']['score']}:{battle_dict['attacker']['score']}\n"
+                                  + (f"**Total Dmg:** {battle_dict['dmg']}" if 'dmg' in battle_dict else ''))
+        embed.add_field(name=f"{utils.get_flag_code(d_name)} " + utils.shorten_country(d_name),
+                        value=f"{defender_dmg:,}")
+        embed.add_field(name=f"Battle type: {api_battles['type'].replace('_', ' ').title()}",
+                        value=utils.bar(defender_dmg, attacker_dmg, d_name, a_name))
+        embed.add_field(name=f"{utils.get_flag_code(a_name)} " + utils.shorten_country(a_name),
+                        value=f"{attacker_dmg:,}")
+        embed.set_footer(text="Type /stop if you wish to stop it.")
+        embed = await utils.convert_embed(int(state["author_id"]), embed)
+        if not await bot.notifier.send(channel, state["role"], embed, image=image, delete_after=t * 60):
+            async with utils.edit("collection", "ping") as find_ping:
+                was_active = find_ping.pop(ping_id, None) is not None
+            if was_active:
+                await bot.notifier.send(
+                    channel, f"There was an error. Program `ping` for ID {ping_id.split()[1]} has been stopped.")
+            return None
+    return t * 60 + 30
+
+
+async def update_watch_doc(link: str, subs: dict, api_battles: dict) -> None:
+    """Drops the entries of link that are no longer watched, and updates the score and sides of the others."""
     attacker, defender = utils.get_sides(api_battles)
-    should_break = True
+    async with utils.edit("collection", "watch") as find_watch:
+        for watch_dict in list(find_watch.setdefault("watch", [])):
+            if watch_dict["link"] != link:
+                continue
+            if watch_dict.get("removed") or watch_key(watch_dict) not in subs:
+                find_watch["watch"].remove(watch_dict)
+            else:
+                watch_dict["sides"] = f"{defender} vs {attacker}"
+                watch_dict["score"] = f"{api_battles['defenderScore']}:{api_battles['attackerScore']}"
+
+
+def watch_key(watch_dict: dict) -> str:
+    """The key of a subscriber (channel and ping time) in its battle job."""
+    return f"{watch_dict['channel_id']} {watch_dict['t']}"
+
+
+async def schedule_watch(bot, watch_dict: dict, delay: float = 0, replace: bool = True) -> None:
+    """Subscribe a watch entry to the job of its battle (one job per battle, shared by all the channels)."""
+    job_id = f"watch {watch_dict['link']}"
+    state = bot.scheduler.get(job_id) or {"link": watch_dict["link"], "subs": {}}
+    key = watch_key(watch_dict)
+    if key in state["subs"] and not replace:
+        return
+    state["subs"][key] = dict(watch_dict, round=0, rounds=0)
+    if not bot.scheduler.is_scheduled(job_id):
+        await bot.scheduler.schedule(job_id, "watch", state, delay, replace)
+    elif replace and (job_id in bot.scheduler.running or delay < bot.scheduler.time_left(job_id)):
+        await bot.scheduler.schedule(job_id, "watch", state, delay)
+
+
+async def watch_func(bot, job_id: str, state: dict) -> float | None:
+    """Watch func (a scheduler job per battle): polls the battle once, and pings every subscribed channel
+    t minutes before the end of each round."""
+    if "subs" not in state:  # a job of a single channel, from before the jobs were shared
+        await schedule_watch(bot, state)
+        return None
+    link, subs = state["link"], state["subs"]
+    api_battles = await utils.get_content(link.replace("battle", "apiBattles").replace("id", "battleId"))
+    is_over = 8 in (api_battles['defenderScore'], api_battles['attackerScore']) or api_battles['frozen']
     find_watch = await utils.find_one("collection", "watch") or {"watch": []}
-    for watch_dict in list(find_watch["watch"]):
-        if watch_dict["link"] != link or watch_dict["channel_id"] != channel_id:
-            continue
-        if (8 in (api_battles['defenderScore'], api_battles['attackerScore'])
-                or watch_dict.get("removed")
-                or api_battles['frozen']):
-            find_watch["watch"].remove(watch_dict)
-        else:
-            watch_dict["sides"] = f"{defender} vs {attacker}"
-            watch_dict["score"] = f"{api_battles['defenderScore']}:{api_battles['attackerScore']}"
-            should_break = False  # If not all battles are over, don't break
-
-    await utils.replace_one("collection", "watch", find_watch)
-    return should_break
-
-
-async def watch_func(bot, channel: TextChannel, link: str, t: float, role: str, custom: str,
-                     author_id: int = 0) -> None:
-    """Watch func."""
-    for _ in range(20):  # Max rounds: 15, plus option for some freeze/delay
-        api_battles = await utils.get_content(link.replace("battle", "apiBattles").replace("id", "battleId"))
-
-        for _ in range(3):  # allow some delays from e-sim
-            h, m, s = api_battles["hoursRemaining"], api_battles["minutesRemaining"], api_battles["secondsRemaining"]
-            sleep_time = h * 3600 + m * 60 + s - t * 60
-            if sleep_time < 30:
-                break  # If less than 30 seconds left, don't sleep again
-            await sleep(max(0, sleep_time))
-
-            # check again, in case e-sim froze the battle / delayed it
-            api_battles = await utils.get_content(
-                link.replace("battle", "apiBattles").replace("id", "battleId"))
-
-        if await watch_should_break(link, channel.id, api_battles):
-            break
-
+    active = {watch_key(x) for x in find_watch["watch"] if x["link"] == link and not x.get("removed")}
+    for key, sub in list(subs.items()):
+        # Max rounds: 15, plus option for some freeze/delay
+        if is_over or key not in active or sub["rounds"] >= 20 or not bot.get_channel(sub["channel_id"]):
+            del subs[key]
+    await update_watch_doc(link, subs, api_battles)
+    if not subs:
+        return None
+
+    h, m, s = api_battles["hoursRemaining"], api_battles["minutesRemaining"], api_battles["secondsRemaining"]
+    remaining = h * 3600 + m * 60 + s
+    current_round = api_battles["currentRound"]
+    pending = [sub for sub in subs.values() if sub["round"] != current_round]
+    # If less than 30 seconds left, don't sleep again (and allow some delays from e-sim)
+    due = [sub for sub in pending if remaining - sub["t"] * 60 < 30]
+    if due:
         attacker, defender = utils.get_sides(api_battles)
         api_fights_link = link.replace("battle", "apiFights").replace(
-            "id", "battleId") + f"&roundId={api_battles['currentRound']}"
+            "id", "battleId") + f"&roundId={current_round}"
         my_dict, hit_time = await utils.save_dmg_time(api_fights_link, attacker, defender)
-        output_buffer = await utils.dmg_trend(hit_time, link.split("//")[1].split(".e-sim.org")[0],
-                                              f'{link.split("=")[1].split("&")[0]}-{api_battles["currentRound"]}')
+        image = (await utils.dmg_trend(hit_time, link.split("//")[1].split(".e-sim.org")[0],
+                                       f'{link.split("=")[1].split("&")[0]}-{current_round}')).getvalue()
         hit_time.clear()
-        msg = f"{role} {custom}"
-        embed = Embed(colour=0x3D85C6,
-                      title=f"T{t}, **Score:** {api_battles['defenderScore']}:{api_battles['attackerScore']}", url=link)
-        embed.add_field(name=f"{utils.get_flag_code(defender)}" + utils.shorten_country(defender),
-                        value=f"{my_dict[defender]:,}")
-        embed.add_field(name=f'Battle type: {api_battles["type"].replace("_", " ").title()}',
-                        value=utils.bar(my_dict[defender], my_dict[attacker], defender, attacker))
-        embed.add_field(name=f"{utils.get_flag_code(attacker)} " + utils.shorten_country(attacker),
-                        value=f"{my_dict[attacker]:,}")
-        embed.set_thumbnail(url=f"attachment://{channel.id}.png")
-        embed.set_footer(text="If you want to stop watching this battle, type /unwatch")
-        delete_after = api_battles["hoursRemaining"] * 3600 + api_battles["minutesRemaining"] * 60 + api_battles[
-            "secondsRemaining"]
-
-        try:
-            await channel.send(msg, embed=await utils.convert_embed(author_id, embed),
-                               file=File(fp=output_buffer, filename=f"{channel.id}.png"), delete_after=delete_after)
-        except Exception:
-            return await bot.get_command("unwatch").__call__(channel, link)
-        await sleep(t * 60 + 150)
-
-
-async def watch_auction_func(channel: TextChannel, link: str, t: float, custom_msg: str,
-                             author_id: int = 0) -> None:
-    """Activate watch/auction function."""
+        for sub in due:
+            sub["round"] = current_round
+            sub["rounds"] += 1
+            if not await send_watch(bot, sub, api_battles, my_dict, image, remaining):
+                del subs[watch_key(sub)]
+        pending = [sub for sub in pending if sub not in due]
+    if pending:
+        return min(remaining - sub["t"] * 60 for sub in pending)
+    return remaining + 150 if subs else None
+
+
+async def send_watch(bot, sub: dict, api_battles: dict, my_dict: dict, image: bytes, remaining: int) -> bool:
+    """Sends the round state (score and wall) to a subscribed channel. Returns False if it was unwatched."""
+    channel = bot.get_channel(sub["channel_id"])
+    attacker, defender = utils.get_sides(api_battles)
+    msg = f"{sub['role']} {sub['custom']}"
+    embed = Embed(colour=0x3D85C6, url=sub["link"],
+                  title=f"T{sub['t']}, **Score:** {api_battles['defenderScore']}:{api_battles['attackerScore']}")
+    embed.add_field(name=f"{utils.get_flag_code(defender)}" + utils.shorten_country(defender),
+                    value=f"{my_dict[defender]:,}")
+    embed.add_field(name=f'Battle type: {api_battles["type"].replace("_", " ").title()}',
+                    value=utils.bar(my_dict[defender], my_dict[attacker], defender, attacker))
+    embed.add_field(name=f"{utils.get_flag_code(attacker)} " + utils.shorten_country(attacker),
+                    value=f"{my_dict[attacker]:,}")
+    embed.set_footer(text="If you want to stop watching this battle, type /unwatch")
+    if not await bot.notifier.send(channel, msg, await utils.convert_embed(sub["author_id"], embed),
+                                   image=image, delete_after=remaining):
+        await bot.get_command("unwatch").__call__(channel, sub["link"])
+        return False
+    return True
+
+
+async def schedule_auction(bot, auction_dict: dict, delay: float = 0, replace: bool = True) -> None:
+    """Schedule the job of a watched auction."""
+    job_id = f"auction {auction_dict['channel_id']} {auction_dict['link']}"
+    await bot.scheduler.schedule(job_id, "auction", dict(auction_dict, notify=False), delay, replace)
+
+
+async def watch_auction_func(bot, job_id: str, state: dict) -> float | None:
+    """Watch auction func (a scheduler job per auction): pings t minutes before it ends."""
+    link, t = state["link"], state["t"]
+    channel = bot.get_channel(state["channel_id"])
+    if channel is None:
+        return await remove_auction(link, state["channel_id"])
     row = await utils.get_auction(link)
+    if not state["notify"]:
+        if row["remaining_seconds"] < 0:
+            return await remove_auction(link, channel.id)
+        state["notify"] = True
+        return row["remaining_seconds"] - t * 60
 
-    if row["remaining_seconds"] < 0:
-        return await remove_auction(link, channel.id)
-
-    await sleep(row["remaining_seconds"] - t * 60)
-    if not row.get("removed"):
-        row = await utils.get_auction(link)
-
-        embed = Embed(colour=0x3D85C6, title=link,
-                      description=f"**__Parameters__:**\n**T**: {t}\n\n**Custom msg**: " + (
-                          f"{custom_msg}" if custom_msg else "None"))
-        embed.add_field(name="Info", value="\n".join(f"**{k.title()}:** {v}" for k, v in row.items()))
-
+    find_auctions = await utils.find_one("collection", "auctions") or {"auctions": []}
+    if any(auction_dict["link"] == link and auction_dict["channel_id"] == channel.id
+           and not auction_dict.get("removed") for auction_dict in find_auctions["auctions"]):
         embed = Embed(colour=0x3D85C6, title=link)
         embed.add_field(name="Info", value="\n".join(f"**{k.title()}:** {v}" for k, v in row.items()))
-        await channel.send(custom_msg, embed=await utils.convert_embed(author_id, embed))
+        await bot.notifier.send(channel, state["custom"], await utils.convert_embed(state["author_id"], embed))
     return await remove_auction(link, channel.id)
 
 
 async def remove_auction(link: str, channel_id: int) -> None:
     """Removes auction."""
-    find_auctions = await utils.find_one("collection", "auctions") or {"auctions": []}
-    for auction_dict in list(find_auctions["auctions"]):
-        if auction_dict["link"] == link and auction_dict["channel_id"] == channel_id:
-            find_auctions["auctions"].remove(auction_dict)
-    await utils.replace_one("collection", "auctions", find_auctions)
+    async with utils.edit("collection", "auctions") as find_auctions:
+        for auction_dict in list(find_auctions.setdefault("auctions", [])):
+            if auction_dict["link"] == link and auction_dict["channel_id"] == channel_id:
+                find_auctions["auctions"].remove(auction_dict)
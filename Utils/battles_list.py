@@ -0,0 +1,85 @@
+"""One snapshot of the battles list (battles.html) per server, shared by ping, nexts and the other consumers."""
+import asyncio
+import logging
+from time import time
+
+from discord.ext import tasks
+
+from . import utils
+
+logger = logging.getLogger()
+# The lists that were requested in the last battles_list_ttl seconds are refreshed every battles_list_interval seconds
+battles_list_interval = 60
+battles_list_ttl = 900
+
+
+class BattlesList:
+    """The parsed battles list of a server.
+
+    The consumers keep the round of each battle they follow: the round was closed if the battle is gone,
+    or its round changed.
+    """
+
+    def __init__(self, server: str, battles: list[dict]) -> None:
+        self.server = server
+        self.fetched_at = time()
+        self.battles = {battle["battle_id"]: battle for battle in battles}
+        for battle in battles:
+            battle["round"] = battle["defender"]["score"] + battle["attacker"]["score"] + 1
+
+    def seconds_left(self, battle: dict) -> float:
+        """Seconds until the end of the current round (now, not when it was fetched)."""
+        h, m, s = map(int, battle["time_remaining"].split(":"))
+        return h * 3600 + m * 60 + s - (time() - self.fetched_at)
+
+    def get_battles(self, country: str = "") -> list[dict]:
+        """The battles (of the given country, if any), by time remaining."""
+        battles = self.battles.values()
+        if country:
+            battles = [x for x in battles if
+                       country.lower() in (x['defender']['name'].lower(), x['attacker']['name'].lower())]
+        return sorted(battles, key=lambda k: k['time_remaining'])
+
+
+snapshots: dict[str, BattlesList] = {}
+requested: dict[str, float] = {}
+refreshing: dict[str, asyncio.Task] = {}
+
+
+async def refresh(server: str) -> BattlesList:
+    """Scrape and parse the list once, even if many consumers are waiting for it."""
+    if server not in refreshing:
+        refreshing[server] = asyncio.create_task(utils.get_battles(f"https://{server}.e-sim.org/"))
+    try:
+        battles = await asyncio.shield(refreshing[server])
+    finally:
+        refreshing.pop(server, None)
+    if server not in snapshots or snapshots[server].fetched_at < time() - 1:
+        snapshots[server] = BattlesList(server, battles)
+    return snapshots[server]
+
+
+async def get(server: str, max_age: float = battles_list_interval) -> BattlesList:
+    """The battles list of the server, refreshed if it's older than max_age seconds.
+
+    Asking for a server keeps its list refreshed by refresh_battles_lists for a while.
+    """
+    requested[server] = time()
+    snapshot = snapshots.get(server)
+    if snapshot is None or time() - snapshot.fetched_at > max_age:
+        snapshot = await refresh(server)
+    return snapshot
+
+
+@tasks.loop(seconds=battles_list_interval)
+async def refresh_battles_lists() -> None:
+    """Refresh the lists that were requested lately (so the consumers rarely wait for a scrape)."""
+    for server, last_request in list(requested.items()):
+        if time() - last_request > battles_list_ttl:
+            del requested[server]
+            snapshots.pop(server, None)
+            continue
+        try:
+            await refresh(server)
+        except Exception as error:
+            logger.warning(f"battles_list: failed to refresh {server=}: {error}")
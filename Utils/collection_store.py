@@ -0,0 +1,533 @@
+"""Collection documents (find_one / replace_one), stored in files or in SQLite, with the hot ones in memory.
+
+Switching to SQLite (stop the bot and update_db first):
+    python -m Utils.collection_store import [db_dir]
+Size and load/save time of the documents as JSON and as msgpack:
+    python -m Utils.collection_store report [db_dir]
+Comparing the backends and codecs:
+    python -m Utils.collection_store benchmark
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from glob import glob
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from time import perf_counter
+from typing import AsyncIterator, Awaitable, Callable
+
+import msgpack
+
+logger = logging.getLogger()
+sqlite_filename = "collections.sqlite"
+# The collections in db/, longest first (the file names are {collection}_{_id}.json, and both may contain "_")
+known_collections = ("time_online", "collection", "buffs", "price", "mm")
+
+
+# Documents that are stored as msgpack (smaller, and faster to load and save than JSON).
+# "{collection}" or "{collection}_{_id}". Unlike JSON, msgpack keeps non-string keys as they are, so only
+# documents with string keys should be listed.
+default_msgpack_collections = ("buffs", "time_online", "price", "collection_commands_count")
+codecs = ("json", "msgpack")
+
+
+def dumps(data, codec: str) -> bytes:
+    return msgpack.packb(data) if codec == "msgpack" else json.dumps(data).encode()
+
+
+def loads(raw: bytes | str, codec: str):
+    return msgpack.unpackb(raw, strict_map_key=False) if codec == "msgpack" else json.loads(raw)
+
+
+def write_file(filename: str, content: bytes) -> None:
+    """Write through a temporary file and rename it, so readers (in any process) never see a half written file."""
+    with NamedTemporaryFile("wb", dir=os.path.dirname(filename), prefix=os.path.basename(filename), suffix=".tmp",
+                            delete=False) as file:
+        file.write(content)
+    try:
+        os.replace(file.name, filename)
+    except OSError:
+        os.remove(file.name)
+        raise
+
+
+def json_key(key) -> str:
+    """A dict key, as json.dumps writes it."""
+    return key if isinstance(key, str) else json.dumps(key)
+
+
+def loads_rows(rows: list) -> dict:
+    """{key: value} of (key, encoded value) rows."""
+    if all(isinstance(row[1], str) for row in rows):  # parse all the JSON values at once (much faster)
+        return dict(zip((row[0] for row in rows), json.loads(f"[{','.join(row[1] for row in rows)}]")))
+    return {row[0]: loads(row[1], "json" if isinstance(row[1], str) else "msgpack") for row in rows}
+
+
+class FileBackend:
+    """A file per document: db/{collection}_{_id}.json or .msgpack (for the msgpack collections).
+
+    Reading takes whichever of them exists (the newer, if both do), and writing removes the other one,
+    so documents move between the codecs on their next write.
+    """
+
+    def __init__(self, db_dir: str, msgpack_collections: iter = default_msgpack_collections) -> None:
+        self.db_dir = db_dir
+        self.msgpack_collections = set(msgpack_collections)
+
+    def get_codec(self, collection: str, _id: str) -> str:
+        return "msgpack" if {collection, f"{collection}_{_id}"} & self.msgpack_collections else "json"
+
+    def get_filename(self, collection: str, _id: str, codec: str) -> str:
+        return os.path.join(self.db_dir, f"{collection}_{_id}.{codec}")
+
+    def read(self, collection: str, _id: str) -> dict:
+        filenames = {codec: filename for codec in codecs
+                     if os.path.exists(filename := self.get_filename(collection, _id, codec))}
+        if not filenames:
+            return {}
+        codec = max(filenames, key=lambda c: os.path.getmtime(filenames[c]))
+        with open(filenames[codec], "rb") as file:
+            raw = file.read()
+        return loads(raw, codec) if raw else {}
+
+    def get_version(self, collection: str, _id: str) -> tuple:
+        """Changes whenever the document is written (by any process)."""
+        version = []
+        for codec in codecs:
+            try:
+                stat = os.stat(self.get_filename(collection, _id, codec))
+                version.append((codec, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                pass
+        return tuple(version)
+
+    def write(self, collection: str, _id: str, data: dict) -> None:
+        codec = self.get_codec(collection, _id)
+        write_file(self.get_filename(collection, _id, codec), dumps(data, codec))
+        for other_codec in codecs:
+            if other_codec != codec and os.path.exists(filename := self.get_filename(collection, _id, other_codec)):
+                os.remove(filename)
+
+    def read_keys(self, collection: str, _id: str, keys: iter) -> dict:
+        document = self.read(collection, _id)
+        return {key: document[key] for key in map(json_key, keys) if key in document}
+
+    def update_keys(self, collection: str, _id: str, data: dict, removed: iter = ()) -> None:
+        document = self.read(collection, _id)
+        document.update((json_key(k), v) for k, v in data.items())
+        for key in removed:
+            document.pop(json_key(key), None)
+        self.write(collection, _id, document)
+
+
+class SqliteBackend:
+    """A row per top level key of each document, so reading or updating a few keys doesn't touch the rest.
+
+    Values are JSON text, or msgpack blobs for the msgpack collections (rows written with the other codec are
+    still read, and re-encoded on their next write).
+    Each document has a version in the versions table, which every write that changes it increments.
+    WAL mode lets the bot read while update_db writes.
+    """
+
+    def __init__(self, filename: str, msgpack_collections: iter = default_msgpack_collections) -> None:
+        self.msgpack_collections = set(msgpack_collections)
+        self.connection = sqlite3.connect(filename, timeout=30, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()  # the store calls it from the executor's threads
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                collection TEXT NOT NULL,
+                _id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                value NOT NULL,
+                PRIMARY KEY (collection, _id, key))""")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS versions (
+                collection TEXT NOT NULL,
+                _id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                PRIMARY KEY (collection, _id))""")
+
+    def get_encoder(self, collection: str, _id: str) -> callable:
+        if {collection, f"{collection}_{_id}"} & self.msgpack_collections:
+            return msgpack.packb
+        return json.dumps
+
+    def get_version(self, collection: str, _id: str) -> int:
+        """Changes whenever the document is written (by any process), and only then."""
+        with self.lock:
+            row = self.connection.execute("SELECT version FROM versions WHERE collection = ? AND _id = ?",
+                                          (collection, _id)).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, collection: str, _id: str) -> None:
+        """Increment the version of the document (inside the write's transaction)."""
+        self.connection.execute("INSERT INTO versions VALUES (?, ?, 1) ON CONFLICT (collection, _id) "
+                                "DO UPDATE SET version = version + 1", (collection, _id))
+
+    def read(self, collection: str, _id: str) -> dict:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, value FROM documents WHERE collection = ? AND _id = ? ORDER BY position",
+                (collection, _id)).fetchall()
+        return loads_rows(rows)
+
+    def read_keys(self, collection: str, _id: str, keys: iter) -> dict:
+        keys = list(map(json_key, keys))
+        rows = []
+        with self.lock:
+            for i in range(0, len(keys), 500):  # SQLite's limit of variables per query
+                chunk = keys[i:i + 500]
+                rows.extend(self.connection.execute(
+                    f"SELECT key, value, position FROM documents WHERE collection = ? AND _id = ? "
+                    f"AND key IN ({','.join('?' * len(chunk))})", (collection, _id, *chunk)).fetchall())
+        return loads_rows(sorted(rows, key=lambda row: row[2]))
+
+    def write(self, collection: str, _id: str, data: dict) -> None:
+        """Replace the document, writing only the keys that changed."""
+        encode = self.get_encoder(collection, _id)
+        new_rows = {json_key(k): (position, encode(v)) for position, (k, v) in enumerate(data.items())}
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                old_rows = {key: (position, value) for key, position, value in self.connection.execute(
+                    "SELECT key, position, value FROM documents WHERE collection = ? AND _id = ?",
+                    (collection, _id))}
+                removed = [(collection, _id, key) for key in old_rows.keys() - new_rows.keys()]
+                changed = [(collection, _id, key, position, value) for key, (position, value) in new_rows.items()
+                           if old_rows.get(key) != (position, value)]
+                self.connection.executemany(
+                    "DELETE FROM documents WHERE collection = ? AND _id = ? AND key = ?", removed)
+                self.connection.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)", changed)
+                if removed or changed:
+                    self.bump_version(collection, _id)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def update_keys(self, collection: str, _id: str, data: dict, removed: iter = ()) -> None:
+        """Set (or add, at the end) the given keys, and remove the `removed` ones."""
+        encode = self.get_encoder(collection, _id)
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany(
+                    "DELETE FROM documents WHERE collection = ? AND _id = ? AND key = ?",
+                    [(collection, _id, json_key(key)) for key in removed])
+                next_position = self.connection.execute(
+                    "SELECT COALESCE(MAX(position), -1) + 1 FROM documents WHERE collection = ? AND _id = ?",
+                    (collection, _id)).fetchone()[0]
+                self.connection.executemany(
+                    "INSERT INTO documents VALUES (?, ?, ?, ?, ?) ON CONFLICT (collection, _id, key) "
+                    "DO UPDATE SET value = excluded.value",
+                    [(collection, _id, json_key(k), next_position + i, encode(v))
+                     for i, (k, v) in enumerate(data.items())])
+                self.bump_version(collection, _id)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def get_backend(db_dir: str, msgpack_collections: iter = default_msgpack_collections) -> FileBackend | SqliteBackend:
+    """SQLite once the files were imported into it, files otherwise."""
+    filename = os.path.join(db_dir, sqlite_filename)
+    if os.path.exists(filename):
+        return SqliteBackend(filename, msgpack_collections)
+    return FileBackend(db_dir, msgpack_collections)
+
+
+class Snapshot:
+    """A document that is parsed once and shared by all the commands until it changes, so treat it as read only."""
+
+    def __init__(self, data: dict, version) -> None:
+        self.data = data
+        self.version = version
+        self.indexes = {}
+
+    def get_index(self, build: callable):
+        """build(data), computed once per snapshot (e.g. a lookup table, or parsed dates)."""
+        if build not in self.indexes:
+            self.indexes[build] = build(self.data)
+        return self.indexes[build]
+
+
+class CollectionStore:
+    """find_one / replace_one (and find_keys / update_keys) over the backend.
+
+    Documents of the `cached` collections are kept in memory (as their JSON text, so every find_one returns a
+    fresh copy, just like reading the file), and the dirty ones are written every `flush_interval` seconds.
+    Only collections that no other process writes should be cached (update_db writes buffs, time_online, mm and
+    price), the others are read from and written to the backend on every call.
+    Writes to the same collection are serialized with a lock.
+    """
+
+    def __init__(self, db_dir: str, cached: iter = (), flush_interval: float = 5,
+                 msgpack_collections: iter = default_msgpack_collections,
+                 backend: FileBackend | SqliteBackend = None) -> None:
+        self.backend = backend or get_backend(db_dir, msgpack_collections)
+        self.cached = set(cached)
+        self.flush_interval = flush_interval
+        self.documents: dict[tuple[str, str], str] = {}  # (collection, _id) -> JSON text
+        self.dirty = set()
+        self.locks = defaultdict(asyncio.Lock)
+        self.editing: dict[str, asyncio.Task] = {}  # collection -> the task inside its edit block
+        self.flush_task = None
+        self.snapshots: dict[tuple[str, str], Snapshot] = {}
+        self.snapshot_locks = defaultdict(asyncio.Lock)
+        self.listeners = defaultdict(list)  # collection -> [async listener(_id)]
+        self.listener_tasks = set()
+
+    def on_replace(self, collection: str, listener: Callable[[str], Awaitable]) -> None:
+        """Run listener(_id) in the background after every replace_one of the collection (in this process)."""
+        self.listeners[collection].append(listener)
+
+    def load(self, collection: str, _id: str) -> dict:
+        """Sync find_one (for startup, before the loop is running)."""
+        if collection not in self.cached:
+            return self.backend.read(collection, _id)
+        key = (collection, _id)
+        if key not in self.documents:
+            self.documents[key] = json.dumps(self.backend.read(collection, _id))
+        return json.loads(self.documents[key])
+
+    async def find_one(self, collection: str, _id: str) -> dict:
+        """The document, or {} if there isn't one."""
+        return self.load(collection, _id)
+
+    async def get_snapshot(self, collection: str, _id: str) -> Snapshot:
+        """The shared snapshot of the document (re-read only if it was written since the last call).
+
+        Checking the version costs a stat (or a one row query with SQLite), instead of reading and parsing the
+        document.
+        """
+        key = (collection, _id)
+        snapshot = self.snapshots.get(key)
+        if snapshot is not None and snapshot.version == self.get_version(collection, _id):
+            return snapshot
+        async with self.snapshot_locks[key]:  # commands that ask for it meanwhile wait for this read
+            version = self.get_version(collection, _id)
+            snapshot = self.snapshots.get(key)
+            if snapshot is None or snapshot.version != version:
+                if collection in self.cached:
+                    data = self.load(collection, _id)
+                else:
+                    data = await asyncio.get_running_loop().run_in_executor(
+                        None, self.backend.read, collection, _id)
+                snapshot = self.snapshots[key] = Snapshot(data, version)
+        return snapshot
+
+    def get_version(self, collection: str, _id: str):
+        if collection in self.cached:
+            self.load(collection, _id)
+            return self.documents[(collection, _id)]  # replaced (by another str) on every write
+        return self.backend.get_version(collection, _id)
+
+    async def replace_one(self, collection: str, _id: str, data: dict) -> None:
+        """Replace the document (the cached ones are written in the background)."""
+        self.check_not_editing(collection)
+        async with self.locks[collection]:
+            await self.write(collection, _id, data)
+        self.notify(collection, _id)
+
+    @asynccontextmanager
+    async def edit(self, collection: str, _id: str) -> AsyncIterator[dict]:
+        """Read, modify and replace the document, with no other write to the collection in between:
+
+            async with store.edit("collection", "ping") as data:
+                data.pop(ping_id, None)
+
+        It's written when the block ends (unless it raises). Writing to the same collection inside the block
+        raises RuntimeError (it would wait for the block forever).
+        """
+        self.check_not_editing(collection)
+        async with self.locks[collection]:
+            if collection in self.cached:
+                data = self.load(collection, _id)
+            else:
+                data = await asyncio.get_running_loop().run_in_executor(None, self.backend.read, collection, _id)
+            self.editing[collection] = asyncio.current_task()
+            try:
+                yield data
+            finally:
+                del self.editing[collection]
+            await self.write(collection, _id, data)
+        self.notify(collection, _id)
+
+    def check_not_editing(self, collection: str) -> None:
+        """Raise if the current task is inside an edit block of the collection (instead of a deadlock)."""
+        if self.editing.get(collection) is asyncio.current_task():
+            raise RuntimeError(f"collection_store: {collection} was written inside its own edit block")
+
+    async def write(self, collection: str, _id: str, data: dict) -> None:
+        """Replace the document (the caller holds the lock of the collection)."""
+        if collection in self.cached:
+            self.documents[(collection, _id)] = json.dumps(data)
+            self.dirty.add((collection, _id))
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.backend.write, collection, _id, data)
+
+    def notify(self, collection: str, _id: str) -> None:
+        """Run the on_replace listeners of the collection."""
+        for listener in self.listeners[collection]:
+            task = asyncio.create_task(listener(_id))
+            self.listener_tasks.add(task)
+            task.add_done_callback(self.listener_tasks.discard)
+
+    async def find_keys(self, collection: str, _id: str, keys: iter) -> dict:
+        """The given keys of the document (the missing ones are skipped)."""
+        if collection in self.cached:
+            document = self.load(collection, _id)
+            return {key: document[key] for key in map(json_key, keys) if key in document}
+        return await asyncio.to_thread(self.backend.read_keys, collection, _id, list(keys))
+
+    async def update_keys(self, collection: str, _id: str, data: dict, removed: iter = ()) -> None:
+        """Set the given keys of the document, and remove the `removed` ones."""
+        self.check_not_editing(collection)
+        async with self.locks[collection]:
+            if collection in self.cached:
+                document = self.load(collection, _id)
+                document.update((json_key(k), v) for k, v in data.items())
+                for key in removed:
+                    document.pop(json_key(key), None)
+                self.documents[(collection, _id)] = json.dumps(document)
+                self.dirty.add((collection, _id))
+            else:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.backend.update_keys, collection, _id, data, tuple(removed))
+
+    async def flush(self) -> None:
+        """Write the dirty documents."""
+        loop = asyncio.get_running_loop()
+        for collection, _id in sorted(self.dirty):
+            async with self.locks[collection]:
+                self.dirty.discard((collection, _id))
+                try:
+                    await loop.run_in_executor(None, self.backend.write, collection, _id,
+                                               json.loads(self.documents[(collection, _id)]))
+                except Exception as error:
+                    self.dirty.add((collection, _id))  # retry on the next flush
+                    logger.error(f"collection_store: failed to write {collection}_{_id}: {error}")
+
+    async def flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        """Start writing the dirty documents in the background."""
+        if self.cached and self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_loop())
+
+    async def close(self) -> None:
+        """Stop the background writes, and write what's left."""
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+
+
+def split_filename(filename: str) -> tuple[str, str] | None:
+    """(collection, _id) of db/{collection}_{_id}.json (or .msgpack), or None if it's not a known collection."""
+    name = os.path.splitext(os.path.basename(filename))[0]
+    for collection in known_collections:
+        if name.startswith(collection + "_"):
+            return collection, name[len(collection) + 1:]
+    return None
+
+
+def get_documents(db_dir: str) -> list[tuple[str, str]]:
+    """(collection, _id) of the documents in the files of db_dir."""
+    documents = set()
+    for filename in glob(os.path.join(db_dir, "*.json")) + glob(os.path.join(db_dir, "*.msgpack")):
+        if collection_id := split_filename(filename):
+            documents.add(collection_id)
+        else:
+            print(f"skipped {filename}")
+    return sorted(documents)
+
+
+def import_files(db_dir: str) -> None:
+    """Copy the documents into db/collections.sqlite (the files are left as they are)."""
+    temp_filename = os.path.join(db_dir, sqlite_filename) + ".tmp"
+    if os.path.exists(temp_filename):  # left by a failed import
+        os.remove(temp_filename)
+    backend = SqliteBackend(temp_filename)
+    file_backend = FileBackend(db_dir)
+    for collection_id in get_documents(db_dir):
+        backend.write(*collection_id, file_backend.read(*collection_id))
+        print(f"imported {'_'.join(collection_id)}")
+    backend.close()
+    os.replace(temp_filename, os.path.join(db_dir, sqlite_filename))
+
+
+def time_ms(func: callable, repeat: int) -> float:
+    start = perf_counter()
+    for _ in range(repeat):
+        func()
+    return (perf_counter() - start) / repeat * 1000
+
+
+def report(db_dir: str, repeat: int = 5) -> None:
+    """Size and encode/decode time of each document in the files of db_dir, as JSON and as msgpack."""
+    file_backend = FileBackend(db_dir)
+    print(f"{'document':<40}{'json KB':>10}{'msgpack KB':>12}{'json load':>11}{'msgpack load':>14}"
+          f"{'json save':>11}{'msgpack save':>14}  (ms)")
+    for collection, _id in get_documents(db_dir):
+        data = file_backend.read(collection, _id)
+        raw = {codec: dumps(data, codec) for codec in codecs}
+        sizes = [len(raw[codec]) / 1024 for codec in codecs]
+        load_times = [time_ms(lambda: loads(raw[codec], codec), repeat) for codec in codecs]
+        save_times = [time_ms(lambda: dumps(data, codec), repeat) for codec in codecs]
+        print(f"{collection + '_' + _id:<40}{sizes[0]:>10.1f}{sizes[1]:>12.1f}{load_times[0]:>11.2f}"
+              f"{load_times[1]:>14.2f}{save_times[0]:>11.2f}{save_times[1]:>14.2f}")
+
+
+def benchmark(players: int = 20000, repeat: int = 20) -> None:
+    """Time typical operations on a buffs-like document, with both backends and both codecs."""
+    document = {f"player{i}": [f"2024-01-{i % 28 + 1:02d} 10:00:00", "", i, i % 2 == 0, "BULLETS"]
+                for i in range(players)}
+    operations = {
+        "replace_one (all keys)": lambda b: b.write("buffs", "alpha", document),
+        "find_one": lambda b: b.read("buffs", "alpha"),
+        "replace_one (1 key changed)": lambda b: b.write(
+            "buffs", "alpha", document | {"player1": ["x", "", 0, False, ""]}),
+        "find_keys (10 keys)": lambda b: b.read_keys("buffs", "alpha", [f"player{i}" for i in range(0, 1000, 100)]),
+        "update_keys (10 keys)": lambda b: b.update_keys(
+            "buffs", "alpha", {f"player{i}": ["y", "", 1, True, ""] for i in range(0, 1000, 100)}),
+    }
+    with TemporaryDirectory() as json_dir, TemporaryDirectory() as msgpack_dir:
+        backends = {"files/json": FileBackend(json_dir, ()),
+                    "files/msgpack": FileBackend(msgpack_dir, ("buffs",)),
+                    "sqlite/json": SqliteBackend(os.path.join(json_dir, sqlite_filename), ()),
+                    "sqlite/msgpack": SqliteBackend(os.path.join(msgpack_dir, sqlite_filename), ("buffs",))}
+        print(f"{'operation (ms)':<30}" + "".join(f"{name:>16}" for name in backends))
+        for name, operation in operations.items():
+            print(f"{name:<30}" + "".join(f"{time_ms(lambda: operation(backend), repeat):>16.2f}"
+                                          for backend in backends.values()))
+        for backend in backends.values():
+            if isinstance(backend, SqliteBackend):
+                backend.close()
+
+
+if __name__ == "__main__":
+    default_db_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "db")
+    if sys.argv[1:2] == ["import"]:
+        import_files(sys.argv[2] if len(sys.argv) > 2 else default_db_dir)
+    elif sys.argv[1:2] == ["report"]:
+        report(sys.argv[2] if len(sys.argv) > 2 else default_db_dir)
+    elif sys.argv[1:2] == ["benchmark"]:
+        benchmark()
+    else:
+        print(__doc__)
@@ -1,14 +1,13 @@
 from collections import defaultdict
 from copy import deepcopy
-from csv import writer
-from io import BytesIO, StringIO
 
 from discord import Embed, File, Interaction
 from discord.app_commands import Transform
 from discord.utils import MISSING
 
-from . import utils, UiButtons
+from . import dmg_stats_utils, utils, UiButtons
 from .constants import all_countries, all_countries_by_name
+from .export_utils import CsvExport
 from .transformers import BattleLink, Country
 from .utils import dmg_trend, draw_pil_table
 
@@ -103,65 +102,37 @@ async def dmg_func(bot, interaction: Interaction, battle_link: Transform[dict, B
                 last = api_battles['currentRound']
             else:
                 last = api_battles['currentRound'] + 1
+            rounds = []
             for round_i in range(1, last):
-                defender_details = defaultdict(lambda: {'weps': [0, 0, 0, 0, 0, 0], 'dmg': 0})
-                attacker_details = defaultdict(lambda: {'weps': [0, 0, 0, 0, 0, 0], 'dmg': 0})
                 round_s = f'&roundId={round_i}' if calculate_tops else ''
-                for hit in reversed(
-                        await utils.get_content(f'{base_url}apiFights.html?battleId={battle_id}{round_s}')):
-                    side_string = defender if hit['defenderSide'] else attacker
-                    update_hit_dmg(hit, stats_per_entity, range_of_battles, key, side_string)
-                    update_hit_time(hit, hit_time, side_string)
-
-                    if key == 'citizenId':
-                        side = defender_details if hit['defenderSide'] else attacker_details
-                        side[hit['citizenId']]['weps'][hit['weapon']] += 5 if hit['berserk'] else 1
-                        side[hit['citizenId']]['dmg'] += hit['damage']
-
-                for side in (attacker_details, defender_details):
-                    side = sorted(side.items(), key=lambda x: x[1]['dmg'], reverse=True)
-                    for (name, value) in side:
-                        if "tops" not in stats_per_entity[name]:
-                            stats_per_entity[name]["tops"] = [0, 0, 0, 0]
-                        stats_per_entity[name]["tops"][3] += 1
-                        if (name, value) in side[:10]:
-                            stats_per_entity[name]["tops"][2] += 1
-                            if (name, value) in side[:3]:
-                                stats_per_entity[name]["tops"][1] += 1
-                                if (name, value) in side[:1]:
-                                    stats_per_entity[name]["tops"][0] += 1
-
+                rounds.append(await utils.get_content(f'{base_url}apiFights.html?battleId={battle_id}{round_s}'))
                 await utils.custom_delay(interaction)
+            merge_battle_dmg(stats_per_entity, hit_time, await bot.workers.run(
+                dmg_stats_utils.get_battle_dmg, rounds, key, defender, attacker, range_of_battles,
+                interaction=interaction, msg=msg))
 
     else:
         for index, battle_id in enumerate(range(battle_id, last_battle + 1)):
             if range_of_battles:
                 msg = await utils.update_percent(index, last_battle - battle_id, msg)
-            hit = None
             api_fights = await utils.get_content(
                 f'{base_url}apiFights.html?battleId={battle_id}&roundId={round_id}')
-            for hit in reversed(api_fights):
-                side_string = defender if hit['defenderSide'] else attacker
-                update_hit_dmg(hit, stats_per_entity, range_of_battles, key, side_string)
-                if key in hit:
-                    # TODO: I am not sure what this is doing
-                    if (not range_of_battles) and (not key_id or hit[key] == key_id):
-                        name = nick if key_id else side_string
-                        update_hit_time(hit, hit_time, name)
-
-            if not hit and not range_of_battles:
+            if not api_fights and not range_of_battles:
                 await utils.custom_followup(
                     interaction,
                     f'Nothing found at <{base_url}apiFights.html?battleId={battle_id}&roundId={round_id}>')
                 return
+            merge_battle_dmg(stats_per_entity, hit_time, await bot.workers.run(
+                dmg_stats_utils.get_battle_dmg, [api_fights], key, defender, attacker, range_of_battles,
+                round_id, key_id, nick, interaction=interaction, msg=msg))
             if index > 0:
                 await utils.custom_delay(interaction)
 
     output_buffer = await dmg_trend(hit_time, server, battle_id if not round_id else f"{battle_id}-{round_id}")
     hit_time.clear()
     new_dict = defaultdict(int)
-    output = StringIO()
-    csv_writer = writer(output)
+    output = CsvExport()
+    csv_writer = output.writer
     row = [key, "dmg"] + [f"Q{x} wep" for x in range(6)]
     if calculate_tops:
         row.extend(["Top 1", "Top 3", "Top 10", "Total Participation"])
@@ -213,7 +184,6 @@ async def dmg_func(bot, interaction: Interaction, battle_link: Transform[dict, B
                     table.append(
                         [nick, f"{value['weps'][0]:,}", f"{value['weps'][1]:,}", f"{value['weps'][-1]:,}",
                          f"{value['dmg']:,}"])
-    output.seek(0)
     if not table:
         await utils.custom_followup(
             interaction,
@@ -232,7 +202,7 @@ async def dmg_func(bot, interaction: Interaction, battle_link: Transform[dict, B
             'Citizen Id': {'api_url': 'apiCitizenById', 'api_key': 'login', 'cs_key': 'citizenshipId',
                            'final_link': 'profile'}}
 
-    files = [File(fp=BytesIO(output.getvalue().encode()), filename="dmg.csv"),
+    files = [output.to_file("dmg.csv"),
              File(fp=output_buffer, filename=f"{interaction.id}.png")]
     view = UiButtons.Transform() if "Id" in embed_name else MISSING
     if len(table) == 1 and not range_of_battles:
@@ -251,11 +221,11 @@ async def dmg_func(bot, interaction: Interaction, battle_link: Transform[dict, B
                                           embed=await utils.convert_embed(interaction, deepcopy(embed)), view=view)
     else:
         embed.description = f'**Battle type: {api_battles["type"]}**'
-        output_buffer1 = await bot.loop.run_in_executor(None, draw_pil_table, table, headers)
+        output_buffer1 = await utils.render(draw_pil_table, table, headers, 0, True)
         msg = await utils.custom_followup(interaction,
                                           embed=await utils.convert_embed(interaction, deepcopy(embed)),
                                           files=[File(fp=output_buffer1,
-                                                      filename=f'{battle_id} {server}.jpg')] + files, view=view)
+                                                      filename=f'{battle_id} {server}.png')] + files, view=view)
     del stats_per_entity, table
     if "Id" not in embed_name:
         return
@@ -276,21 +246,16 @@ async def dmg_func(bot, interaction: Interaction, battle_link: Transform[dict, B
     await msg.edit(embed=await utils.convert_embed(interaction, embed), view=view)
 
 
-def update_hit_dmg(hit: dict, my_dict: dict, range_of_battles: bool, key: str, side_string: str) -> None:
-    wep = 5 if hit['berserk'] else 1
-    if not range_of_battles:
-        my_dict[side_string]['weps'][hit['weapon']] += wep
-        my_dict[side_string]['dmg'] += hit['damage']
-    my_dict['Total']['weps'][hit['weapon']] += wep
-    my_dict['Total']['dmg'] += hit['damage']
-    if key in hit:
-        my_dict[hit[key]]['weps'][hit['weapon']] += wep
-        my_dict[hit[key]]['dmg'] += hit['damage']
-
-
-def update_hit_time(hit: dict, hit_time: dict, side_string: str) -> None:
-    hit_time[side_string]["time"].append(utils.get_time(hit["time"]))
-    if hit_time[side_string]["dmg"]:
-        hit_time[side_string]["dmg"].append(hit_time[side_string]["dmg"][-1] + hit['damage'])
-    else:
-        hit_time[side_string]["dmg"].append(hit['damage'])
+def merge_battle_dmg(stats_per_entity: dict, hit_time: dict, battle_dmg: tuple[dict, dict]) -> None:
+    """Merge the results of dmg_stats_utils.get_battle_dmg into the totals."""
+    battle_stats, battle_hit_time = battle_dmg
+    for name, value in battle_stats.items():
+        entity = stats_per_entity[name]
+        entity['weps'] = [a + b for a, b in zip(entity['weps'], value['weps'])]
+        entity['dmg'] += value['dmg']
+        if "tops" in value:
+            entity["tops"] = [a + b for a, b in zip(entity.get("tops", [0, 0, 0, 0]), value["tops"])]
+    for name, value in battle_hit_time.items():
+        total_dmg = hit_time[name]["dmg"][-1] if hit_time[name]["dmg"] else 0
+        hit_time[name]["time"].extend(value["time"])
+        hit_time[name]["dmg"].extend(dmg + total_dmg for dmg in value["dmg"])
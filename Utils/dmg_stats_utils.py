@@ -0,0 +1,395 @@
+from collections import defaultdict
+from csv import reader
+from datetime import datetime
+from io import BytesIO, StringIO
+
+import numpy as np
+import pandas as pd
+
+from .constants import all_countries
+
+restore_battles_types = ('COUNTRY_TOURNAMENT', 'CUP_EVENT_BATTLE', 'MILITARY_UNIT_CUP_EVENT_BATTLE', 'TEAM_TOURNAMENT')
+slow_servers = ("primera", "secura", "suna")
+
+# Each player has 32 daily limit. With each limit he can hit 1 berserk, or 5 non berserks. He has 40% chance to not lose a limit while hitting.
+# Every 10 minutes (or every day in some servers), the player get 2 limits, up to 32. This is called a restore.
+# In restore_battle, the player gets extra 22 limits per round, but only if he dealt 30 hits before that round.
+# If the player used all his limits plus some more, it means he opened a medkit, which gives him 20 limits.
+seconds_in_10_minutes = 10 * 60
+health_limits = limits_per_restore = 2
+full_limits = 15 + 15 + health_limits
+medkit_limits = 10 + 10
+avoid = 0.4
+hits_per_limit = 5
+threshold = -10
+restore_battle_min_hits = 30
+# Larger ranges are calculated block after block, sized by the dmg_stats_memory_limit config: the first block by
+#  battle_memory_estimate (up to first_block_size battles), and the next ones by the memory of the previous blocks.
+first_block_size = 100
+battle_memory_estimate = 2 ** 20  # bytes of rounds and windows per battle
+
+
+def is_fast_server(server: str, fast_server: bool | None) -> bool:
+    """Fast server has limits restore, but sometimes also slow servers have it."""
+    return fast_server or (fast_server is None and server not in slow_servers)
+
+
+def get_medkits_and_restores(api_fights_df: pd.DataFrame, api_battles_df: pd.DataFrame, fast_server: bool,
+                             state: pd.DataFrame = None) -> tuple[pd.Series, pd.Series, pd.DataFrame]:
+    """Estimate the medkits used per player, and count his restores per day.
+
+    api_fights_df can be the hits, or their sum per citizenId, battle_id and 10 minutes window (in `time`),
+    since the limits can change only between windows.
+
+    A restore is a hit in a 10 minutes window [00:00-00:10, 00:10-00:20, ...] later than the window of his last hit.
+    Between two limits changes (day change, restore, restore battle), the limits only go down, so the medkits
+    opened in such a segment depend only on its limits at start and on the total limits it consumed.
+
+    state continues the players' limits from the previous battles (see get_block_stats), and can be None.
+    Returns (medkits per citizenId, restores per (citizenId, day), state after those battles).
+    """
+    battle_order = pd.Series(np.arange(len(api_battles_df)), index=api_battles_df['battle_id'].values)
+    hits_df = api_fights_df[['citizenId', 'battle_id', 'time']].copy()
+    hits_df['hits'] = api_fights_df['hits'] if 'hits' in api_fights_df else np.where(api_fights_df['berserk'], 5, 1)
+    hits_df['battle_order'] = hits_df['battle_id'].map(battle_order)
+    # Only battles in api_battles_df count, in their order.
+    hits_df = hits_df.dropna(subset='battle_order').sort_values(
+        ['citizenId', 'battle_order', 'time'], kind='stable', ignore_index=True)
+    if hits_df.empty:
+        no_restores = pd.Series(dtype=int, index=pd.MultiIndex.from_arrays([[], []], names=['citizenId', 'day']))
+        return pd.Series(dtype=int), no_restores, state
+
+    citizen = hits_df['citizenId'].to_numpy()
+    battle = hits_df['battle_order'].to_numpy()
+    new_citizen = np.r_[True, citizen[1:] != citizen[:-1]]
+    new_battle = new_citizen | np.r_[True, battle[1:] != battle[:-1]]
+    # The players that fought in the previous battles continue from their last window and limits
+    previous = (state if state is not None else pd.DataFrame(
+        columns=['last_window', 'limits', 'has_restore'])).reindex(citizen[new_citizen])
+    known = previous['limits'].notna().to_numpy()
+    previous_window = pd.to_datetime(previous['last_window'])
+
+    window = hits_df['time'].dt.floor('10min')
+    seconds_from_last = window.diff().dt.total_seconds().to_numpy(copy=True)
+    seconds_from_last[new_citizen] = np.where(known, (window[new_citizen].to_numpy() - previous_window.to_numpy()) /
+                                              np.timedelta64(1, 's'), np.inf)
+    is_restore = seconds_from_last > 0
+    day = hits_df['time'].dt.normalize()
+    day_change = (day != day.shift()).to_numpy(copy=True)
+    day_change[new_citizen] = ~known | (day[new_citizen].to_numpy() != previous_window.dt.normalize().to_numpy())
+
+    # The extra limits of a restore battle are given at the first hit in it, if the previous battle
+    # the player fought in was also a restore battle with enough hits.
+    battle_id = np.cumsum(new_battle) - 1
+    battle_hits = np.bincount(battle_id, weights=hits_df['hits'].to_numpy())
+    battle_is_restore = api_battles_df['is_restore_battle'].to_numpy()[battle[new_battle].astype(int)]
+    has_restore = battle_is_restore & (battle_hits >= restore_battle_min_hits)
+    prev_has_restore = np.r_[False, has_restore[:-1]]
+    prev_has_restore[new_citizen[new_battle]] = known & previous['has_restore'].eq(True).to_numpy()
+    restore_battle_start = np.zeros(len(hits_df), dtype=bool)
+    restore_battle_start[new_battle] = battle_is_restore & prev_has_restore
+
+    restores_window = is_restore & fast_server
+    segment_start = new_citizen | day_change | restores_window | restore_battle_start
+    segment_id = np.cumsum(segment_start) - 1
+    consumed = np.bincount(segment_id, weights=hits_df['hits'].to_numpy() / (1 - avoid) / hits_per_limit)
+    starts = np.flatnonzero(segment_start)
+    segment_day_change = day_change[starts]
+    segment_restore_battle = restore_battle_start[starts]
+    segment_restores = np.where(restores_window[starts],
+                                np.floor(seconds_from_last[starts] / seconds_in_10_minutes) *
+                                limits_per_restore + health_limits, 0)
+
+    # Segments that continue the previous segment's limits are resolved rank by rank (one per citizen at a time)
+    segment_citizen = np.cumsum(new_citizen[starts]) - 1
+    segment_rank = np.arange(len(starts)) - np.flatnonzero(new_citizen[starts])[segment_citizen]
+    limits_at_start = np.where(segment_restore_battle, medkit_limits + health_limits, full_limits).astype(float)
+    medkits = np.zeros(len(starts))
+    limits_at_end = np.zeros(len(starts))
+    carried_limits = np.zeros(len(starts))
+    carried_limits[segment_rank == 0] = previous['limits'].fillna(0).to_numpy(dtype=float)
+    independent = segment_day_change | segment_restore_battle
+    by_rank = np.argsort(segment_rank, kind='stable')
+    rank_bounds = np.flatnonzero(np.r_[True, np.diff(segment_rank[by_rank]) != 0, True])
+    for first, last in zip(rank_bounds[:-1], rank_bounds[1:]):
+        indexes = by_rank[first:last]
+        dependent = indexes[~independent[indexes]]
+        limits_before = np.where(segment_rank[dependent] == 0, carried_limits[dependent], limits_at_end[dependent - 1])
+        limits_at_start[dependent] = np.minimum(limits_before + segment_restores[dependent], full_limits)
+        medkits[indexes] = np.maximum(0, np.ceil(np.round(
+            (consumed[indexes] - limits_at_start[indexes] + threshold) / medkit_limits, 9)))
+        limits_at_end[indexes] = limits_at_start[indexes] - consumed[indexes] + medkits[indexes] * medkit_limits
+
+    citizens = citizen[starts]
+    medkits_per_citizen = pd.Series(medkits, index=citizens).groupby(level=0).sum().astype(int)
+    restores = hits_df[is_restore].groupby(['citizenId', day[is_restore].rename('day')]).size()
+
+    last_hit = np.r_[np.flatnonzero(new_citizen)[1:] - 1, len(hits_df) - 1]
+    new_state = pd.DataFrame({'last_window': window.to_numpy()[last_hit],
+                              'limits': limits_at_end[segment_id[last_hit]],
+                              'has_restore': has_restore[battle_id[last_hit]]}, index=citizen[last_hit])
+    if state is not None:
+        new_state = pd.concat([state[~state.index.isin(new_state.index)], new_state])
+    return medkits_per_citizen, restores, new_state
+
+
+def get_sum_df(df: pd.DataFrame, column: str) -> pd.DataFrame:
+    """Sum the aggregates of api_fights per `column` (see battle_db_utils.select_api_fights_aggregates).
+
+    Returns df with the following columns:
+    index, `column`, 'damage', 'Q0 weps', 'Q1 weps', 'Q2 weps', 'Q3 weps', 'Q4 weps', 'Q5 weps'
+    (only the weapons that were used)
+    """
+    weps_columns = [f'Q{wep_q} weps' for wep_q in range(6)]
+    result_df = df.groupby(column)[['damage'] + weps_columns].sum().sort_values('damage', ascending=False)
+    return result_df.drop(columns=[col for col in weps_columns if not result_df[col].any()])
+
+
+def get_battles_stats(battle_sum_df: pd.DataFrame, api_battles_df: pd.DataFrame) -> tuple[pd.DataFrame, ...]:
+    """Derive the battles, sides and countries stats from the damage and weapons per battle.
+
+    Returns (battle_df, side_df, countries_df)
+    """
+    battle_df = get_sum_df(battle_sum_df, 'battle_id').join(api_battles_df[['defenderId', 'attackerId']], how='inner')
+    # reorder cols, so that defenderId and attackerId are next to battle_id
+    cols = battle_df.columns.tolist()
+    battle_df = battle_df[cols[:1] + cols[-2:] + cols[1:-2]]
+
+    sum_columns = cols[:-2]
+    side_df = battle_df.groupby('defenderId')[sum_columns].sum().add(
+        battle_df.groupby('attackerId')[sum_columns].sum(), fill_value=0)
+    side_df.index.name = 'Side'
+
+    # get number of battles won and lost by each country
+    # (country in defenderId and defenderScore == 8) or (country in attackerId and attackerScore == 8)
+    # TODO: skip events?
+    attacker_won = api_battles_df['attackerScore'] == 8
+    defender_won = (api_battles_df['defenderScore'] == 8) & ~attacker_won
+    won = pd.concat([api_battles_df.loc[attacker_won, 'attackerId'], api_battles_df.loc[defender_won, 'defenderId']])
+    lost = pd.concat([api_battles_df.loc[attacker_won, 'defenderId'], api_battles_df.loc[defender_won, 'attackerId']])
+    country_ids = pd.concat([api_battles_df['attackerId'], api_battles_df['defenderId']]).unique()
+    countries_df = pd.DataFrame({'won': won.value_counts(), 'lost': lost.value_counts()}).reindex(
+        country_ids, fill_value=0).fillna(0).astype(int)
+    countries_df.index.name = 'Country'
+    return battle_df, side_df, countries_df
+
+
+def get_rounds_stats(player_rounds_df: pd.DataFrame) -> pd.DataFrame:
+    """Clutches, BHs and damage records per citizen, from their damage in each round and side.
+
+    The stats of different battles can be merged with merge_rounds_stats.
+    """
+    # The damage of each player, in each round and side
+    player_damage_per_round = player_rounds_df.set_index(
+        ['citizenId', 'battle_id', 'round_id', 'defenderSide'])['damage']
+    side_dmg = player_damage_per_round.groupby(['battle_id', 'round_id', 'defenderSide']).sum().unstack().fillna(
+        0).rename_axis(None, axis=1)
+
+    # Calculate how many times the player was the best damage dealer in a round for each side
+    bhs_count = player_damage_per_round.groupby(['battle_id', 'round_id', 'defenderSide']).idxmax().apply(
+        lambda x: x[0]).value_counts().fillna(0)
+
+    # Calculate how many times the round would have been lost without the player.
+    #  (side_dmg > other_side_dmg AND (side_dmg - player_dmg_in_that_round) < other_side_dmg ?)
+    unstacked_player = player_damage_per_round.unstack().fillna(0).rename_axis(None, axis=1)
+    clutches_defender = (side_dmg[0] > side_dmg[1]) & (((side_dmg[0] - unstacked_player[0]) - side_dmg[1]) < 0)
+    clutches_attacker = (side_dmg[1] > side_dmg[0]) & (((side_dmg[1] - unstacked_player[1]) - side_dmg[0]) < 0)
+    # TODO: remove events?
+    # Sum per citizen (clutches is a series with index (battle_id, round_id, citizenId) and value True/False)
+    clutches_count = clutches_defender.groupby('citizenId').sum() + clutches_attacker.groupby('citizenId').sum()
+
+    best_damage_battle = player_damage_per_round.groupby(['citizenId', 'battle_id']).sum().groupby(
+        'citizenId').max()
+    best_damage_round = player_damage_per_round.groupby(['citizenId', 'battle_id', 'round_id']).sum().groupby(
+        'citizenId').max()
+
+    return pd.DataFrame({
+        'Clutches': clutches_count,
+        'BHs': bhs_count,
+        'Damage record in single battle': best_damage_battle,
+        'Damage record in single round': best_damage_round,
+    })
+
+
+def merge_rounds_stats(dfs: list[pd.DataFrame]) -> pd.DataFrame:
+    """Merge the rounds stats of different battles."""
+    df = pd.concat(dfs)
+    counts = df[['Clutches', 'BHs']].groupby(level=0).sum(min_count=1)
+    counts = counts.astype({column: int for column in counts if counts[column].notna().all()})  # as in one block
+    return counts.join(df.drop(columns=['Clutches', 'BHs']).groupby(level=0).max())
+
+
+def get_dmg_stats(player_rounds_df: pd.DataFrame, citizen_sum_df: pd.DataFrame, date_sum_df: pd.DataFrame,
+                  country_sum_df: pd.DataFrame, mu_sum_df: pd.DataFrame, battle_sum_df: pd.DataFrame,
+                  windows_df: pd.DataFrame, api_battles_df: pd.DataFrame, base_url: str,
+                  fast_server: bool) -> tuple[tuple[bytes, list], ...]:
+    """Calculate the dmg-stats from the api_fights aggregates (runs in a worker process).
+
+    Returns the players, battles and restores stats, each as (csv, preview rows).
+    """
+    medkits, restores, _ = get_medkits_and_restores(windows_df, api_battles_df, fast_server)
+    return write_dmg_stats(get_rounds_stats(player_rounds_df), citizen_sum_df, date_sum_df, country_sum_df,
+                           mu_sum_df, battle_sum_df, medkits, restores, api_battles_df, base_url)
+
+
+def get_block_stats(player_rounds_df: pd.DataFrame, windows_df: pd.DataFrame, api_battles_df: pd.DataFrame,
+                    fast_server: bool, totals: tuple | None) -> tuple:
+    """Add a block of battles to the totals of the previous blocks (runs in a worker process).
+
+    The blocks must be in the battles order, because the medkits estimation continues from the previous block.
+    Returns the new totals: (rounds stats, medkits, restores, medkits state)
+    """
+    rounds_stats, medkits, restores, state = totals or (None, None, None, None)
+    block_medkits, block_restores, state = get_medkits_and_restores(windows_df, api_battles_df, fast_server, state)
+    block_rounds_stats = get_rounds_stats(player_rounds_df)
+    if rounds_stats is None:
+        return block_rounds_stats, block_medkits, block_restores, state
+    return (merge_rounds_stats([rounds_stats, block_rounds_stats]),
+            medkits.add(block_medkits, fill_value=0).astype(int),
+            pd.concat([restores, block_restores]).groupby(level=[0, 1]).sum(),
+            state)
+
+
+def write_dmg_stats(rounds_stats: pd.DataFrame, citizen_sum_df: pd.DataFrame, date_sum_df: pd.DataFrame,
+                    country_sum_df: pd.DataFrame, mu_sum_df: pd.DataFrame, battle_sum_df: pd.DataFrame,
+                    medkits: pd.Series, restores: pd.Series, api_battles_df: pd.DataFrame,
+                    base_url: str) -> tuple[tuple[bytes, list], ...]:
+    """Write the dmg-stats csv files (runs in a worker process).
+
+    Returns the players, battles and restores stats, each as (csv, preview rows).
+    """
+    player_sum_df = get_sum_df(citizen_sum_df, 'citizenId')
+    best_single_hit = citizen_sum_df.set_index('citizenId')['max_hit'].rename('Single hit record')
+    player_stats = rounds_stats.join(best_single_hit, how='outer').join(player_sum_df).sort_values(
+        by='damage', ascending=False)
+
+    date_df = get_sum_df(date_sum_df, 'date')
+    country_df = get_sum_df(country_sum_df, 'citizenship')
+    mu_df = get_sum_df(mu_sum_df, 'militaryUnit')
+    battle_df, side_df, countries_df = get_battles_stats(battle_sum_df, api_battles_df)
+    battle_df.index = battle_df.index.map(lambda x: f"{base_url}battleStatistics.html?id={x}")
+    battle_df.index.name = 'Battle Link'
+
+    # Write the data to csv
+
+    player_stats_buffer = BytesIO()
+    player_stats = player_stats.reset_index().rename(columns={'index': 'citizenId'})
+    player_stats['Medkits used (rough estimation)'] = player_stats['citizenId'].map(medkits).astype('Int64')
+    player_stats.to_csv(player_stats_buffer, mode='wb', index=False, lineterminator='\n')
+
+    battle_stats_buffer = BytesIO()
+
+    # Convert country ids to country names
+    countries_columns = ('citizenship', 'Side', 'Country', 'defenderId', 'attackerId')
+    for df in (country_df, side_df):
+        if df.index.name in countries_columns:
+            df.index = df.index.map(all_countries)
+        for col in df.columns:
+            if col in countries_columns:
+                df[col] = df[col].map(all_countries)
+
+    date_df.to_csv(battle_stats_buffer, mode='wb', lineterminator='\n')
+    battle_stats_buffer.write(b"\n\n")
+    country_df.to_csv(battle_stats_buffer, mode='ab', lineterminator='\n')
+    battle_stats_buffer.write(b"\n\n")
+    mu_df.to_csv(battle_stats_buffer, mode='ab', lineterminator='\n')
+    battle_stats_buffer.write(b"\n\n")
+    side_df.to_csv(battle_stats_buffer, mode='ab', lineterminator='\n')
+    battle_stats_buffer.write(b"\n\n")
+    battle_df.to_csv(battle_stats_buffer, mode='ab', lineterminator='\n')
+    battle_stats_buffer.write(b"\n\n")
+
+    countries_df["won %"] = round(countries_df["won"] / (countries_df["won"] + countries_df["lost"]) * 100, 2)
+    countries_df["lost %"] = round(countries_df["lost"] / (countries_df["won"] + countries_df["lost"]) * 100, 2)
+    countries_df.sort_values("won", ascending=False).to_csv(battle_stats_buffer, mode='ab', lineterminator='\n')
+
+    restores_per_day_buffer = BytesIO()
+    restores_per_day = restores.unstack() if not restores.empty else pd.DataFrame()
+    restores_per_day.columns = pd.DatetimeIndex(restores_per_day.columns).strftime("%d-%m-%Y")
+    restores_per_day = restores_per_day.reindex(player_stats['citizenId'])
+    restores_per_day["Average Per Day"] = restores_per_day.mean(axis=1)
+    restores_per_day["Median"] = restores_per_day.median(axis=1)
+    restores_per_day["Max"] = restores_per_day.max(axis=1)
+    restores_per_day.to_csv(restores_per_day_buffer, mode='wb', lineterminator='\n')
+
+    return ((player_stats_buffer.getvalue(), get_preview_rows(player_stats, index=False)),
+            (battle_stats_buffer.getvalue(), get_preview_rows(date_df)),
+            (restores_per_day_buffer.getvalue(), get_preview_rows(restores_per_day)))
+
+
+def get_preview_rows(df: pd.DataFrame, rows: int = 10, **kwargs) -> list[list[str]]:
+    """The header and the first rows of df, as they are written to the csv (for export_utils.preview_image)."""
+    return list(reader(StringIO(df.head(rows).to_csv(lineterminator='\n', **kwargs))))
+
+
+def parse_api_times(times: list[str]) -> list[datetime]:
+    """Parse the times of api hits all at once (same formats as utils.get_time)."""
+    times = pd.Series(times, dtype=str).str.strip()
+    parsed = pd.Series(pd.NaT, index=times.index, dtype='datetime64[ns]')
+    for time_format in ('%d-%m-%Y %H:%M:%S:%f', '%Y-%m-%d %H:%M:%S:%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f'):
+        parsed = parsed.fillna(pd.to_datetime(times, format=time_format, errors='coerce'))
+    return list(parsed.dt.to_pydatetime())
+
+
+def get_battle_dmg(rounds: list[list[dict]], key: str, defender: str, attacker: str, range_of_battles: bool,
+                   round_id: int = 0, key_id: int | str = "", nick: str = "") -> tuple[dict, dict]:
+    """Sum the weps and dmg per entity (side, and citizen / MU / country) in the hits of one battle.
+
+    rounds: the apiFights of each round.
+    Returns (stats_per_entity, hit_time), to be merged into the totals of all battles.
+    """
+    stats_per_entity = defaultdict(lambda: {'weps': [0, 0, 0, 0, 0, 0], 'dmg': 0})
+    hit_time = defaultdict(lambda: {"dmg": [], "time": []})
+    for api_fights in rounds:
+        api_fights = api_fights[::-1]
+        defender_details = defaultdict(lambda: {'weps': [0, 0, 0, 0, 0, 0], 'dmg': 0})
+        attacker_details = defaultdict(lambda: {'weps': [0, 0, 0, 0, 0, 0], 'dmg': 0})
+        for hit, hit_time_ in zip(api_fights, parse_api_times([hit["time"] for hit in api_fights])):
+            side_string = defender if hit['defenderSide'] else attacker
+            update_hit_dmg(hit, stats_per_entity, range_of_battles, key, side_string)
+            if not round_id:
+                update_hit_time(hit, hit_time_, hit_time, side_string)
+                if key == 'citizenId':
+                    side = defender_details if hit['defenderSide'] else attacker_details
+                    side[hit['citizenId']]['weps'][hit['weapon']] += 5 if hit['berserk'] else 1
+                    side[hit['citizenId']]['dmg'] += hit['damage']
+
+            elif key in hit:
+                # TODO: I am not sure what this is doing
+                if (not range_of_battles) and (not key_id or hit[key] == key_id):
+                    name = nick if key_id else side_string
+                    update_hit_time(hit, hit_time_, hit_time, name)
+
+        for side in (attacker_details, defender_details):
+            side = sorted(side.items(), key=lambda x: x[1]['dmg'], reverse=True)
+            for (name, value) in side:
+                if "tops" not in stats_per_entity[name]:
+                    stats_per_entity[name]["tops"] = [0, 0, 0, 0]
+                stats_per_entity[name]["tops"][3] += 1
+                if (name, value) in side[:10]:
+                    stats_per_entity[name]["tops"][2] += 1
+                    if (name, value) in side[:3]:
+                        stats_per_entity[name]["tops"][1] += 1
+                        if (name, value) in side[:1]:
+                            stats_per_entity[name]["tops"][0] += 1
+    return dict(stats_per_entity), dict(hit_time)
+
+
+def update_hit_dmg(hit: dict, my_dict: dict, range_of_battles: bool, key: str, side_string: str) -> None:
+    wep = 5 if hit['berserk'] else 1
+    if not range_of_battles:
+        my_dict[side_string]['weps'][hit['weapon']] += wep
+        my_dict[side_string]['dmg'] += hit['damage']
+    my_dict['Total']['weps'][hit['weapon']] += wep
+    my_dict['Total']['dmg'] += hit['damage']
+    if key in hit:
+        my_dict[hit[key]]['weps'][hit['weapon']] += wep
+        my_dict[hit[key]]['dmg'] += hit['damage']
+
+
+def update_hit_time(hit: dict, time: datetime, hit_time: dict, side_string: str) -> None:
+    hit_time[side_string]["time"].append(time)
+    if hit_time[side_string]["dmg"]:
+        hit_time[side_string]["dmg"].append(hit_time[side_string]["dmg"][-1] + hit['damage'])
+    else:
+        hit_time[side_string]["dmg"].append(hit['damage'])
@@ -0,0 +1,126 @@
+import numpy as np
+
+# Max cells in one (players x drops amounts) matrix, the players are processed in chunks above it
+max_matrix_size = 2 ** 22
+# The chances are calculated only within mean +- window_stds * std (+ window_margin), the rest is negligible
+window_stds = 12
+window_margin = 30
+
+
+def log_factorials(n: int) -> np.ndarray:
+    """log(k!) for k in 0..n (gammaln(k + 1) for integers)."""
+    return np.r_[0.0, np.cumsum(np.log(np.arange(1, n + 1)))]
+
+
+def get_percentages(n: int, p: np.ndarray, k: np.ndarray) -> np.ndarray:
+    """The chance (in %) of each player to get k drops out of n.
+
+    k is a (len(p), m) matrix of drops amounts (amounts above n get 0).
+    Uses a normal approximation (PDF at k) if n*p >= 5 and n*(1-p) >= 5, otherwise the exact binomial PMF
+    in log space (not normalized by the sum of the row, since k can be a window of the amounts).
+    """
+    p = p[:, None]
+    mean = n * p
+    std = np.sqrt(mean * (1 - p))
+    is_normal = ((mean >= 5) & (n * (1 - p) >= 5))[:, 0]
+    percentages = np.zeros(k.shape)
+    valid = k <= n
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        # X ~ N(mu=np, sigma=sqrt(np(1-p)) ; PDF(X) = e^(-(x-np)^2/(2np(1-p))) / sqrt(2*PI*np(1-p))
+        z = (k[is_normal] - mean[is_normal]) / std[is_normal]
+        percentages[is_normal] = np.exp(-z ** 2 / 2) / (np.sqrt(2 * np.pi) * std[is_normal]) * 100
+
+        # log(n choose k) + k*log(p) + (n-k)*log(1-p)
+        is_binom = ~is_normal & (p[:, 0] > 0) & (p[:, 0] < 1)
+        log_k = log_factorials(n)
+        binom_k = np.minimum(k[is_binom], n)
+        log_pmf = np.where(valid[is_binom], log_k[n] - log_k[binom_k] - log_k[n - binom_k] +
+                           binom_k * np.log(p[is_binom]) + (n - binom_k) * np.log1p(-p[is_binom]), -np.inf)
+        percentages[is_binom] = np.exp(log_pmf) * 100
+
+    percentages[p[:, 0] <= 0] = np.where(k[p[:, 0] <= 0] == 0, 100.0, 0.0)
+    percentages[p[:, 0] >= 1] = np.where(k[p[:, 0] >= 1] == n, 100.0, 0.0)
+    percentages[~valid] = 0
+    return percentages
+
+
+def get_drops_chances(tops_per_player: dict, drops_per_q: dict, hits: int, bonus: int,
+                      player_id: int = None) -> tuple[dict, set, list, list, int]:
+    """Calculate the expected drops of each player (or the given player only), per quality.
+
+    tops_per_player: {citizenId: {'hits': int, 'tops': [top1, top3, top10]}}
+    drops_per_q: {quality: (total drops, hits for next)}
+
+    Returns (final, qualities, plots, mean_values, max_k), where final is
+    {citizenId: {quality: (drops range, chance)}}, and plots are (quality, percentages) of the given player.
+    """
+    hits_with_bonus = hits + hits * bonus / 100
+    top1, top3, top10 = range(3)
+    all_total_tops = {index: sum(x['tops'][index] for x in tops_per_player.values()) for index in range(3)}
+    indexes = {"Q3": top10, "Q4": top3, "Q5": top1, "Q6": top1}
+    players = [user_id for user_id in tops_per_player if player_id is None or player_id == user_id]
+    players_hits = np.array([tops_per_player[user_id]['hits'] for user_id in players], dtype=float)
+    final = {user_id: {} for user_id in players}
+    qualities = set()
+    plots = []
+    mean_values = []
+    max_k = 0
+    for quality, (total_drops, _) in drops_per_q.items():
+        if quality in indexes:
+            total_tops = all_total_tops[indexes[quality]]
+            my_tops = np.array([tops_per_player[user_id]['tops'][indexes[quality]]
+                                if 'tops' in tops_per_player[user_id] else 0 for user_id in players], dtype=float)
+        elif "upg" in quality:
+            total_tops = hits
+            my_tops = players_hits
+        else:
+            total_tops = hits_with_bonus
+            my_tops = players_hits + players_hits * bonus / 100
+
+        n = total_drops
+        p = (my_tops / total_tops) if total_tops else np.zeros(len(players))
+        mean = n * p  # mu
+        std = np.sqrt(mean * (1 - p))  # sigma
+        mean_values.extend(mean.tolist())
+        first, last = np.round(mean - std).astype(int), np.round(mean + std).astype(int)
+
+        # Each player gets a window of drops amounts around his mean (or all of them, for the plot)
+        if player_id is None:
+            low = np.clip(np.floor(mean - window_stds * std) - window_margin, 0, n).astype(int)
+            width = int(np.clip(np.ceil(window_stds * std * 2) + window_margin * 2 + 2, 1, n + 1).max(initial=1))
+        else:
+            low, width = np.zeros(len(players), dtype=int), n + 1
+        chunk_size = max(1, max_matrix_size // width)
+        for start in range(0, len(players), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            k = low[chunk, None] + np.arange(width)
+            percentages = get_percentages(n, p[chunk], k)
+            cum_sum = np.cumsum(percentages, axis=1)
+            # keep only values below 99.9 (the cumulative sum is increasing, so it's a prefix)
+            below = cum_sum < 99.9
+            lengths = np.where(below.all(axis=1), n + 1, low[chunk] + below.sum(axis=1))
+            lengths[lengths == 0] = n + 1
+            max_k = max(max_k, lengths.max(initial=0))
+            cum_sum = np.c_[np.zeros(len(cum_sum)), cum_sum]
+
+            for i, user_id in enumerate(players[chunk], start):
+                length, offset = lengths[i - start], low[i]
+                if total_drops and my_tops[i]:
+                    if first[i] == 0:
+                        drops_range = "1" if total_drops == 1 else "1+"
+                        chances = 100 - (percentages[i - start, 0] if offset == 0 else 0)
+                    else:
+                        drops_range = f"{first[i]}-{last[i]}" if first[i] != last[i] else str(first[i])
+                        # sum(percentages[first:last + 1]), with python slicing
+                        begin, end = (np.clip(np.array(slice(first[i], last[i] + 1).indices(length)[:2]) - offset,
+                                              0, width))
+                        chances = cum_sum[i - start, end] - cum_sum[i - start, begin] if end > begin else 0
+                    final[user_id][quality] = (drops_range, f"{round(chances)}%")
+                    qualities.add(quality)
+                else:
+                    final[user_id][quality] = (0, "100%")
+
+                if player_id is not None and length > 1:
+                    plots.append((quality, percentages[i - start, :length].tolist()))
+    return final, qualities, plots, mean_values, int(max_k)
@@ -0,0 +1,104 @@
+"""CSV attachments: written once as bytes, previewed from the rows in memory, and zipped if too big for Discord."""
+import shutil
+from csv import writer
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import pandas as pd
+from discord import File
+
+from . import utils
+from .plot_utils import draw_pil_table
+
+max_file_size = 10 * 1024 * 1024  # Discord's attachment limit (for servers without boosts)
+spool_size = 8 * 1024 * 1024  # larger exports are written to a temporary file instead of memory
+
+
+class CsvExport:
+    """A CSV attachment.
+
+    Rows are encoded straight into a spooled file (no StringIO copy), and the first ones are kept for the preview.
+    Use `output.writer` like a csv.writer, then `output.to_file(filename)` and `await output.preview(filename)`.
+    """
+
+    def __init__(self, preview_rows: int = 10) -> None:
+        self.file = SpooledTemporaryFile(max_size=spool_size)
+        self.preview_rows = preview_rows
+        self.rows = []  # the header and the first preview_rows rows
+        self._csv_writer = writer(self)
+        self._zip = None
+
+    @property
+    def writer(self) -> "CsvExport":
+        """csv.writer-like interface (writerow / writerows)."""
+        return self
+
+    def write(self, text: str) -> None:
+        """Called by csv.writer."""
+        self.file.write(text.encode())
+
+    def writerow(self, row: iter) -> None:
+        row = list(row)
+        if len(self.rows) <= self.preview_rows:
+            self.rows.append(["" if x is None else str(x) for x in row])
+        self._csv_writer.writerow(row)
+
+    def writerows(self, rows: iter) -> None:
+        for row in rows:
+            self.writerow(row)
+
+    def write_df(self, df: pd.DataFrame, **kwargs) -> None:
+        """Write a DataFrame (kwargs are passed to to_csv)."""
+        index = kwargs.get("index", True)
+        preview_df = df.head(self.preview_rows + 1 - len(self.rows))
+        if index:
+            preview_df = preview_df.reset_index()
+        if not self.rows and kwargs.get("header", True):
+            self.rows.append(list(map(str, preview_df.columns)))
+        self.rows.extend(preview_df.astype(str).values.tolist()[:self.preview_rows + 1 - len(self.rows)])
+        df.to_csv(self.file, mode="wb", **kwargs)
+
+    def size(self) -> int:
+        return self.file.seek(0, 2)
+
+    def to_file(self, filename: str, limit: int = max_file_size) -> File:
+        """The CSV as a discord File (zipped, if it's above the limit). It can be sent more than once."""
+        if self.size() <= limit:
+            self.file.seek(0)
+            return File(fp=self.file, filename=filename)
+        if self._zip is None:
+            self._zip = SpooledTemporaryFile(max_size=spool_size)
+            self.file.seek(0)
+            with ZipFile(self._zip, "w", ZIP_DEFLATED) as zip_file, zip_file.open(filename, "w") as dest:
+                shutil.copyfileobj(self.file, dest)
+        self._zip.seek(0)
+        return File(fp=self._zip, filename=filename.rsplit(".", 1)[0] + ".zip")
+
+    async def preview(self, filename: str, columns: int = 10) -> File:
+        """An image of the first rows."""
+        return File(fp=await preview_image(self.rows, columns), filename=filename)
+
+    def close(self) -> None:
+        self.file.close()
+        if self._zip is not None:
+            self._zip.close()
+
+
+async def preview_image(rows: list, columns: int = 10) -> BytesIO:
+    """Draw the header and the first rows (up to `columns` columns)."""
+    header, *table = rows or [[]]
+    return await utils.render(draw_pil_table, [row[:columns] for row in table], header[:columns], 0, True)
+
+
+def to_file(content: str | bytes, filename: str, limit: int = max_file_size) -> File:
+    """A discord File of an already built CSV (zipped, if it's above the limit)."""
+    if isinstance(content, str):
+        content = content.encode()
+    if len(content) <= limit:
+        return File(fp=BytesIO(content), filename=filename)
+    output = BytesIO()
+    with ZipFile(output, "w", ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(filename, content)
+    output.seek(0)
+    return File(fp=output, filename=filename.rsplit(".", 1)[0] + ".zip")
@@ -0,0 +1,181 @@
+"""Delivery of the bot's notifications (watch pings, cup results, motivate, alerts...) to the subscribed channels."""
+import asyncio
+import hashlib
+import logging
+from collections import defaultdict, deque
+from io import BytesIO
+from time import time
+
+from discord import Embed, File
+
+logger = logging.getLogger()
+max_embeds = 10  # per message (Discord's limits)
+max_files = 10
+max_content = 2000
+
+
+class Notice:
+    """A message that waits in the queue of its channel."""
+
+    def __init__(self, content: str, embed: Embed | None, files: list[File], image: bytes | None,
+                 delete_after: float | None) -> None:
+        self.content = content
+        self.embed = embed
+        self.files = files
+        self.image = image
+        self.image_key = hashlib.sha1(image).hexdigest()[:16] if image else None
+        self.delete_after = delete_after
+        self.queued_at = time()
+        self.future = asyncio.get_running_loop().create_future()
+
+    def fits(self, bundle: list["Notice"]) -> bool:
+        """Whether it can be added to the bundle (a single message)."""
+        first = bundle[0]
+        return (self.delete_after == first.delete_after
+                and sum(bool(x.embed) for x in bundle) + bool(self.embed) <= max_embeds
+                and sum(len(x.files) + bool(x.image) for x in bundle) + len(self.files) + bool(self.image) <= max_files
+                and sum(len(x.content) + 1 for x in bundle) + len(self.content) <= max_content)
+
+
+class Notifier:
+    """Per-channel queues, with at most `concurrency` messages being sent at once.
+
+    A notice is sent right away, but when more notices reach a channel while it's sending, they wait `bundle_window`
+    seconds for the rest of the burst and are bundled into one message (up to Discord's limits).
+    An image (the embed thumbnail) is uploaded once, then linked by its URL in the other channels for `url_ttl` seconds,
+    but only by messages that are deleted before the uploading message (up to `url_grace` seconds after it),
+    because deleting a message deletes its attachments.
+    """
+
+    def __init__(self, concurrency: int = 5, bundle_window: float = 0.5, url_ttl: float = 3600,
+                 url_grace: float = 30) -> None:
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bundle_window = bundle_window
+        self.url_ttl = url_ttl
+        self.url_grace = url_grace
+        self.queues: dict[int, list[Notice]] = defaultdict(list)
+        self.workers: dict[int, asyncio.Task] = {}
+        # image key -> (url of its upload, when the url expires, when its message is deleted or None)
+        self.urls: dict[str, tuple[str, float, float | None]] = {}
+        self.uploading: dict[str, asyncio.Future] = {}
+        self.latencies = deque(maxlen=1000)  # seconds from queued to delivered, of the recent notices
+        self.counts = defaultdict(int)  # notices, messages, failed, reused_images
+
+    async def send(self, channel, content: str = "", embed: Embed = None, files: list[File] = (),
+                   image: bytes = None, delete_after: float = None) -> bool:
+        """Queue a notice, and wait until it's delivered. Returns False if it couldn't be sent.
+
+        `image` is shown as the thumbnail of `embed`.
+        """
+        notice = Notice(content or "", embed, list(files), image, delete_after)
+        self.queues[channel.id].append(notice)
+        if channel.id not in self.workers:
+            self.workers[channel.id] = asyncio.create_task(self.channel_worker(channel))
+        return await notice.future
+
+    async def channel_worker(self, channel) -> None:
+        queue = self.queues[channel.id]
+        try:
+            is_burst = False
+            while queue:
+                if is_burst:  # more notices arrived while the previous message was sent, so let the rest join
+                    await asyncio.sleep(self.bundle_window)
+                bundle = [queue.pop(0)]
+                while queue and queue[0].fits(bundle):
+                    bundle.append(queue.pop(0))
+                async with self.semaphore:
+                    await self.deliver(channel, bundle)
+                is_burst = bool(queue)
+        finally:
+            del self.workers[channel.id]
+            self.queues.pop(channel.id, None)
+            for notice in queue:  # the worker was cancelled
+                self.resolve(notice, False)
+
+    def resolve(self, notice: Notice, delivered: bool) -> None:
+        """Count the notice, and return `delivered` to its sender."""
+        if notice.future.done():
+            return
+        self.counts["notices"] += 1
+        self.counts["failed"] += not delivered
+        self.latencies.append(time() - notice.queued_at)
+        notice.future.set_result(delivered)
+
+    async def deliver(self, channel, bundle: list[Notice]) -> None:
+        """Send the bundle as one message. Its notices get False if anything fails."""
+        try:
+            await self.send_bundle(channel, bundle)
+        except Exception as error:
+            logger.error(f"Notifier: failed to deliver {len(bundle)} notices to {channel.id=}: {error}")
+        finally:
+            for notice in bundle:
+                self.resolve(notice, False)
+
+    async def send_bundle(self, channel, bundle: list[Notice]) -> None:
+        files, embeds, new_images = [], [], {}
+        message = None
+        try:
+            for notice in bundle:
+                files.extend(notice.files)
+                if notice.embed is None:
+                    continue
+                embeds.append(notice.embed)
+                if notice.image is None:
+                    continue
+                url = None if notice.image_key in new_images else await self.get_url(
+                    notice.image_key, notice.delete_after)
+                if url:
+                    notice.embed.set_thumbnail(url=url)
+                    self.counts["reused_images"] += 1
+                else:
+                    filename = f"{notice.image_key}.png"
+                    if notice.image_key not in new_images:
+                        files.append(File(fp=BytesIO(notice.image), filename=filename))
+                        new_images[notice.image_key] = filename
+                        self.uploading.setdefault(notice.image_key, asyncio.get_running_loop().create_future())
+                    notice.embed.set_thumbnail(url=f"attachment://{filename}")
+            message = await channel.send("\n".join(x.content for x in bundle if x.content) or None,
+                                         embeds=embeds, files=files, delete_after=bundle[0].delete_after)
+        except Exception as error:
+            logger.warning(f"Notifier: failed to send {len(bundle)} notices to {channel.id=}: {error}")
+        finally:
+            self.counts["messages"] += 1
+            for key, filename in new_images.items():  # the other channels wait for those uploads
+                url = next((x.url for x in message.attachments if x.filename == filename), None) if message else None
+                if url:
+                    delete_after = bundle[0].delete_after
+                    self.urls[key] = (url, time() + min(self.url_ttl, delete_after or self.url_ttl),
+                                      time() + delete_after if delete_after is not None else None)
+                future = self.uploading.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_result(url)
+        for notice in bundle:
+            self.resolve(notice, message is not None)
+        if self.counts["messages"] % 100 == 0:
+            logger.info(f"Notifier: {self.stats()}")
+
+    async def get_url(self, key: str, delete_after: float | None) -> str | None:
+        """The URL of an uploaded image (waiting for an upload of it that is in progress), or None.
+
+        None also if a message that is deleted after `delete_after` seconds (or never) would outlive the upload.
+        """
+        if key in self.uploading:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.uploading[key]), 10)
+            except asyncio.TimeoutError:
+                return None
+        url, expires_at, deleted_at = self.urls.get(key, (None, 0, None))
+        if time() > expires_at:
+            self.urls.pop(key, None)
+            return None
+        if deleted_at is not None and (delete_after is None or time() + delete_after > deleted_at + self.url_grace):
+            return None
+        return url
+
+    def stats(self) -> str:
+        """Delivery counts and latency (of the recent notices)."""
+        latencies = sorted(self.latencies) or [0]
+        p50, p95 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+        queued = sum(map(len, self.queues.values()))
+        return (", ".join(f"{k}={v}" for k, v in self.counts.items()) +
+                f", latency p50={p50:.2f}s p95={p95:.2f}s max={latencies[-1]:.2f}s, {queued=}")
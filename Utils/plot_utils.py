@@ -0,0 +1,246 @@
+"""Plots and table images.
+
+This module doesn't import the bot, so its functions can run in the render processes (see Utils.workers.RenderPool).
+"""
+import statistics
+from functools import lru_cache
+from io import BytesIO
+from os import path
+
+import matplotlib
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw, ImageFont
+from matplotlib import pyplot as plt
+from matplotlib.dates import DateFormatter
+from matplotlib.gridspec import GridSpec
+from matplotlib.ticker import FixedLocator
+from tabulate import tabulate
+
+from .constants import temp_servers
+
+matplotlib.use('Agg')
+font_path = path.join(path.dirname(path.dirname(__file__)), "files", "DejaVuSansMono.ttf")
+table_background, table_color = (44, 47, 51), (255, 255, 255)
+# Lines with more points are downsampled before drawing (a plot is 640px wide, so more points add nothing)
+max_line_points = 1000
+
+
+def human_format(num: float) -> str:
+    """Number to human format."""
+    magnitude = 0
+    while abs(num) >= 1000:
+        magnitude += 1
+        num /= 1000
+
+    if num < 10:
+        precision = 2
+    elif num < 100:
+        precision = 1
+    else:
+        precision = 0
+    return f'{num:.{precision}f}' + ['', 'K', 'M', 'B', 'T', 'P'][magnitude]
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: the indices of max_points points that keep the shape of the line.
+
+    The first and last points are kept, and from each bucket in between, the point that forms the largest triangle
+    with the previously selected point and the average of the next bucket.
+    """
+    if len(x) <= max_points or max_points < 3:
+        return np.arange(len(x))
+    edges = np.linspace(1, len(x) - 1, max_points - 1).astype(int)
+    # The average of each bucket (the last point stands for the bucket after the last one)
+    average_x = np.append(np.add.reduceat(x[1:-1], edges[:-1] - 1) / np.diff(edges), x[-1])
+    average_y = np.append(np.add.reduceat(y[1:-1], edges[:-1] - 1) / np.diff(edges), y[-1])
+    indices = np.empty(max_points, dtype=int)
+    indices[0], indices[-1] = 0, len(x) - 1
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        prev_x, prev_y = x[indices[i]], y[indices[i]]
+        next_x, next_y = average_x[i + 1], average_y[i + 1]
+        areas = np.abs((prev_x - next_x) * (y[start:end] - prev_y) - (prev_x - x[start:end]) * (next_y - prev_y))
+        indices[i + 1] = start + areas.argmax()
+    return indices
+
+
+def downsample(x: iter, y: iter, max_points: int = max_line_points) -> tuple[np.ndarray, np.ndarray]:
+    """Downsample a line (x can be numbers or datetimes) with LTTB."""
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    if len(x) <= max_points:
+        return x, y
+    numeric_x = x.astype(float) if np.issubdtype(x.dtype, np.number) else (
+        pd.to_datetime(x).to_numpy().astype("datetime64[ns]").astype(np.int64).astype(float))
+    indices = lttb_indices(numeric_x, y, max_points)
+    return x[indices], y[indices]
+
+
+def plt_to_bytes(fig: plt.Figure) -> BytesIO:
+    output_buffer = BytesIO()
+    fig.tight_layout()
+    fig.savefig(output_buffer)
+    plt.close(fig)
+    output_buffer.seek(0)
+    return output_buffer
+
+
+@lru_cache
+def get_font(size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, size)
+
+
+get_font(100)  # loaded once, before the render processes are forked
+
+
+def get_compact_font_size(rows: int) -> int:
+    """100px for up to 20 rows, and smaller for longer tables (but not less than 20px)."""
+    return max(20, min(100, 2400 // (rows + 4)))
+
+
+def draw_pil_table(my_table: list | tuple, header: list | tuple, new_lines: int = 0,
+                   compact: bool = False) -> BytesIO:
+    """Draw table (a JPEG, or a palette PNG sized to the text if compact)."""
+    tabulate_table = tabulate(my_table, headers=header, tablefmt='grid', numalign="center", stralign="center")
+    if compact:
+        return draw_compact_table(tabulate_table, get_compact_font_size(len(my_table) + new_lines))
+    table_len = len(tabulate_table) / (len(my_table) * 2 + 3 + new_lines)
+    img = Image.new('RGB', (int(60 * table_len), 300 + new_lines * 100 + len(my_table) * 200), color=table_background)
+    ImageDraw.Draw(img).text((10, 10), tabulate_table, font=get_font(100))
+    output_buffer = BytesIO()
+    img.save(output_buffer, format='JPEG', subsampling=0, quality=95)
+    output_buffer.seek(0)
+    return output_buffer
+
+
+def draw_compact_table(text: str, font_size: int) -> BytesIO:
+    """Draw a tabulated text as a palette PNG.
+
+    The font is monospaced and tabulate already aligned the columns, so the size is measured once (a single glyph)
+    instead of per cell. The text is drawn as a grayscale mask, and the palette maps it from the background
+    to the text color, so there are no quantization costs or artifacts.
+    """
+    table_font = get_font(font_size)
+    lines = text.splitlines()
+    spacing = font_size // 25 + 4
+    line_height = table_font.getbbox("A")[3] + spacing  # as in ImageDraw.multiline_text
+    margin = font_size // 10 + 2
+    width = int(max(map(len, lines)) * table_font.getlength("0")) + 2 * margin
+    height = len(lines) * line_height + 2 * margin
+    img = Image.new('L', (width, height), color=0)
+    ImageDraw.Draw(img).multiline_text((margin, margin), text, font=table_font, fill=255, spacing=spacing)
+    img = img.convert('P')  # the same indices, with a background -> color gradient as the palette
+    img.putpalette([round(background + (color - background) * i / 255)
+                    for i in range(256) for background, color in zip(table_background, table_color)])
+    output_buffer = BytesIO()
+    img.save(output_buffer, format='PNG')
+    output_buffer.seek(0)
+    return output_buffer
+
+
+def dmg_trend(hit_time: dict, server: str, battle_id: str) -> BytesIO:
+    """Dmg trend."""
+    fig, ax = plt.subplots()
+    for side, DICT in hit_time.items():
+        ax.plot(*downsample(DICT["time"], DICT["dmg"]), label=side)
+    ax.legend()
+    ax.xaxis.set_major_formatter(DateFormatter("%d-%m %H:%M"))
+    fig.autofmt_xdate()
+    ax.set_title(f"Dmg Trend ({server}, {battle_id})")
+    ax.set_ylabel('DMG')
+    ax.set_xlabel('Time')
+    ax.yaxis.set_major_locator(FixedLocator(ax.get_yticks()))
+    ax.set_yticklabels([human_format(x) for x in ax.get_yticks().tolist()])
+    ax.grid()
+    return plt_to_bytes(fig)
+
+
+def generate_cup_plot(df: pd.DataFrame, names: dict) -> BytesIO | None:
+    names = {k: v.replace("_", "") for k, v in names.items()}  # matplotlib ignores names that starts with _
+    # Calculate total_damage for each row
+    df['total_damage'] = df.groupby('citizenId')['damage'].cumsum()
+
+    # Identify the day changes (more than 12h) and plot them directly
+    fig, (ax0, ax1) = plt.subplots(1, 2, sharey='all', tight_layout=True)
+
+    has_second_day = False
+
+    colors = ('red', 'blue', 'green', 'orange', 'purple', 'brown', 'pink', 'gray', 'olive', 'cyan')
+
+    for i, (citizen_id, group) in enumerate(df.groupby('citizenId')):
+        color = colors[i]
+
+        # Filter and plot points corresponding to day changes
+        second_day_points = group[group['time'] - group['time'].shift() > pd.Timedelta(hours=12)]
+
+        # Plot the first subplot (before the day change)
+        if not second_day_points.empty:
+            ax0.plot(*downsample(group['time'][group['time'] < second_day_points.iloc[0]['time']],
+                                 group['total_damage'][group['time'] < second_day_points.iloc[0]['time']]),
+                     label=names[citizen_id], color=color)
+        else:
+            ax0.plot(*downsample(group['time'], group['total_damage']), label=names[citizen_id], color=color)
+
+        # Plot the second subplot (after the day change)
+        if not second_day_points.empty:
+            has_second_day = True
+            ax1.plot(*downsample(group['time'][group['time'] >= second_day_points.iloc[0]['time']],
+                                 group['total_damage'][group['time'] >= second_day_points.iloc[0]['time']]),
+                     label=names[citizen_id], color=color)
+
+    # Use FixedFormatter with existing tick positions
+    ax0.yaxis.set_major_locator(FixedLocator(ax0.get_yticks()))
+    ax0.set_yticklabels([human_format(x) for x in ax0.get_yticks().tolist()])
+
+    ax0.xaxis.set_major_formatter(DateFormatter("%d-%m %H:%M"))
+    ax1.xaxis.set_major_formatter(DateFormatter("%d-%m %H:%M"))
+
+    if has_second_day:
+        ax0.spines['right'].set_visible(False)
+        ax1.spines['left'].set_visible(False)
+        ax1.yaxis.tick_right()
+    else:
+        # remove ax1 and expand ax0
+        fig.delaxes(ax1)
+        ax0.set_subplotspec(GridSpec(1, 1)[0])
+
+    fig.suptitle('Total Damage vs Time')
+    ax0.set_ylabel('Total Damage')
+    ax0.set_xlabel('Time')
+
+    # sort legends based on tops
+    lines, labels = ax0.get_legend_handles_labels()
+    lines = tuple(lines[labels.index(label)] for label in names.values())
+    labels = tuple(labels[labels.index(label)] for label in names.values())
+    ax0.legend(lines, labels)
+
+    fig.autofmt_xdate()
+
+    return plt_to_bytes(fig)
+
+
+def plot_avg_prices(prices_per_day: dict, product_name: str, server: str) -> BytesIO:
+    med = statistics.median(prices_per_day.values())
+    std = statistics.stdev(prices_per_day.values())
+    prices_per_day = {day: min(price, med + 2 * std) for day, price in prices_per_day.items()}
+
+    # calculate the moving average
+    is_temp_server = server in temp_servers
+    window = 12 if not is_temp_server else 7
+    prices_list = list(prices_per_day.values())
+    moving_average = tuple(statistics.median(prices_list[i - window // 2: i + window // 2])
+                           if i + window // 2 <= len(prices_list) and i >= window // 2 else None
+                           for i in range(len(prices_list)))
+
+    fig, ax = plt.subplots()
+    ax.set_title(f"{product_name}, {server}")
+    ax.set_ylabel('Price')
+    ax.set_xlabel('Date')
+    ax.plot(prices_per_day.keys(), prices_per_day.values(),  # noqa WPS221
+            label="Daily Average" if is_temp_server else "Monthly Average")
+    if any(moving_average):
+        ax.plot(prices_per_day.keys(), moving_average, '.-', label="Moving Average")  # noqa WPS221
+    ax.legend()
+    fig.autofmt_xdate()
+    ax.grid()
+    return plt_to_bytes(fig)
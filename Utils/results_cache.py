@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import pickle
+from glob import glob
+from os import path
+
+import pandas as pd
+
+from bot.bot import bot
+from . import battle_db_utils
+
+logger = logging.getLogger()
+
+
+def get_key(command: str, server: str, battle_ids: iter, **options) -> str:
+    """Cache key of a report: the command, server, normalized battle ids and options."""
+    raw = repr((command, server, sorted(set(battle_ids)), sorted(options.items())))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def get_filename(key: str) -> str:
+    return path.join(path.dirname(bot.root), f"db/results_{key}.pkl")
+
+
+def read_pickle(filename: str) -> dict:
+    with open(filename, "rb") as file:
+        return pickle.load(file)
+
+
+def write_pickle(filename: str, data: dict) -> None:
+    with open(filename + ".tmp", "wb") as file:
+        pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + ".tmp", filename)  # never leave a half written entry
+
+
+async def load(key: str) -> dict | None:
+    """Load a cached report, or None."""
+    filename = get_filename(key)
+    if not path.exists(filename):
+        return None
+    try:
+        entry = await bot.loop.run_in_executor(None, read_pickle, filename)
+        os.utime(filename)  # least recently used entries are evicted first
+        return entry
+    except Exception as error:
+        logger.warning(f"results_cache: failed to load {key=}: {error}")
+        return None
+
+
+async def save(key: str, entry: dict) -> None:
+    """Save a report, and evict the least recently used ones above `results_cache_size`."""
+    await bot.loop.run_in_executor(None, write_pickle, get_filename(key), entry)
+    files = sorted(glob(get_filename("*")), key=path.getmtime)
+    for filename in files[:-bot.config.get("results_cache_size", 100)]:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def get_verified_rounds(api_battles_df: pd.DataFrame) -> dict[int, int | None]:
+    """The last verified round of each battle, or None if all of its rounds are verified.
+
+    The fights of the rounds up to lastVerifiedRound are final, so their aggregates can be reused.
+    """
+    finished = (api_battles_df["defenderScore"] == 8) | (api_battles_df["attackerScore"] == 8)
+    complete = finished & (api_battles_df["lastVerifiedRound"] >= api_battles_df["currentRound"] - 1)
+    return {int(battle_id): None if is_complete else max(int(last_verified_round), 0)
+            for battle_id, last_verified_round, is_complete in zip(
+            api_battles_df["battle_id"], api_battles_df["lastVerifiedRound"], complete)}
+
+
+async def refresh_verified_rounds(server: str, api_battles_df: pd.DataFrame) -> dict[int, int | None]:
+    """Re-read the verified rounds of the given battles (after cache_api_fights verified some more)."""
+    if api_battles_df.empty:
+        return {}
+    api_battles_df = await battle_db_utils.select_many_api_battles(
+        server, api_battles_df["battle_id"].tolist(),
+        columns=("battle_id", "currentRound", "lastVerifiedRound", "defenderScore", "attackerScore"))
+    return get_verified_rounds(api_battles_df)
+
+
+def is_complete(verified_rounds: dict) -> bool:
+    return all(round_id is None for round_id in verified_rounds.values())
+
+
+def is_valid(entry: dict, verified_rounds: dict) -> bool:
+    """Whether the entry covers the same battles, and all of its rounds are still verified."""
+    old_verified_rounds = entry["verified_rounds"]
+    return old_verified_rounds.keys() == verified_rounds.keys() and all(
+        round_id is None or (old_verified_rounds[battle_id] is not None and
+                             round_id >= old_verified_rounds[battle_id])
+        for battle_id, round_id in verified_rounds.items())
+
+
+def verified_condition(verified_rounds: dict) -> str:
+    """SQL condition for the verified rounds (battles that aren't in verified_rounds are considered verified)."""
+    open_battles = {k: v for k, v in verified_rounds.items() if v is not None}
+    if not open_battles:
+        return "TRUE"
+    rounds = " OR ".join(f"(battle_id = {battle_id} AND round_id <= {round_id})"
+                         for battle_id, round_id in open_battles.items())
+    return f"(battle_id NOT IN ({','.join(map(str, open_battles))}) OR {rounds})"
+
+
+def unverified_condition(verified_rounds: dict) -> str | None:
+    """SQL condition for the rounds that might still change (None if there aren't any)."""
+    rounds = " OR ".join(f"(battle_id = {battle_id} AND round_id > {round_id})"
+                         for battle_id, round_id in verified_rounds.items() if round_id is not None)
+    return f"({rounds})" if rounds else None
+
+
+def new_rounds_condition(old_verified_rounds: dict, verified_rounds: dict) -> str | None:
+    """SQL condition for the rounds verified since old_verified_rounds (None if there aren't any)."""
+    rounds = []
+    for battle_id, old_round_id in old_verified_rounds.items():
+        round_id = verified_rounds[battle_id]
+        if old_round_id is None or round_id == old_round_id:
+            continue
+        rounds.append(f"(battle_id = {battle_id} AND round_id > {old_round_id}" +
+                      ("" if round_id is None else f" AND round_id <= {round_id}") + ")")
+    return f"({' OR '.join(rounds)})" if rounds else None
+
+
+def merge(dfs: iter, group_by: list) -> pd.DataFrame:
+    """Merge partial aggregates of the same query: sums are added, and max_hit takes the max."""
+    dfs = [df for df in dfs if df is not None]
+    non_empty = [df for df in dfs if not df.empty]
+    if len(non_empty) <= 1:
+        return non_empty[0] if non_empty else dfs[0]
+    df = pd.concat(non_empty, ignore_index=True)
+    return df.groupby(group_by, as_index=False, sort=False, dropna=False).agg(
+        {column: "max" if column == "max_hit" else "sum" for column in df.columns if column not in group_by})
+
+
+async def merge_many(dfs_lists: iter, group_by_list: iter) -> list[pd.DataFrame]:
+    """Merge lists of partial aggregates, where the i-th frames are grouped by group_by_list[i]."""
+    return await bot.loop.run_in_executor(None, lambda: [
+        merge(dfs, list(group_by)) for *dfs, group_by in zip(*dfs_lists, group_by_list)])
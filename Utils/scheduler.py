@@ -0,0 +1,157 @@
+"""One heap-based scheduler for the periodic jobs (reminders, watches, pings, motivate)."""
+import asyncio
+import heapq
+import logging
+from itertools import count
+from time import time
+from typing import Awaitable, Callable
+
+logger = logging.getLogger()
+
+# handler(job_id, data) -> seconds until its next run, or None when it's done. It may update data (it's saved).
+Handler = Callable[[str, dict], Awaitable[float | None]]
+
+
+class Scheduler:
+    """Runs all the timed jobs (reminders, watches, pings...) from one heap.
+
+    A single task wakes up every `tick` seconds and queues the due jobs, and `workers` tasks run them,
+    so the number of tasks doesn't depend on the number of jobs.
+    The jobs are saved in the collection store ("collection", "scheduler") once per tick at most,
+    and resume after a restart.
+    """
+
+    def __init__(self, store, tick: float = 1, workers: int = 10, start_rate: float = 5,
+                 _id: str = "scheduler") -> None:
+        self.store = store
+        self.tick = tick
+        self.workers = workers
+        self._id = _id
+        self.handlers: dict[str, Handler] = {}
+        self.jobs: dict[str, dict] = {}  # job_id -> {"kind": str, "when": float, "data": dict}
+        self.heap: list[tuple[float, int, str]] = []  # (when, seq, job_id), entries of replaced jobs are skipped
+        self.seq = count()
+        self.running = set()
+        self.queue = asyncio.Queue()
+        self.tasks = []
+        self.dirty = False
+        self.start_rate = start_rate  # jobs per second, for the first runs after a restart
+        self.next_slot = 0.0
+
+    def register(self, kind: str, handler: Handler) -> None:
+        self.handlers[kind] = handler
+
+    def is_scheduled(self, job_id: str) -> bool:
+        return job_id in self.jobs
+
+    def get(self, job_id: str) -> dict | None:
+        """The data of a scheduled job (it can be updated in place)."""
+        job = self.jobs.get(job_id)
+        return job["data"] if job else None
+
+    def time_left(self, job_id: str) -> float:
+        return self.jobs[job_id]["when"] - time()
+
+    def startup_delay(self, delay: float = 0) -> float:
+        """`delay`, or a later one that spreads the first runs after a restart over the rate budget
+        (start_rate jobs per second). A slot of the budget is taken only if it's needed."""
+        slot = max(self.next_slot, time()) + 1 / self.start_rate
+        if time() + delay >= slot:
+            return delay
+        self.next_slot = slot
+        return slot - time()
+
+    def push(self, job_id: str) -> None:
+        heapq.heappush(self.heap, (self.jobs[job_id]["when"], next(self.seq), job_id))
+
+    async def save(self) -> None:
+        if self.dirty:
+            self.dirty = False
+            await self.store.replace_one("collection", self._id, self.jobs)
+
+    async def schedule(self, job_id: str, kind: str, data: dict, delay: float = 0, replace: bool = True) -> None:
+        """Run handlers[kind](job_id, data) in `delay` seconds.
+
+        A job with the same id is replaced, or kept as it is if not `replace`. A job that isn't replaced is being
+        restored, so it's spread by startup_delay.
+        """
+        if not replace:
+            if job_id in self.jobs:
+                return
+            delay = self.startup_delay(delay)
+        self.jobs[job_id] = {"kind": kind, "when": time() + delay, "data": data}
+        if job_id not in self.running:
+            self.push(job_id)
+        self.dirty = True
+
+    async def cancel(self, job_id: str) -> None:
+        if self.jobs.pop(job_id, None) is not None:
+            self.dirty = True
+
+    def start(self) -> None:
+        """Load the saved jobs, and start the tick and the workers.
+
+        The jobs that became due while the bot was down are spread by startup_delay, instead of running at once.
+        """
+        if self.tasks:
+            return
+        jobs = self.store.load("collection", self._id)
+        for job_id, job in sorted(jobs.items(), key=lambda item: item[1]["when"]):
+            if job["kind"] in self.handlers:
+                if job["when"] <= time():
+                    job["when"] = time() + self.startup_delay()
+                self.jobs[job_id] = job
+                self.push(job_id)
+            else:
+                logger.warning(f"scheduler: no handler for {job_id=}")
+        self.tasks = [asyncio.create_task(self.tick_loop())]
+        self.tasks.extend(asyncio.create_task(self.worker()) for _ in range(self.workers))
+
+    async def close(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        self.tasks.clear()
+        await self.save()
+
+    async def tick_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.save()
+            except Exception as error:
+                logger.error(f"scheduler: failed to save the jobs: {error}")
+            now = time()
+            while self.heap and self.heap[0][0] <= now:
+                when, _, job_id = heapq.heappop(self.heap)
+                job = self.jobs.get(job_id)
+                if job is None or job["when"] != when or job_id in self.running:
+                    continue  # cancelled, rescheduled or already running
+                self.running.add(job_id)
+                self.queue.put_nowait(job_id)
+
+    async def worker(self) -> None:
+        while True:
+            job_id = await self.queue.get()
+            await self.run(job_id)
+
+    async def run(self, job_id: str) -> None:
+        job = self.jobs.get(job_id)
+        try:
+            if job is None:  # cancelled while it was queued
+                return
+            delay = await self.handlers[job["kind"]](job_id, job["data"])
+        except Exception as error:
+            logger.error(f"scheduler: {job_id=} failed: {error!r}")
+            delay = None
+        finally:
+            self.running.discard(job_id)
+        if self.jobs.get(job_id) is not job:
+            if job_id in self.jobs:  # scheduled again while it was running
+                self.push(job_id)
+            return
+        if delay is None:
+            del self.jobs[job_id]
+        else:
+            job["when"] = time() + delay
+            self.push(job_id)
+        self.dirty = True
@@ -27,6 +27,15 @@ def get_id(link: str, parameter: str = "id") -> int:
     return int(link.split(parameter + "=")[1].split("&")[0])
 
 
+def get_tournament_link(link: str) -> str | None:
+    """Get the normalized tournament link, or None if it's not a tournament link."""
+    link = link.split("#")[0].replace("http://", "https://")  # noqa WPS221
+    if any(x in link for x in ("tournamentEvent.html?id=", "teamTournament.html?id=",
+                               "countryTournament.html?id=")):
+        return link
+    return None
+
+
 class Period(Transformer):
     """Period."""
 
@@ -175,9 +184,8 @@ class TournamentLink(Transformer):
     """TournamentLink."""
 
     async def transform(self, interaction: Interaction, tournament_link: str) -> str:
-        link = tournament_link.split("#")[0].replace("http://", "https://")  # noqa WPS221
-        if any(x in link for x in ("tournamentEvent.html?id=", "teamTournament.html?id=",
-                                   "countryTournament.html?id=")):
+        link = get_tournament_link(tournament_link)
+        if link:
             return link
         raise TransformerError(tournament_link, self.type, self)
 
@@ -1,20 +1,17 @@
 """Utils.py."""
-import json
 import logging
 import random
 from asyncio import sleep
+from bisect import bisect_right
 from collections import defaultdict
 from copy import deepcopy
 from csv import reader
 from datetime import date, datetime, timedelta, UTC
 from io import BytesIO, StringIO
-from itertools import islice
-from os import path
 from re import finditer, findall
 from traceback import format_exception
-from typing import Tuple, Dict, Iterable, Container, Callable, Optional
+from typing import AsyncContextManager, Tuple, Dict, Iterable, Container, Callable, Optional
 
-from PIL import Image, ImageDraw, ImageFont
 from aiohttp import ClientSession, ClientTimeout
 from discord import Embed, File, Interaction, Message
 from discord.app_commands import CheckFailure
@@ -22,21 +19,19 @@ from discord.ext import tasks
 from discord.ext.commands import BadArgument, Cooldown
 from discord.utils import MISSING
 from lxml.html import fromstring, HtmlElement
-from matplotlib import pyplot as plt
-from matplotlib.dates import DateFormatter
-from matplotlib.ticker import FixedLocator
 from pytz import timezone
-from tabulate import tabulate
 
 from bot.bot import bot
+from .collection_store import Snapshot
 from .constants import (all_countries, all_parameters, all_servers, api_url,
                         config_ids, countries_per_id, countries_per_server,
                         date_format, flags_codes)
 from .paginator import FieldPageSource, Pages
 from .db_utils import execute_query
+from . import plot_utils
+from .plot_utils import draw_pil_table, human_format, plt_to_bytes  # noqa F401 (used as utils.*)
 
 hidden_guild = config_ids["commands_server_id"]
-font = ImageFont.truetype(path.join(path.dirname(path.dirname(__file__)), "files", "DejaVuSansMono.ttf"), 100)
 logger = logging.getLogger()
 
 
@@ -77,22 +72,6 @@ def server_validation(server: str) -> str:
     raise CheckFailure(f"`{server}` is not a valid server.\nValid servers: " + ", ".join(all_servers))
 
 
-def human_format(num: float) -> str:
-    """Number to human format."""
-    magnitude = 0
-    while abs(num) >= 1000:
-        magnitude += 1
-        num /= 1000
-
-    if num < 10:
-        precision = 2
-    elif num < 100:
-        precision = 1
-    else:
-        precision = 0
-    return f'{num:.{precision}f}' + ['', 'K', 'M', 'B', 'T', 'P'][magnitude]
-
-
 def split_list(alist: list | tuple, wanted_parts: int) -> tuple:
     """Split list into parts."""
     length = len(alist)
@@ -101,18 +80,6 @@ def split_list(alist: list | tuple, wanted_parts: int) -> tuple:
     return tuple(x for x in small_lists if x)
 
 
-def draw_pil_table(my_table: list | tuple, header: list | tuple, new_lines: int = 0) -> BytesIO:
-    """Draw table."""
-    tabulate_table = tabulate(my_table, headers=header, tablefmt='grid', numalign="center", stralign="center")
-    table_len = len(tabulate_table) / (len(my_table) * 2 + 3 + new_lines)
-    img = Image.new('RGB', (int(60 * table_len), 300 + new_lines * 100 + len(my_table) * 200), color=(44, 47, 51))
-    ImageDraw.Draw(img).text((10, 10), tabulate_table, font=font)
-    output_buffer = BytesIO()
-    img.save(output_buffer, format='JPEG', subsampling=0, quality=95)
-    output_buffer.seek(0)
-    return output_buffer
-
-
 def bar(defender_dmg: int, attacker_dmg: int, defender: str = "", attacker: str = "", size: int = -1) -> str:
     """Bar."""
     if size < 0:
@@ -135,21 +102,14 @@ def bar(defender_dmg: int, attacker_dmg: int, defender: str = "", attacker: str
     return value
 
 
+async def render(func: Callable, *args) -> BytesIO:
+    """Draw an image with a plot_utils function, in the render processes."""
+    return await bot.renderer.render(func, *args)
+
+
 async def dmg_trend(hit_time: dict, server: str, battle_id: str) -> BytesIO:
     """Dmg trend."""
-    fig, ax = plt.subplots()
-    for side, DICT in hit_time.items():
-        ax.plot(DICT["time"], DICT["dmg"], label=side)
-    ax.legend()
-    ax.xaxis.set_major_formatter(DateFormatter("%d-%m %H:%M"))
-    fig.autofmt_xdate()
-    ax.set_title(f"Dmg Trend ({server}, {battle_id})")
-    ax.set_ylabel('DMG')
-    ax.set_xlabel('Time')
-    ax.yaxis.set_major_locator(FixedLocator(ax.get_yticks()))
-    ax.set_yticklabels([human_format(x) for x in ax.get_yticks().tolist()])
-    ax.grid()
-    return plt_to_bytes(fig)
+    return await render(plot_utils.dmg_trend, hit_time, server, battle_id)
 
 
 async def get_auction(link: str) -> dict:
@@ -187,25 +147,22 @@ async def save_dmg_time(api_fights: str, attacker: str, defender: str) -> Tuple[
     return my_dict, hit_time
 
 
-def plt_to_bytes(fig: plt.Figure) -> BytesIO:
-    output_buffer = BytesIO()
-    fig.tight_layout()
-    fig.savefig(output_buffer)
-    plt.close(fig)
-    output_buffer.seek(0)
-    return output_buffer
-
-
 async def _stop_alert(channel_id: str) -> None:
     await sleep(30)
-    db_dict = await find_one("collection", "alert")
-    for name_for_db in list(db_dict):
-        for x in db_dict[name_for_db]:
-            if channel_id in x:
-                db_dict[name_for_db].remove(x)
+    async with edit("collection", "alert") as db_dict:
+        for name_for_db in list(db_dict):
+            db_dict[name_for_db] = [x for x in db_dict[name_for_db] if x.split()[-2] != channel_id]
             if not db_dict[name_for_db]:
                 del db_dict[name_for_db]
-    await replace_one("collection", "alert", db_dict)
+    stopping_alerts.discard(channel_id)
+
+
+async def _send_alert(channel_id: str, message: str) -> None:
+    """Send an alert, then remove the alerts of its channel (they fire once, like before)."""
+    channel = bot.get_channel(int(channel_id))
+    if channel is None or not await bot.notifier.send(channel, message):
+        logger.warning(f"alert: failed to send to {channel_id=}, removing its alerts")
+    await _stop_alert(channel_id)
 
 
 """
@@ -221,30 +178,78 @@ async def update_donors():
 """
 
 
-@tasks.loop(seconds=1000)
+def get_alerts_index(alerts: dict) -> dict[tuple[str, str], list[tuple[float, str]]]:
+    """(server, product) -> its alerts as (price, channel_id), sorted by price (an index for the alert snapshot).
+
+    The product includes the quality (e.g. "Q5 Weapon"), like in the price documents.
+    """
+    index = defaultdict(list)
+    for name_for_db, list_of_requests in alerts.items():
+        server, product_name = name_for_db.split(" ", 1)
+        for string in list_of_requests:
+            channel_id, price = string.split()[-2:]
+            index[(server, product_name)].append((float(price), channel_id))
+    return {key: sorted(value) for key, value in index.items()}
+
+
+def get_triggered_alerts(thresholds: list[tuple[float, str]], best_price: float) -> list[tuple[float, str]]:
+    """The alerts (sorted, see get_alerts_index) whose price is above best_price."""
+    # "~" sorts after any channel id, so the alerts of exactly best_price are not included
+    return thresholds[bisect_right(thresholds, (best_price, "~")):]
+
+
+def get_best_prices(prices: dict) -> dict[str, float]:
+    """product -> its lowest price (an index for the price snapshots)."""
+    return {product_name: rows[0][0] for product_name, rows in prices.items() if rows}
+
+
+checked_prices: dict[tuple[str, str], float] = {}  # (server, product) -> the best price its alerts were checked with
+checked_alerts: dict[tuple[str, str], list] = {}  # (server, product) -> its alerts, when they were last checked
+stopping_alerts = set()  # channels whose alerts are being removed
+
+
+async def check_alerts(server: str) -> None:
+    """Evaluate only the alerts of the products whose best price changed, and the new alerts.
+
+    Each product costs a bisect over its sorted thresholds, instead of going over all the alerts.
+    """
+    alerts_index = (await get_snapshot("collection", "alert")).get_index(get_alerts_index)
+    best_prices = (await get_snapshot("price", server)).get_index(get_best_prices)
+    for product_name, best_price in best_prices.items():
+        key = (server, product_name)
+        thresholds = alerts_index.get(key)
+        if not thresholds:
+            continue
+        if checked_prices.get(key) == best_price and checked_alerts.get(key) is thresholds:
+            continue
+        checked_prices[key], checked_alerts[key] = best_price, thresholds
+        for price, channel_id in get_triggered_alerts(thresholds, best_price):
+            if channel_id in stopping_alerts:
+                continue
+            stopping_alerts.add(channel_id)
+            bot.loop.create_task(_send_alert(
+                channel_id, f"The price of {product_name} at {server} is {best_price} (below {price:g})\n"
+                            f"For more info, type /price"))
+
+
+async def on_price_replace(server: str) -> None:
+    """Called after /price writes the prices of a server."""
+    try:
+        await check_alerts(server)
+    except Exception as error:
+        await send_error(None, error, cmd="alert")
+
+
+@tasks.loop(seconds=60)
 async def alert() -> None:
-    """Alert."""
+    """Check the alerts of the servers whose prices were written by update_db (another process).
+
+    A server whose price document didn't change costs a version check (a stat), not a read.
+    """
     try:
-        for name_for_db, list_of_requests in (await find_one("collection", "alert")).items():
-            name_for_db = name_for_db.split()
-            server, product_name = name_for_db[0], " ".join(name_for_db[1:])
-            prices = await find_one("price", server)
-            try:
-                row = prices[product_name][0]
-            except (KeyError, IndexError):
-                continue
-            for string in list_of_requests:
-                channel_id, price = string.split()[-2:]
-                try:
-                    channel = bot.get_channel(int(channel_id))
-                    if row[0] < float(price):
-                        await channel.send(f"The price of {product_name} at {server} is {row[0]} (below {price})\n"
-                                           f"For more info, type /price")
-                        await _stop_alert(channel_id)
-                        continue
-                except Exception:
-                    await _stop_alert(channel_id)
-                await sleep(1)
+        for server in {server for server, _ in (await get_snapshot("collection", "alert")).get_index(
+                get_alerts_index)}:
+            await check_alerts(server)
     except Exception as error:
         await send_error(None, error, cmd="alert")
 
@@ -504,10 +509,10 @@ async def default_nick(interaction: Interaction, server: str, nick: str = "-") -
     return nick or interaction.user.name
 
 
-async def custom_delay(interaction: Interaction) -> None:
-    """Custom delay."""
+async def custom_delay(interaction: Interaction | None) -> None:
+    """Custom delay (the default one for background tasks)."""
     # TODO: remove this and instead add a dynamic delay based on server load
-    await sleep(bot.custom_delay_dict.get(str(interaction.user.id), 0.4))
+    await sleep(bot.custom_delay_dict.get(str(interaction.user.id), 0.4) if interaction else 0.4)
 
 
 def get_formatted_interaction(interaction: Interaction | None, bold: bool = True) -> str | None:
@@ -650,15 +655,6 @@ async def send_long_embed(interaction: Interaction, embed: Embed, headers: list
     await pages.start(files=files)
 
 
-async def csv_to_image(output: StringIO, columns: int = 10, rows: int = 10):
-    """Convert csv file to image."""
-    file_iter = reader(output)
-    headers = tuple(next(file_iter))
-    table = tuple(row[:columns] for row in islice(file_iter, rows))
-    output.seek(0)
-    return await bot.loop.run_in_executor(None, draw_pil_table, table, headers)
-
-
 async def last_page(link: str, func=get_content, **kwargs) -> int:
     """Get last page."""
     tree = await func(link, **kwargs)
@@ -835,20 +831,39 @@ async def get_battles(base_url: str, country_id: int = 0,
 
 
 async def find_one(collection: str, _id: str) -> dict:
-    """Find one."""  # TODO: use msgpack
-    filename = path.join(path.dirname(bot.root), f"db/{collection}_{_id}.json")
-    if path.exists(filename):
-        with open(filename, encoding='utf-8') as file:
-            return json.load(file)
-    else:
-        return {}
+    """Find one."""
+    return await bot.store.find_one(collection, _id)
 
 
 async def replace_one(collection: str, _id: str, data: dict) -> None:
     """Replace one."""
-    filename = path.join(path.dirname(bot.root), f"db/{collection}_{_id}.json")
-    with open(filename, "w", encoding='utf-8', errors='ignore') as file:
-        json.dump(data, file)
+    await bot.store.replace_one(collection, _id, data)
+
+
+def edit(collection: str, _id: str) -> AsyncContextManager[dict]:
+    """Read, modify and replace one, with no other write in between (`async with utils.edit(...) as data:`)."""
+    return bot.store.edit(collection, _id)
+
+
+async def get_snapshot(collection: str, _id: str) -> Snapshot:
+    """A shared, read only, copy of one (re-read only after it changes, e.g. update_db's buffs and prices)."""
+    return await bot.store.get_snapshot(collection, _id)
+
+
+def get_buffed_at(buffs: dict) -> dict[str, datetime]:
+    """When each player in a buffs document was buffed (an index for its snapshot)."""
+    return {nick: datetime.strptime(row[5], date_format) for nick, row in buffs.items()
+            if row[5] and nick != "Nick" and "Last update" not in nick}
+
+
+async def find_keys(collection: str, _id: str, keys: iter) -> dict:
+    """Find the given keys of one (the other keys aren't read, with the SQLite backend)."""
+    return await bot.store.find_keys(collection, _id, keys)
+
+
+async def update_keys(collection: str, _id: str, data: dict, removed: iter = ()) -> None:
+    """Update (and remove) the given keys of one."""
+    await bot.store.update_keys(collection, _id, data, removed)
 
 
 async def remove_old_donors():
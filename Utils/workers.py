@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Callable
+
+from discord import Interaction, Message
+
+from bot.bot import bot
+
+logger = logging.getLogger()
+
+
+class JobCancelled(Exception):
+    """The user cancelled the command while its job was running."""
+
+
+class WorkerPool:
+    """Process pool for CPU-heavy analytics, so they don't block the event loop.
+
+    Jobs must be picklable: module level functions (in modules that don't import the bot), with frames,
+    dicts or file paths as arguments.
+    A job that times out or gets cancelled kills the workers, and the other running (or queued) jobs are resubmitted.
+    """
+
+    # The forkserver is shared by all the pools, so its preload list is the union of theirs
+    preload = {"numpy", "pandas"}
+
+    def __init__(self, max_workers: int = None, timeout: float = 600, cancel_check_interval: float = 1,
+                 preload: iter = ()) -> None:
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.timeout = timeout
+        self.cancel_check_interval = cancel_check_interval
+        # forkserver: the workers don't inherit the bot's threads and sockets, and the main module is imported once
+        self.context = multiprocessing.get_context("forkserver")
+        WorkerPool.preload.update(preload)
+        self.context.set_forkserver_preload(sorted(WorkerPool.preload))
+        self.executor = None
+        self.closed = False
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """Get the executor, creating it if needed."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.max_workers, mp_context=self.context)
+        return self.executor
+
+    def restart(self, executor: ProcessPoolExecutor) -> None:
+        """Kill the workers of the given executor (if it's still the current one)."""
+        if executor is not self.executor:
+            return
+        self.executor = None
+        for process in list((executor._processes or {}).values()):  # noqa
+            process.terminate()
+        # The pending jobs fail with BrokenProcessPool, and their callers resubmit them
+        executor.shutdown(wait=False)
+
+    def shutdown(self) -> None:
+        """Shutdown the workers."""
+        self.closed = True
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def run(self, func: Callable, *args, interaction: Interaction = None, msg: Message = None,
+                  timeout: float = None):
+        """Run func(*args) in a worker process and return its result.
+
+        Raises TimeoutError after `timeout` seconds, and JobCancelled if bot.should_cancel(interaction, msg).
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        while True:
+            executor = self.get_executor()
+            job = executor.submit(func, *args)
+            future = asyncio.wrap_future(job)
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    done, _ = await asyncio.wait([future], timeout=min(self.cancel_check_interval, remaining))
+                    if done:
+                        if job.cancelled() and not self.closed:  # not by this caller, so like a killed worker
+                            raise BrokenProcessPool(f"{func.__name__} was dropped by the executor")
+                        return future.result()
+                    if interaction is not None and await bot.should_cancel(interaction, msg):
+                        self.abort(executor, job, future)
+                        raise JobCancelled(func.__name__)
+                    if remaining <= self.cancel_check_interval:
+                        self.abort(executor, job, future)
+                        raise TimeoutError(f"{func.__name__} took more than {timeout or self.timeout} seconds")
+            except BrokenProcessPool:
+                if executor is self.executor:  # not killed by another job
+                    self.restart(executor)
+                    raise
+                logger.info(f"WorkerPool: resubmitting {func.__name__} after another job was aborted")
+
+    def abort(self, executor: ProcessPoolExecutor, job: Future, future: asyncio.Future) -> None:
+        """Abort a job: drop it if it hasn't started yet, otherwise kill the workers."""
+        started = not job.cancel()
+        future.cancel()
+        if started:
+            self.restart(executor)
+
+
+class RenderPool(WorkerPool):
+    """Process pool for the plots and table images (Utils.plot_utils), so drawing doesn't block the event loop.
+
+    The workers preload matplotlib (Agg) and the fonts. At most max_concurrency renders are submitted at once,
+    and the others wait in line (queue_depth).
+    """
+
+    def __init__(self, max_workers: int = None, max_concurrency: int = None, timeout: float = 60) -> None:
+        super().__init__(max_workers or 2, timeout, preload=("matplotlib.pyplot", "Utils.plot_utils"))
+        self.semaphore = asyncio.Semaphore(max_concurrency or self.max_workers)
+        self.queue_depth = 0
+
+    async def render(self, func: Callable, *args) -> BytesIO:
+        """Run a plot_utils function in a render process, and return its image."""
+        waiting = True
+        self.queue_depth += 1
+        if self.semaphore.locked():
+            logger.debug(f"RenderPool: {func.__name__} is waiting, {self.queue_depth=}")
+        try:
+            async with self.semaphore:
+                waiting = False
+                self.queue_depth -= 1
+                return await self.run(func, *args)
+        finally:
+            if waiting:  # cancelled while waiting
+                self.queue_depth -= 1
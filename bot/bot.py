@@ -12,6 +12,7 @@ from discord import (AllowedMentions, Forbidden, Game, HTTPException, Intents,
                      Interaction, Message, NotFound, app_commands, InteractionType)
 from discord.ext.commands import Bot
 
+from Utils.collection_store import CollectionStore, default_msgpack_collections
 from Utils.constants import all_servers
 from Utils.db_utils import execute_query
 
@@ -31,16 +32,6 @@ async def load_extensions(reload: bool = False) -> None:
         break  # only walk the first level
 
 
-def find_one(collection: str, _id: str) -> dict:
-    """Find one."""
-    filename = os.path.join(os.path.dirname(root), f"db/{collection}_{_id}.json")
-    if os.path.exists(filename):
-        with open(filename, encoding='utf-8') as file:
-            return json.load(file)
-    else:
-        return {}
-
-
 class MyTree(app_commands.CommandTree):
     async def interaction_check(self, interaction: Interaction) -> bool:
         """Lock new server."""
@@ -115,12 +106,21 @@ class EsimBot(Bot):
 
         self.session = None
         self.locked_sessions = {}
-        self.phone_users = (find_one("collection", "phone") or {"users": []})["users"]
-        self.default_nick_dict = find_one("collection", "default")
-        self.premium_users = find_one("collection", "donors")
-        self.premium_servers = (find_one("collection", "premium_guilds") or {"guilds": []})["guilds"]
-        self.custom_delay_dict = find_one("collection", "delay")
+        # the bot is the only writer of the "collection" documents, so they can be kept in memory
+        self.store = CollectionStore(os.path.join(os.path.dirname(root), "db"),
+                                     self.config.get("cached_collections", ["collection"]),
+                                     self.config.get("store_flush_interval", 5),
+                                     self.config.get("msgpack_collections", default_msgpack_collections))
+        self.phone_users = (self.store.load("collection", "phone") or {"users": []})["users"]
+        self.default_nick_dict = self.store.load("collection", "default")
+        self.premium_users = self.store.load("collection", "donors")
+        self.premium_servers = (self.store.load("collection", "premium_guilds") or {"guilds": []})["guilds"]
+        self.custom_delay_dict = self.store.load("collection", "delay")
         self.pool: asyncmy.Pool = None  # type: ignore
+        self.workers = None  # Utils.workers.WorkerPool
+        self.renderer = None  # Utils.workers.RenderPool
+        self.scheduler = None  # Utils.scheduler.Scheduler
+        self.notifier = None  # Utils.notifier.Notifier
         self.logger = logging.getLogger()
 
     async def setup_hook(self) -> None:
@@ -133,6 +133,7 @@ class EsimBot(Bot):
         for key in ("db_host", "db_user", "db_password"):
             self.config.pop(key, None)
 
+        self.store.start()
         await load_extensions()
 
     async def close(self):
@@ -142,6 +143,15 @@ class EsimBot(Bot):
             await session.close()
         if self.pool is not None:
             self.pool.close()
+        if self.workers is not None:
+            self.workers.shutdown()
+        if self.renderer is not None:
+            self.renderer.shutdown()
+        if self.scheduler is not None:
+            await self.scheduler.close()
+        if self.notifier is not None:
+            self.logger.info(f"Notifier: {self.notifier.stats()}")
+        await self.store.close()
         await super().close()
 
     async def __aexit__(self, *excinfo):
@@ -1,13 +1,11 @@
 """Battle.py."""
-import math
 import statistics
 import traceback
 from asyncio import sleep
 from collections import defaultdict
 from copy import deepcopy
-from csv import writer
 from datetime import datetime, timedelta
-from io import BytesIO, StringIO
+from io import BytesIO
 from json import loads
 from random import randint
 
@@ -16,15 +14,16 @@ from discord.app_commands import (Transform, check, checks, command, describe,
                                   guild_only)
 from discord.ext.commands import Cog, Context, hybrid_command
 from matplotlib import pyplot as plt
-import numpy as np
 
-from Utils import utils, UiButtons
+from Utils import battles_list, drops_utils, utils, UiButtons
 from Utils.DmgCalculator import dmg_calculator
-from Utils.battle_utils import (cup_func, motivate_func, normal_pdf, binom_pmf, ping_func,
-                                watch_auction_func, watch_func)
+from Utils.battle_utils import (cup_func, get_tournament_battle_ids,
+                                schedule_auction, schedule_motivate,
+                                schedule_ping, schedule_watch)
 from Utils.constants import (all_countries, all_countries_by_name, all_servers,
-                             date_format, gids)
+                             gids)
 from Utils.dmg_func import dmg_func
+from Utils.export_utils import CsvExport
 from Utils.transformers import (AuctionLink, BattleLink, Country, Server,
                                 TournamentLink)
 from Utils.utils import CoolDownModified, bar, draw_pil_table, not_support
@@ -66,11 +65,12 @@ class Battle(Cog):
             mu_name = ""
 
         result = []
-        buffed_players_dict = await utils.find_one("buffs", server)
+        buffs = await utils.get_snapshot("buffs", server)
+        buffed_at = buffs.get_index(utils.get_buffed_at)
         now = utils.get_current_time(timezone_aware=False)
         total_buff = 0
         total_debuff = 0
-        for current_nick, row in buffed_players_dict.items():
+        for current_nick, row in buffs.data.items():
             if current_nick == "Nick" or "Last update" in current_nick:
                 continue
             link, citizenship, dmg, last, premium, buffed, _, till_change, _, _, _, _ = row[:12]
@@ -83,7 +83,7 @@ class Battle(Cog):
             hyperlink = (":star:" if premium else ":lock:") + country_nick
 
             # A buff last for 24 hours
-            if (now - datetime.strptime(buffed, date_format)).total_seconds() < 24 * 60 * 60:
+            if (now - buffed_at[current_nick]).total_seconds() < 24 * 60 * 60:
                 buff = ":green_circle: "
                 total_buff += 1
             else:
@@ -111,7 +111,7 @@ class Battle(Cog):
         embed.set_footer(text="\U00002b50 / \U0001f512 = Premium / Non Premium\n"
                               "\U0001f7e2 / \U0001f534 = Buff / Debuff\n"
                               f"\U0001f505 / \U0001f506 = Below / Above median total dmg ({round(median_dmg):,})\n"
-                              f"Last update: {buffed_players_dict['Last update:'][0]}")
+                              f"Last update: {buffs.data['Last update:'][0]}")
         headers = ("Nick, Citizenship" if not country else "Nick", "Last Seen (game time)", "Till Debuff (over)")
         await utils.send_long_embed(interaction, embed, headers, result)
 
@@ -150,13 +150,7 @@ class Battle(Cog):
         await utils.default_nick(interaction, server, nick)
         find_cup = await utils.find_one("collection", interaction.command.name)
         if link not in find_cup or len(find_cup[link]) >= 10:
-            if "countryTournament" not in link:
-                tree = await utils.get_locked_content(link)
-            else:
-                tree = await utils.get_locked_content(link + "&hash=%23slideShedule", method="post")
-            ids = {int(x) for x in (
-                utils.get_ids_from_path(tree, '//*[@class="battle-link"]') if "countryTournament" not in link else
-                utils.get_ids_from_path(tree, '//*[@class="getBattle right"]'))}
+            ids = await get_tournament_battle_ids(link)
             if ids:
                 find_cup[link] = [
                     {str(interaction.channel.id): {"nick": nick, "author_id": str(interaction.user.id)}}]
@@ -325,71 +319,22 @@ class Battle(Cog):
             except Exception:
                 nick = ""
 
-        final = defaultdict(lambda: defaultdict(tuple))
-        qualities = set()
         all_total_tops = {index: sum(x['tops'][index] for x in tops_per_player.values()) for index in range(3)}
+        final, qualities, plots, mean_values, max_k = await self.bot.workers.run(
+            drops_utils.get_drops_chances, dict(tops_per_player), drops_per_q, hits, bonus,
+            given_user_id if nick else None, interaction=interaction)
         fig, ax = plt.subplots()
-
-        indexes = {"Q3": top10, "Q4": top3, "Q5": top1, "Q6": top1}
-        mean_values = []
-        max_k = 0
-        for user_id, value in tops_per_player.items():
-            player = given_user_id if nick else user_id
-            if player != user_id:
-                continue
-            for quality, total_drops in {k: v[0] for k, v in drops_per_q.items()}.items():
-                if quality in indexes:
-                    total_tops = all_total_tops[indexes[quality]]
-                    my_tops = value['tops'][indexes[quality]] if 'tops' in value else 0
-                elif "upg" in quality:
-                    total_tops = hits
-                    my_tops = value['hits']
-                else:
-                    total_tops = hits_with_bonus
-                    my_tops = value['hits'] + value['hits'] * bonus / 100
-
-                n = total_drops
-                p = (my_tops / total_tops) if total_tops else 0
-                mean = n * p  # mu
-                mean_values.append(mean)
-                std = math.sqrt(mean * (1 - p))  # sigma
-                if n * p >= 5 and n * (1 - p) >= 5:
-                    # normal approx
-                    percentages = [normal_pdf(k, mean, std) * 100 for k in range(n + 1)]
-                else:
-                    probs = binom_pmf(n, p)
-                    percentages = [p * 100 for p in probs]
-
-                cum_sum = np.cumsum(percentages)
-                # keep only values below 99.9
-                percentages = [percentages[i] for i in range(len(cum_sum)) if cum_sum[i] < 99.9] or percentages
-
-                max_k = max(max_k, len(percentages))
-
-                first, last = round(mean - std), round(mean + std)
-                if total_drops and my_tops:
-                    if first == 0:
-                        drops_range = "1" if total_drops == 1 else "1+"
-                        chances = 100 - percentages[0]
-                    else:
-                        drops_range = f"{first}-{last}" if first != last else str(first)
-                        chances = sum(percentages[first:last + 1])
-                    final[player][quality] = (drops_range, f"{round(chances)}%")
-                    qualities.add(quality)
-                else:
-                    final[player][quality] = (0, "100%")
-
-                if nick and len(percentages) > 1:
-                    amounts = list(range(1, len(percentages) + 1))
-                    await self.bot.loop.run_in_executor(None, lambda: ax.plot(
-                        amounts, percentages, marker='.', label=quality))
+        for quality, percentages in plots:
+            amounts = list(range(1, len(percentages) + 1))
+            await self.bot.loop.run_in_executor(None, lambda: ax.plot(
+                amounts, percentages, marker='.', label=quality))
 
         csv_writer = None
         if not nick:
             qualities = sorted(qualities, reverse=True)
             headers = tuple(a for a in ((f"{x} Prediction Range", f"{x} chance") for x in qualities) for a in a)
-            output = StringIO()
-            csv_writer = writer(output)
+            output = CsvExport()
+            csv_writer = output.writer
             csv_writer.writerow(("Citizen Id", "Hits", "Top 1", "Top 3", "Top 10") + headers)
         for player, chances in final.items():
             if not nick:
@@ -434,11 +379,9 @@ class Battle(Cog):
                 await utils.custom_followup(interaction, file=file, embed=await utils.convert_embed(interaction, embed))
 
         if not nick:
-            output.seek(0)
             await utils.custom_followup(interaction, "Chances of receiving **at least** x amount of drops", files=[
-                File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"),
-                File(fp=BytesIO(output.getvalue().encode()),
-                     filename=f"Chances_{link.split('battle.html?id=')[1]}.csv")],
+                await output.preview(f"Preview_{server}.png"),
+                output.to_file(f"Chances_{link.split('battle.html?id=')[1]}.csv")],
                                         embed=await utils.convert_embed(interaction, embed))
 
     @checks.dynamic_cooldown(CoolDownModified(5))
@@ -488,7 +431,7 @@ class Battle(Cog):
         if server not in db_dict:
             db_dict[server] = [str(interaction.channel.id)]
             await utils.replace_one("collection", "motivate", db_dict)
-            self.bot.loop.create_task(motivate_func(self.bot, server, db_dict))
+            await schedule_motivate(self.bot, server)
         elif str(interaction.channel.id) not in db_dict[server]:
             db_dict[server].append(str(interaction.channel.id))
             await utils.replace_one("collection", "motivate", db_dict)
@@ -596,42 +539,41 @@ class Battle(Cog):
                     country: Transform[str, Country] = "") -> None:
         """Displays the upcoming battles."""
         base_url = f'https://{server}.e-sim.org/'
-        battles = await utils.get_battles(base_url, all_countries_by_name.get(country.lower(), 0))
+        snapshot = await battles_list.get(server)
+        battles = snapshot.get_battles(country)
 
         if not battles:
             await utils.custom_followup(interaction, "There are currently no active RWs or attacks.")
             return
-        battles = sorted(battles, key=lambda k: k['time_remaining'])
-        last = battles[-1]["time_remaining"]
+        rounds = [(x["battle_id"], x["round"]) for x in battles]
         headers = ("**Time remaining**", "**Defender | Attacker (Score)**", "**Bar**")
         battles = tuple(
-            (x["time_remaining"],
+            (str(timedelta(seconds=max(int(snapshot.seconds_left(x)), 0))),
              f"[{utils.shorten_country(x['defender']['name'])} vs " + utils.shorten_country(x['attacker']['name']) +
              f"]({base_url}battle.html?id={x['battle_id']}) ({x['defender']['score']}:{x['attacker']['score']})",
              (bar(x['defender']['bar'], x['attacker']['bar'], size=6)).splitlines()[0]) for x in battles)
         embed = Embed(colour=0x3D85C6, title=server, url=f'{base_url}battles.html')
         await utils.send_long_embed(interaction, embed, headers, battles)
-        time_of_last = int(last.split(":")[0]) * 3600 + int(last.split(":")[1]) * 60 + int(last.split(":")[2])
         del battles
 
         update_seconds = 60
+        time_of_last = 1
         while time_of_last > 0:
-            await sleep(min(time_of_last, update_seconds))
+            await sleep(update_seconds)
+            snapshot = await battles_list.get(server)
             values = embed.fields[0].value.splitlines()
-            for num, value in enumerate(values):
-                if "round is over" in value:
-                    continue
-                value = value.split()[0]
-                actual_time = int(value.split(":")[0]) * 3600 + int(value.split(":")[1]) * 60 + int(
-                    value.split(":")[2]) - update_seconds
-                values[num] = str(timedelta(seconds=actual_time)) if actual_time > 0 else "round is over"
+            time_of_last = 0
+            for num, (battle_id, current_round) in enumerate(rounds[:len(values)]):
+                battle = snapshot.battles.get(battle_id)
+                seconds_left = int(snapshot.seconds_left(battle)) if battle and battle["round"] == current_round else 0
+                values[num] = str(timedelta(seconds=seconds_left)) if seconds_left > 0 else "round is over"
+                time_of_last = max(time_of_last, seconds_left)
             embed.set_field_at(0, name=embed.fields[0].name, value="\n".join(values))
             embed.timestamp = datetime.now()
             try:
                 await interaction.edit_original_response(embed=await utils.convert_embed(interaction, deepcopy(embed)))
             except Exception:
                 return
-            time_of_last -= update_seconds
 
     @checks.dynamic_cooldown(CoolDownModified(10))
     @command()
@@ -696,7 +638,9 @@ class Battle(Cog):
             valid_neighbour_ids = set()
         api_map.clear()
         table = []
-        find_buff = await utils.find_one("buffs", server)
+        buffs = await utils.get_snapshot("buffs", server)
+        find_buff = buffs.data
+        buffed_at = buffs.get_index(utils.get_buffed_at)
         now = utils.get_current_time(timezone_aware=False)
         header = ()
         for row in await utils.get_content(f"{base_url}apiOnlinePlayers.html?countryId={country}"):
@@ -727,8 +671,8 @@ class Battle(Cog):
                         table.append([name, level, dmg, location, buffs, debuffs])
             else:
                 if name in find_buff and find_buff[name][5]:
-                    buff = ":red_circle: " if not (now - datetime.strptime(
-                        find_buff[name][5], date_format)).total_seconds() < 86400 else ":green_circle: "
+                    buff = ":red_circle: " if not (
+                            now - buffed_at[name]).total_seconds() < 86400 else ":green_circle: "
                     level = buff + str(level)
                     citizenship_name = find_buff[name][1]
                     name = f"{utils.get_flag_code(citizenship_name)} [{name}]({find_buff[name][0]})"
@@ -758,7 +702,9 @@ class Battle(Cog):
         else:
             new_lines = 0
             if server in gids:
-                buffed_players_dict = await utils.find_one("buffs", server)
+                buffs = await utils.get_snapshot("buffs", server)
+                buffed_players_dict = buffs.data
+                buffed_at = buffs.get_index(utils.get_buffed_at)
                 for row in table:
                     if row[0] not in buffed_players_dict or not buffed_players_dict[row[0]][5]:
                         continue
@@ -766,15 +712,15 @@ class Battle(Cog):
                     db_row = buffed_players_dict[row[0]]
                     index = None
                     if (utils.get_current_time(timezone_aware=False) -
-                        datetime.strptime(db_row[5], date_format)).total_seconds() < 86400:
+                        buffed_at[row[0]]).total_seconds() < 86400:
                         index = -2
                     if not db_row[5]:
                         index = -1
                     if index and row[index]:
                         row[index] += f"\n(Time left: {db_row[7].strip()})"
                         new_lines += 1
-            output_buffer = await self.bot.loop.run_in_executor(None, draw_pil_table, table, header, new_lines)
-            await utils.custom_followup(interaction, file=File(fp=output_buffer, filename=f'{server}.jpg'))
+            output_buffer = await utils.render(draw_pil_table, table, header, new_lines, True)
+            await utils.custom_followup(interaction, file=File(fp=output_buffer, filename=f'{server}.png'))
 
     @checks.dynamic_cooldown(CoolDownModified(10))
     @command()
@@ -799,7 +745,7 @@ class Battle(Cog):
         find_ping[ping_id] = {"t": t, "server": server, "country": country, "role": role,
                               "author_id": str(interaction.user.id)}
         await utils.replace_one("collection", "ping", find_ping)
-        await ping_func(interaction.channel, t, server, ping_id, country, role, interaction.user.id)
+        await schedule_ping(self.bot, ping_id, find_ping[ping_id])
 
     @checks.dynamic_cooldown(utils.CoolDownModified(2))
     @command()
@@ -931,7 +877,7 @@ class Battle(Cog):
             else:
                 find_auctions["auctions"].append(new_auction)
                 await utils.replace_one("collection", "auctions", find_auctions)
-                await watch_auction_func(interaction.channel, link, t, custom_msg)
+                await schedule_auction(self.bot, new_auction)
 
         else:
             link = f"https://{server}.e-sim.org/battle.html?id={link_id}"
@@ -962,7 +908,7 @@ class Battle(Cog):
                 find_watch["watch"].append(new_watch)
                 await utils.replace_one("collection", "watch", find_watch)
                 await utils.custom_followup(interaction, embed=await utils.convert_embed(interaction, embed))
-                await watch_func(self.bot, interaction.channel, link, t, role, custom_msg)
+                await schedule_watch(self.bot, new_watch)
 
     @checks.dynamic_cooldown(utils.CoolDownModified(5))
     @hybrid_command()
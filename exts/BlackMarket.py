@@ -194,7 +194,7 @@ class BlackMarket(GroupCog, name="black-market"):
         """Displays a list of items for a given user in the black market."""
         user = user or interaction.user
         data = await utils.find_one("collection", __name__)
-        rates = (await utils.find_one("collection", "rates")).get(str(user.id))
+        rates = (await utils.find_keys("collection", "rates", [str(user.id)])).get(str(user.id))
 
         results = {}
         for offer_id, offer_dict in data.items():
@@ -2,9 +2,7 @@
 import itertools
 import statistics
 from collections import defaultdict
-from csv import writer
 from datetime import datetime, timedelta
-from io import BytesIO, StringIO
 
 import matplotlib.axes
 import matplotlib.lines
@@ -17,13 +15,14 @@ from lxml import html
 from matplotlib import pyplot as plt
 from matplotlib.ticker import FixedLocator, MaxNLocator
 
-from Utils import utils
+from Utils import plot_utils, utils
 from Utils.constants import (all_countries, all_countries_by_name,
                              all_parameters, all_products, api_url, config_ids,
-                             date_format, temp_servers)
+                             date_format)
 from Utils.transformers import Country, Product, ProfileLink, Server
 from Utils.utils import CoolDownModified, draw_pil_table, split_list
 from Utils.db_utils import execute_query
+from Utils.export_utils import CsvExport
 
 
 class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": False}):
@@ -207,8 +206,8 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
         del regions_per_country
 
         result = []
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         csv_writer.writerow(["Estimate Time", "Region Id", "Region Name", "Country Id",
                              "Country Name", "Raw Richness", "Resource"])
         count = 1
@@ -229,11 +228,9 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
                       description=f"**ASSUMING npc have worked in region {region_id} at {hour}**")
         embed.set_footer(text="NPCs will probably work around the estimated hours.")
         headers = ("#", "Country", "Estimate Work Time")
-        output.seek(0)
         await utils.send_long_embed(interaction, embed, headers, result,
-                                    files=[File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"),
-                                           File(fp=BytesIO(output.getvalue().encode()),
-                                                filename=f"NPC_estimate_time_{server}.csv")])
+                                    files=[await output.preview(f"Preview_{server}.png"),
+                                           output.to_file(f"NPC_estimate_time_{server}.csv")])
 
     # This command is unavailable at the moment (no e-sim premium access)
     # @check(utils.is_premium_level_1)
@@ -267,8 +264,8 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
             mm_dict[mm_name] = ratio
             await utils.custom_delay(interaction)
 
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         csv_writer.writerow(["NPC name", "Skill", "Salary", "CC", "Salary In Gold", "Company", "Company Link",
                              "Resource", "Raw Richness", "Region", "Region Id", "Country"])
         for index, row in enumerate(
@@ -289,10 +286,9 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
                     [name, skill, salary, cc, mm_dict.get(cc.lower(), 0) * salary, company, company_link,
                      row.get("resource", "").title(), row["rawRichness"].title().replace("None", ""),
                      row["name"], row['id'], (utils.get_countries(server, row["homeCountry"])).title()])
-        output.seek(0)
         await utils.custom_followup(interaction, mention_author=True, files=[
-            File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"),
-            File(fp=BytesIO(output.getvalue().encode()), filename="NPC_stats.csv")])
+            await output.preview(f"Preview_{server}.png"),
+            output.to_file("NPC_stats.csv")])
 
     @checks.dynamic_cooldown(CoolDownModified(25))
     @command()
@@ -350,7 +346,7 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
     @command()
     async def price_list(self, interaction: Interaction, server: Transform[str, Server]) -> None:
         """Displays a list of the cheapest prices in the given server."""
-        db_dict = await utils.find_one("price", server)
+        db_dict = (await utils.get_snapshot("price", server)).data
         embed = Embed(colour=0x3D85C6, title=server,
                       description=f"[All products]({self._get_product_sheet_link(server)}),"
                                   f" [API For developers]({api_url}/https:/{server}.e-sim.org/prices.html)")
@@ -380,7 +376,7 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
         best_price = 0
         embed: Embed = None
         if not real_time:
-            db_dict = await utils.find_one("price", server)
+            db_dict = (await utils.get_snapshot("price", server)).data
             if product_name in db_dict:
                 results = db_dict[product_name][:5]
             else:
@@ -513,44 +509,14 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
             await utils.custom_followup(interaction, message, embed=await utils.convert_embed(interaction, embed))
             return
 
-        output_buffer = await self.bot.loop.run_in_executor(
-            None, self.plot_avg_prices, prices_per_day, best_price, product_name, server
-        )
+        if best_price:
+            prices_per_day[utils.get_current_time()] = best_price
+        output_buffer = await utils.render(plot_utils.plot_avg_prices, prices_per_day, product_name, server)
         file = File(fp=output_buffer, filename=f"{interaction.id}.png")
         embed.set_thumbnail(url=f"attachment://{interaction.id}.png")
         await utils.custom_followup(interaction, message, file=file,
                                     embed=await utils.convert_embed(interaction, embed))
 
-    @staticmethod
-    def plot_avg_prices(prices_per_day: dict, current_price: float, product_name: str, server: str) -> BytesIO:
-        if current_price:
-            prices_per_day[utils.get_current_time()] = current_price
-
-        med = statistics.median(prices_per_day.values())
-        std = statistics.stdev(prices_per_day.values())
-        prices_per_day = {day: min(price, med + 2 * std) for day, price in prices_per_day.items()}
-
-        # calculate the moving average
-        is_temp_server = server in temp_servers
-        window = 12 if not is_temp_server else 7
-        prices_list = list(prices_per_day.values())
-        moving_average = tuple(statistics.median(prices_list[i - window // 2: i + window // 2])
-                               if i + window // 2 <= len(prices_list) and i >= window // 2 else None
-                               for i in range(len(prices_list)))
-
-        fig, ax = plt.subplots()
-        ax.set_title(f"{product_name}, {server}")
-        ax.set_ylabel('Price')
-        ax.set_xlabel('Date')
-        ax.plot(prices_per_day.keys(), prices_per_day.values(),  # noqa WPS221
-                label="Daily Average" if is_temp_server else "Monthly Average")
-        if any(moving_average):
-            ax.plot(prices_per_day.keys(), moving_average, '.-', label="Moving Average")  # noqa WPS221
-        ax.legend()
-        fig.autofmt_xdate()
-        ax.grid()
-        return utils.plt_to_bytes(fig)
-
     @command()
     @check(utils.is_premium_level_1)
     @describe(link="profile, military unit or stock company link")
@@ -620,9 +586,9 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
                     if not_raw:
                         used[product_raw[raw]][key - 2] += sum(float(unit) for unit in value.split()[0::2])
 
-        db_dict = await utils.find_one("price", server)
-        output = StringIO()
-        csv_writer = writer(output)
+        db_dict = (await utils.get_snapshot("price", server)).data
+        output = CsvExport()
+        csv_writer = output.writer
         total_cost = 0
         total_profit = 0
         per_day = defaultdict(lambda: {"cost": 0, "worth": 0})
@@ -665,7 +631,6 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
         csv_writer.writerow(["Total Worth (gold):", "", round(total_profit, 2)])
         csv_writer.writerow(
             ["Net Profit (gold):", "", round(total_profit - total_cost, 2), "", "* SALARIES ARE NOT INCLUDED!"])
-        output.seek(0)
 
         embed = Embed(colour=0x3D85C6, title=name, url=link,
                       description='Net profit per day, based on market prices\nSalaries are not included!')
@@ -692,8 +657,8 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
 
         await utils.custom_followup(
             interaction, mention_author=index > 50, embed=await utils.convert_embed(interaction, embed), files=[
-                file, File(fp=BytesIO(output.getvalue().encode()), filename='Productivity.csv'),
-                File(fp=await utils.csv_to_image(output, columns=14), filename=f"Preview_{server}.png")])
+                file, output.to_file('Productivity.csv'),
+                await output.preview(f"Preview_{server}.png", columns=14)])
 
     @command()
     @check(utils.is_premium_level_1)
@@ -751,8 +716,8 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
         for share, holder in zip(shares, holders):
             balance[holder]["owned shares"] += share * per_share
 
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         for v in balance.values():
             v.update({"profit": v["dividends"] + v["shares sold"] + v["owned shares"] - v["shares purchased"]})
 
@@ -761,10 +726,9 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
                 csv_writer.writerow(["#", "Nick"] + [x.title() for x in v.keys()])
             csv_writer.writerow([index + 1, k] + [round(x, 2) for x in v.values()])
 
-        output.seek(0)
         await utils.custom_followup(interaction, mention_author=(last_page + last_page2) > 50, files=[
-            File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"),
-            File(fp=BytesIO(output.getvalue().encode()), filename=f"SC_profit_{server}_{stock_company_id}.csv")])
+            await output.preview(f"Preview_{server}.png"),
+            output.to_file(f"SC_profit_{server}_{stock_company_id}.csv")])
 
     @checks.dynamic_cooldown(CoolDownModified(5))
     @command()
@@ -889,7 +853,7 @@ class Eco(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra": Fa
                 embed.add_field(name="\n**Upgrades per stat**", value="\n".join(
                     f"**{k.title()}:** {v}" for k, v in sorted(upgrades_per_stat.items())), inline=False)
                 embed.set_footer(text=f"{sum(upgrades_per_stat.values())} total upgrades")
-                files.append(File(fp=await self.bot.loop.run_in_executor(None, draw_pil_table, array, header),
+                files.append(File(fp=await utils.render(draw_pil_table, array, header),
                                   filename=f'{server_nick["nick_or_id"]}.jpg'))
 
         elif "/showEquipment.html?id=" in parameter:
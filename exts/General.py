@@ -1,10 +1,9 @@
 """General.py."""
-from asyncio import sleep
 from datetime import date, datetime, timedelta
 from io import BytesIO
 from random import randint
 
-from discord import Attachment, Embed, File, Interaction, TextChannel
+from discord import Attachment, Embed, File, Interaction
 from discord.app_commands import (Transform, check, checks, command, describe,
                                   guild_only)
 from discord.ext.commands import Cog
@@ -13,7 +12,7 @@ from wolframalpha import Client
 
 from Utils import utils
 from Utils.constants import (all_countries, all_products, all_servers, api_url,
-                             config_ids, date_format, gids)
+                             config_ids, gids)
 from Utils.transformers import Country, Server
 from Utils.utils import CoolDownModified
 
@@ -176,20 +175,21 @@ class General(Cog):
         avg_per_day = 0
 
         if server in gids:
-            buffed_players_dict = await utils.find_one("buffs", server)
+            buffs = await utils.get_snapshot("buffs", server)
+            buffed_players_dict = buffs.data
             if api["login"] in buffed_players_dict and buffed_players_dict[api["login"]][5]:
                 db_row = buffed_players_dict[api["login"]]
                 buffs_link = f"https://docs.google.com/spreadsheets/d/{gids[server][0]}/edit#gid={gids[server][2]}"
                 now = utils.get_current_time(timezone_aware=False)
-                if (now - datetime.strptime(db_row[5], date_format)).total_seconds() < 86400:
+                if (now - buffs.get_index(utils.get_buffed_at)[api["login"]]).total_seconds() < 86400:
                     buffs += f" [(*Time left:* {db_row[7].strip()})]({buffs_link})"
                 else:
                     debuffs += f" [(*Time left:* {db_row[7].strip()})]({buffs_link})"
 
-            find_time = await utils.find_one("time_online", server)
-            if api["id"] in find_time:
+            find_time = (await utils.get_snapshot("time_online", server)).data
+            if str(api["id"]) in find_time:
                 online_link = f"https://docs.google.com/spreadsheets/d/{gids[server][0]}/edit#gid={gids[server][1]}"
-                db_row = find_time[api["id"]]
+                db_row = find_time[str(api["id"])]
                 avg_per_day = f"[{db_row[-1]} Hours]({online_link})"
 
         stats = {
@@ -247,7 +247,7 @@ class General(Cog):
                       url=f"https://docs.google.com/spreadsheets/d/{gids[server][0]}/edit#gid={gids[server][1]}")
 
         result = []
-        find_time = await utils.find_one("time_online", server)
+        find_time = (await utils.get_snapshot("time_online", server)).data
         last_update = find_time["_headers"][-1]
         embed.set_footer(text="Last Update: " + last_update)
         for index, (citizen_id, v) in enumerate(find_time.items(), 1):
@@ -311,10 +311,9 @@ class General(Cog):
                                     f'\nIf you want to remove it, type `/remove reminder_id: {random_id}`')
         random_id = f"{interaction.channel.id} {random_id}"
         msg = interaction.user.mention + " " + msg
-        find_remind = await utils.find_one("collection", "remind")
-        find_remind[random_id] = {"when": when, "msg": msg}
-        await utils.replace_one("collection", "remind", find_remind)
-        await remind_func(interaction.channel, when, random_id, msg)
+        async with utils.edit("collection", "remind") as find_remind:
+            find_remind[random_id] = {"when": when, "msg": msg}
+        await schedule_reminder(self.bot, random_id, find_remind[random_id])
 
     @checks.dynamic_cooldown(utils.CoolDownModified(5))
     @command()
@@ -770,19 +769,27 @@ class General(Cog):
         await utils.custom_followup(interaction, file=file)
 
 
-async def remind_func(channel: TextChannel, when: str, reminder_id: str, msg: str) -> None:
-    """Remind func."""
+async def schedule_reminder(bot, reminder_id: str, remind_dict: dict, replace: bool = True) -> None:
+    """Schedule a reminder (reminder_id is "{channel_id} {id}")."""
+    date_format = "%Y/%m/%d %H:%M:%S"
+    now = utils.get_current_time(timezone_aware=False)
+    seconds = (datetime.strptime(remind_dict["when"], date_format) - now).total_seconds()
+    await bot.scheduler.schedule(f"remind {reminder_id}", "remind", dict(remind_dict, reminder_id=reminder_id),
+                                 seconds, replace)
+
+
+async def remind_func(bot, job_id: str, state: dict) -> None:
+    """Remind func (a scheduler job)."""
     date_format = "%Y/%m/%d %H:%M:%S"
     now = utils.get_current_time(timezone_aware=False)
-    seconds = (datetime.strptime(when, date_format) - now).total_seconds()
-    await sleep(seconds)
-    find_remind = await utils.find_one("collection", "remind")
-    if reminder_id not in find_remind:
+    seconds = (datetime.strptime(state["when"], date_format) - now).total_seconds()
+    if state["reminder_id"] not in await utils.find_one("collection", "remind"):
         return
-    if seconds > 10:
-        await channel.send("Your reminder is ready: " + msg)
-    del find_remind[reminder_id]
-    await utils.replace_one("collection", "remind", find_remind)
+    channel = bot.get_channel(int(state["reminder_id"].split()[0]))
+    if channel and seconds > -10:  # skip the ones that were missed while the bot was down
+        await bot.notifier.send(channel, "Your reminder is ready: " + state["msg"])
+    async with utils.edit("collection", "remind") as find_remind:
+        find_remind.pop(state["reminder_id"], None)
 
 
 def get_user_links(base_url: str, link: str, api: dict, company: str) -> dict:
@@ -10,6 +10,7 @@ from discord.ext.commands import Cog
 
 from Utils import utils, db_utils
 from Utils.constants import config_ids
+from Utils.workers import JobCancelled
 
 
 class Listener(Cog):
@@ -57,6 +58,8 @@ class Listener(Cog):
     async def on_app_command_error(self, interaction: Interaction, error: AppCommandError):
         """On app command error."""
         error = getattr(error, 'original', error)
+        if isinstance(error, JobCancelled):
+            return
         await utils.log_error(interaction, error)
 
         if isinstance(error, CheckFailure):
@@ -1,7 +1,5 @@
 """Premium.py."""
 from collections import defaultdict
-from csv import reader, writer
-from io import BytesIO, StringIO
 
 from discord import File, Interaction, errors
 from discord.app_commands import Transform, check, command, describe
@@ -9,6 +7,7 @@ from discord.ext.commands import Cog
 from lxml.html import fromstring
 
 from Utils import utils
+from Utils.export_utils import CsvExport
 from Utils.transformers import Ids, Server, Period
 
 
@@ -106,8 +105,8 @@ class Premium(Cog):
             await utils.custom_delay(interaction)
 
         await msg.delete()
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         countries_per_month = defaultdict(lambda: my_dict.copy())
         authors = defaultdict(lambda: my_dict.copy())
         countries = defaultdict(lambda: my_dict.copy())
@@ -126,12 +125,10 @@ class Premium(Cog):
                 sum_dict[key] += val
         authors_per_month.clear()
         csv_writer.writerow(["Sum", len(authors), len(countries), len(months)] + list(sum_dict.values()))
-        output.seek(0)
-        files = [File(fp=BytesIO(output.getvalue().encode()),
-                      filename=f"articles_per_player_per_month_{article_id}_{first}_{server}.csv")]
+        files = [output.to_file(f"articles_per_player_per_month_{article_id}_{first}_{server}.csv")]
 
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         for index, (k, v) in enumerate(
                 sorted(countries_per_month.items(), key=lambda x: x[1]['articles'], reverse=True)):
             if not index:
@@ -139,13 +136,12 @@ class Premium(Cog):
             csv_writer.writerow([index + 1] + list(k) + list(v.values()))
         countries_per_month.clear()
         csv_writer.writerow(["Sum", len(countries), len(months)] + list(sum_dict.values()))
-        output.seek(0)
-        files.append(File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"))
+        files.append(await output.preview(f"Preview_{server}.png"))
         files.append(
-            File(fp=BytesIO(output.getvalue().encode()), filename=f"articles_per_country_per_month_{server}.csv"))
+            output.to_file(f"articles_per_country_per_month_{server}.csv"))
 
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         for index, (k, v) in enumerate(sorted(authors.items(), key=lambda x: x[1]['articles'], reverse=True)):
             if not index:
                 csv_writer.writerow(["#", "Nick", "Citizenship"] + [x.title() for x in v.keys()])
@@ -153,11 +149,10 @@ class Premium(Cog):
 
         csv_writer.writerow(["Sum", len(authors), len(countries)] + list(sum_dict.values()))
         authors.clear()
-        output.seek(0)
-        files.append(File(fp=BytesIO(output.getvalue().encode()), filename=f"articles_per_player_{server}.csv"))
+        files.append(output.to_file(f"articles_per_player_{server}.csv"))
 
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         for index, (k, v) in enumerate(sorted(months.items(), key=lambda x: int(x[0].split()[0]))):
             if not index:
                 csv_writer.writerow(["#", "Month"] + [x.title() for x in v.keys()])
@@ -170,9 +165,8 @@ class Premium(Cog):
                 csv_writer.writerow(["#", "Country"] + [x.title() for x in v.keys()])
             csv_writer.writerow([index + 1, k] + list(v.values()))
         csv_writer.writerow(["Sum", len(countries)] + list(sum_dict.values()))
-        output.seek(0)
         files.append(
-            File(fp=BytesIO(output.getvalue().encode()), filename=f"articles_per_month_and_country_{server}.csv"))
+            output.to_file(f"articles_per_month_and_country_{server}.csv"))
 
         await utils.custom_followup(interaction,
                                     f"{deleted} articles deleted in this period.\n"
@@ -191,68 +185,63 @@ class Premium(Cog):
                                           "Progress status: 1%.\n(I will update you after every 10%)" if len(
                                               auctions_ids) > 10 else "I'm on it, Sir. Be patient.",
                                           file=File(self.bot.typing_gif_path))
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         csv_writer.writerow(["Id", "Seller", "Buyer", "Item", "Price"])
         first, last = auctions_ids[0], auctions_ids[-1]
         auction = index = 0
+        rows = []
         for index, auction in enumerate(auctions_ids):
             try:
                 if await self.bot.should_cancel(interaction, msg):
                     break
                 msg = await utils.update_percent(index, len(auctions_ids), msg)
                 data = await utils.get_auction(f'https://{server}.e-sim.org/auction.html?id={auction}')
-                csv_writer.writerow([str(auction), data["seller"], data["buyer"], data["item"], data["price"]])
+                rows.append([str(auction), data["seller"], data["buyer"], data["item"], data["price"]])
+                csv_writer.writerow(rows[-1])
                 await utils.custom_delay(interaction)
             except Exception as error:
                 await utils.send_error(interaction, error, auction)
                 break
 
-        output.seek(0)
         sellers = defaultdict(lambda: {'money': 0, 'count': 0})
         buyers = defaultdict(lambda: {'money': 0, 'count': 0})
         items = defaultdict(lambda: {'money': 0, 'count': 0})
-        for index, row in enumerate(reader(output)):
-            if index:  # Ignore headers
-                _, seller, buyer, item, price = row
-                if buyer != "None":
-                    price = float(price)
-                    sellers[seller]["money"] += price
-                    sellers[seller]["count"] += 1
-                    buyers[buyer]["money"] += price
-                    buyers[buyer]["count"] += 1
-                    items[item]["money"] += price
-                    items[item]["count"] += 1
-
-        output1 = StringIO()
-        csv_writer = writer(output1)
+        for _, seller, buyer, item, price in rows:
+            if buyer != "None":
+                price = float(price)
+                sellers[seller]["money"] += price
+                sellers[seller]["count"] += 1
+                buyers[buyer]["money"] += price
+                buyers[buyer]["count"] += 1
+                items[item]["money"] += price
+                items[item]["count"] += 1
+
+        output1 = CsvExport()
+        csv_writer = output1.writer
         csv_writer.writerow(["#", "Seller", "Money received", "Auctions sold"])
         for index, (k, v) in enumerate(sorted(sellers.items(), key=lambda x: x[1]['money'], reverse=True)):
             csv_writer.writerow([str(index + 1), k, v["money"], v["count"]])
 
-        output2 = StringIO()
-        csv_writer = writer(output2)
+        output2 = CsvExport()
+        csv_writer = output2.writer
         csv_writer.writerow(["#", "Buyer", "Money spend", "Auctions bought"])
         for index, (k, v) in enumerate(sorted(buyers.items(), key=lambda x: x[1]['money'], reverse=True)):
             csv_writer.writerow([str(index + 1), k, v["money"], v["count"]])
 
-        output3 = StringIO()
-        csv_writer = writer(output3)
+        output3 = CsvExport()
+        csv_writer = output3.writer
         csv_writer.writerow(["#", "Item", "average price", "Pieces"])
         for index, (k, v) in enumerate(sorted(items.items(), key=lambda x: x[1]['money'], reverse=True)):
             csv_writer.writerow([str(index + 1), k, v["money"] / v["count"], v["count"]])
 
-        output.seek(0)
-        output1.seek(0)
-        output2.seek(0)
-        output3.seek(0)
         last = auction
         await utils.custom_followup(interaction, mention_author=index > 200, files=[
-            File(fp=BytesIO(output.getvalue().encode()), filename=f"Raw_data_{first}_{last}_{server}.csv"),
-            File(fp=BytesIO(output1.getvalue().encode()), filename=f"Sellers_{first}_{last}_{server}.csv"),
-            File(fp=BytesIO(output2.getvalue().encode()), filename=f"Buyers_{first}_{last}_{server}.csv"),
-            File(fp=await utils.csv_to_image(output3), filename=f"Preview_{server}.png"),
-            File(fp=BytesIO(output3.getvalue().encode()), filename=f"Items_{first}_{last}_{server}.csv")])
+            output.to_file(f"Raw_data_{first}_{last}_{server}.csv"),
+            output1.to_file(f"Sellers_{first}_{last}_{server}.csv"),
+            output2.to_file(f"Buyers_{first}_{last}_{server}.csv"),
+            await output3.preview(f"Preview_{server}.png"),
+            output3.to_file(f"Items_{first}_{last}_{server}.csv")])
 
     # Admin blocked access
     # @command()
@@ -355,8 +344,8 @@ class Premium(Cog):
                     countries_dict[citizenship][k] += v
             countries_dict[citizenship]["donors count"] += 1
 
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         for index, (k, v) in enumerate(sorted(citizens_dict.items(), key=lambda x: x[1]['euro'], reverse=True)):
             if not index:
                 csv_writer.writerow(["#", "Nick"] + [x.title() for x in v.keys()])
@@ -367,11 +356,10 @@ class Premium(Cog):
             if not index:
                 csv_writer.writerow(["#", "Country"] + [x.title() for x in v.keys()])
             csv_writer.writerow([index + 1, k] + list(v.values()))
-        output.seek(0)
         my_range = f"{last}_{bb_id + 1}" if last < bb_id else f"{bb_id + 1}_{last}"
         await utils.custom_followup(interaction, f"IDs: {my_range}", files=[
-            File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"),
-            File(fp=BytesIO(output.getvalue().encode()), filename=f"fund_raising_{my_range}_{server}.csv")])
+            await output.preview(f"Preview_{server}.png"),
+            output.to_file(f"fund_raising_{my_range}_{server}.csv")])
 
     @command()
     @check(utils.is_premium_level_1)
@@ -379,8 +367,8 @@ class Premium(Cog):
         """Displays result from the citizens api for the top 1000 citizens by total dmg."""
         msg = await utils.custom_followup(interaction, "Progress status: 1%.\n(I will update you after every 10%)",
                                           file=File(self.bot.typing_gif_path))
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         header = []
         base_url = f'https://{server}.e-sim.org/'
         count = 0
@@ -409,10 +397,9 @@ class Premium(Cog):
             await utils.custom_followup(interaction, "No citizens found.", ephemeral=True)
             return
 
-        output.seek(0)
         await utils.custom_followup(interaction, "This file is NOT sorted!", mention_author=page > 10, files=[
-            File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"),
-            File(fp=BytesIO(output.getvalue().encode()), filename=f"citizens_api_{server}.csv")])
+            await output.preview(f"Preview_{server}.png"),
+            output.to_file(f"citizens_api_{server}.csv")])
 
     @command()
     @check(utils.is_premium_level_1)
@@ -431,8 +418,8 @@ class Premium(Cog):
         countries = utils.get_countries(server, index=0)
         msg = await utils.custom_followup(interaction, "Progress status: 1%.\n(I will update you after every 10%)",
                                           file=File(self.bot.typing_gif_path))
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         csv_writer.writerow(["#", "Country", "Congress member (votes)"])
         for index, (country_id, country) in enumerate(sorted(countries.items())):
             if await self.bot.should_cancel(interaction, msg):
@@ -449,9 +436,7 @@ class Premium(Cog):
             csv_writer.writerow((str(index + 1), country.title(), "".join(candidates)[:-2]))
             await utils.custom_delay(interaction)
 
-        output.seek(0)
-        await utils.custom_followup(interaction, file=File(fp=BytesIO(output.getvalue().encode()),
-                                                           filename=f"Congress_{server}.csv"),
+        await utils.custom_followup(interaction, file=output.to_file(f"Congress_{server}.csv"),
                                     mention_author=True)
 
     @command()
@@ -471,8 +456,8 @@ class Premium(Cog):
         countries = utils.get_countries(server, index=0)
         msg = await utils.custom_followup(interaction, "Progress status: 1%.\n(I will update you after every 10%)",
                                           file=File(self.bot.typing_gif_path))
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         csv_writer.writerow(["#", "Country", "CP", "Votes"])
         for index, (country_id, country) in enumerate(sorted(countries.items())):
             if await self.bot.should_cancel(interaction, msg):
@@ -487,10 +472,9 @@ class Premium(Cog):
             csv_writer.writerow(row)
             await utils.custom_delay(interaction)
 
-        output.seek(0)
         await utils.custom_followup(interaction,
-                                    files=[File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"),
-                                           File(fp=BytesIO(output.getvalue().encode()), filename=f"CPs_{server}.csv")],
+                                    files=[await output.preview(f"Preview_{server}.png"),
+                                           output.to_file(f"CPs_{server}.csv")],
                                     mention_author=True)
 
     @command()
@@ -499,8 +483,7 @@ class Premium(Cog):
         """Checks how many friends and medals each player has in a given server (from the top 500)."""
         msg = await utils.custom_followup(interaction, "Progress status: 1%.\n(I will update you after every 10%)",
                                           file=File(self.bot.typing_gif_path))
-        output = StringIO()
-        csv_writer = writer(output)
+        rows = []
         count = 0
         break_main = False
         pages = 25  # 20 citizens per page
@@ -522,25 +505,22 @@ class Premium(Cog):
                 except IndexError:
                     break
                 profile_medals = utils.get_profile_medals(tree)
-                csv_writer.writerow([nick, citizenship, friends] + profile_medals)
+                rows.append([nick, citizenship, friends] + profile_medals)
                 await utils.custom_delay(interaction)
             if break_main:
                 break
 
         if not count:
             raise Exception("No citizens found.")
-        output.seek(0)
-        sorted_list = sorted(reader(output), key=lambda row: int(row[-4]), reverse=True)
-        output = StringIO()
-        csv_writer = writer(output)
+        sorted_list = sorted(rows, key=lambda row: int(row[-4]), reverse=True)
+        output = CsvExport()
+        csv_writer = output.writer
         csv_writer.writerow(["#", "Nick", "Citizenship", "Friends", "Congress medals", "CP", "Train",
                              "Inviter", "Subs", "Work", "BHs", "RW", "Tester", "Tournament"])
         csv_writer.writerows([[index] + row for index, row in enumerate(sorted_list, 1)])
-        output.seek(0)
         await utils.custom_followup(
-            interaction, files=[File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"),
-                                File(fp=BytesIO(output.getvalue().encode()),
-                                     filename=f"Medals_{server}.csv")], mention_author=True)
+            interaction, files=[await output.preview(f"Preview_{server}.png"),
+                                output.to_file(f"Medals_{server}.csv")], mention_author=True)
 
     @command()
     @check(utils.is_premium_level_1)
@@ -563,8 +543,7 @@ class Premium(Cog):
         if not org_name.lower().endswith(" org"):
             org_name += " org"
         org_name = (await utils.get_content(f'{base_url}apiCitizenByName.html?name={org_name.lower()}'))["login"]
-        output = StringIO()
-        csv_writer = writer(output)
+        logs = []
         link = f"{base_url}orgTransactions.html?citizenName={org_name}&dayFrom={first_day}&dayTo={last_day}"
         last_page = await utils.last_page(link, utils.get_locked_content)
         msg = await utils.custom_followup(interaction,
@@ -608,10 +587,9 @@ class Premium(Cog):
                     donor, receiver = row[2:]
                     row = row[:2]
 
-                csv_writer.writerow((log_type, date, donor, receiver) + row)
+                logs.append(["" if x is None else str(x) for x in (log_type, date, donor, receiver) + row])
 
-        output.seek(0)
-        csv_reader_list = sorted(reader(output))
+        csv_reader_list = sorted(logs)
         if not csv_reader_list:
             await utils.custom_followup(interaction, "No logs were found.")
             return
@@ -636,8 +614,8 @@ class Premium(Cog):
             csv_reader_list[index] = row
 
         # Writing the logs:
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         temp_log_type = ""
         for row in csv_reader_list:
             if row[0] != temp_log_type:
@@ -646,14 +624,13 @@ class Premium(Cog):
                 temp_log_type = row[0]
             csv_writer.writerow(row)
 
-        output.seek(0)
         donate = defaultdict(int)
         monetary_market = defaultdict(lambda: [0, 0])
         product = defaultdict(lambda: [0, 0])
         gold_from_ref = defaultdict(int)
         debt = defaultdict(int)
-        output1 = StringIO()
-        csv_writer = writer(output1)
+        output1 = CsvExport()
+        csv_writer = output1.writer
         temp_log_type = ""
         for row in csv_reader_list:
             log_type = row[0]
@@ -709,11 +686,10 @@ class Premium(Cog):
                     [k[0], "has bought total of", v[0], k[2], "and he paid for it total of", v[1], k[3], "to", k[1],
                      f"Ratio: 1 {k[2]} =", round(v[1] / v[0], 2), k[3]])
             del product
-        output1.seek(0)
         await utils.custom_followup(interaction, mention_author=page > 50, files=[
-            File(fp=await utils.csv_to_image(output1), filename=f"Preview_{server}.png"),
-            File(fp=BytesIO(output.getvalue().encode()), filename=f"raw_logs_{first_day}_{date}_{server}.csv"),
-            File(fp=BytesIO(output1.getvalue().encode()), filename=f"analyzed_logs_{first_day}_{date}_{server}.csv")])
+            await output1.preview(f"Preview_{server}.png"),
+            output.to_file(f"raw_logs_{first_day}_{date}_{server}.csv"),
+            output1.to_file(f"analyzed_logs_{first_day}_{date}_{server}.csv")])
 
     @command()
     @check(utils.is_premium_level_1)
@@ -818,8 +794,8 @@ class Premium(Cog):
                 break
             await utils.custom_delay(interaction)
 
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         header = ["SC id", "SC name", "CEO", "CEO status",
                   "Total Shares", "Total Value", "Per Share", "Daily", "Share Holders", "Companies",  # main
                   "Best Price", "Shares For Sell", "Last Share Trade", ""] + sorted(all_products, reverse=True) +\
@@ -836,12 +812,10 @@ class Premium(Cog):
             row = [k, *v['main']["main"], "", *[val for key, val in sorted(v["products"].items(), reverse=True)], "",
                    v["cc"]["Gold"]] + [val for key, val in sorted(v["cc"].items())[1:]]
             csv_writer.writerow(row)
-        output.seek(0)
         await utils.custom_followup(interaction,
                                     mention_author=index > 100,
-                                    files=[File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"),
-                                           File(fp=BytesIO(output.getvalue().encode()),
-                                                filename=f"StockCompanies_{first}-{sc_id}_{server}.csv")])
+                                    files=[await output.preview(f"Preview_{server}.png"),
+                                           output.to_file(f"StockCompanies_{first}-{sc_id}_{server}.csv")])
 
     @command()
     @check(utils.is_premium_level_1)
@@ -907,8 +881,8 @@ class Premium(Cog):
             await utils.custom_delay(interaction)
 
         await msg.delete()
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         countries_per_month = defaultdict(lambda: my_dict.copy())
         authors = defaultdict(lambda: my_dict.copy())
         countries = defaultdict(lambda: my_dict.copy())
@@ -928,35 +902,32 @@ class Premium(Cog):
 
         authors_per_month.clear()
         csv_writer.writerow(["Sum", len(authors), len(countries), len(months)] + list(sum_dict.values()))
-        output.seek(0)
-        files = [File(fp=BytesIO(output.getvalue().encode()), filename=f"shouts_per_player_per_month_{server}.csv")]
+        files = [output.to_file(f"shouts_per_player_per_month_{server}.csv")]
 
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         for index, (k, v) in enumerate(sorted(countries_per_month.items(), key=lambda x: x[1]['shouts'], reverse=True)):
             if not index:
                 csv_writer.writerow(["#", "Country", "Time"] + [x.title() for x in v.keys()])
             csv_writer.writerow([index + 1] + list(k) + list(v.values()))
         countries_per_month.clear()
         csv_writer.writerow(["Sum", len(countries), len(months)] + list(sum_dict.values()))
-        output.seek(0)
-        files.append(File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"))
+        files.append(await output.preview(f"Preview_{server}.png"))
         files.append(
-            File(fp=BytesIO(output.getvalue().encode()), filename=f"shouts_per_country_per_month_{server}.csv"))
+            output.to_file(f"shouts_per_country_per_month_{server}.csv"))
 
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         for index, (k, v) in enumerate(sorted(authors.items(), key=lambda x: x[1]['shouts'], reverse=True)):
             if not index:
                 csv_writer.writerow(["#", "Nick", "Citizenship"] + [x.title() for x in v.keys()])
             csv_writer.writerow([index + 1] + list(k) + list(v.values()))
         csv_writer.writerow(["Sum", len(authors), len(countries)] + list(sum_dict.values()))
         authors.clear()
-        output.seek(0)
-        files.append(File(fp=BytesIO(output.getvalue().encode()), filename=f"shouts_per_player_{server}.csv"))
+        files.append(output.to_file(f"shouts_per_player_{server}.csv"))
 
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         for index, (k, v) in enumerate(sorted(months.items(), key=lambda x: int(x[0].split()[0]))):
             if not index:
                 csv_writer.writerow(["#", "Month"] + [x.title() for x in v.keys()])
@@ -969,9 +940,8 @@ class Premium(Cog):
                 csv_writer.writerow(["#", "Country"] + [x.title() for x in v.keys()])
             csv_writer.writerow([index + 1, k] + list(v.values()))
         csv_writer.writerow(["Sum", len(countries)] + list(sum_dict.values()))
-        output.seek(0)
         files.append(
-            File(fp=BytesIO(output.getvalue().encode()), filename=f"shouts_per_month_and_country_{server}.csv"))
+            output.to_file(f"shouts_per_month_and_country_{server}.csv"))
 
         await utils.custom_followup(interaction,
                                     "Feel free to add more stats, such as avg votes per shout etc. (basic excel)",
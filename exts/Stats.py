@@ -1,21 +1,20 @@
 """Stats.py."""
-import os
+from asyncio import gather
 from collections import defaultdict
-from csv import reader, writer
 from datetime import date, timedelta
-from io import BytesIO, StringIO
+from io import BytesIO
 from json import loads
-from time import time
+from operator import add
 from typing import Literal
 
-import numpy as np
 import pandas as pd
 from discord import Attachment, File, Interaction
 from discord.app_commands import Transform, check, checks, command, describe
 from discord.ext.commands import Cog
 
-from Utils import utils, battle_db_utils
+from Utils import utils, battle_db_utils, dmg_stats_utils, export_utils, results_cache
 from Utils.constants import all_countries, all_countries_by_name, api_url
+from Utils.export_utils import CsvExport
 from Utils.transformers import BattleTypes, Ids, Server
 from Utils.utils import CoolDownModified
 from Utils.DmgCalculator import dmg_calculator
@@ -61,8 +60,7 @@ class Stats(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra":
         msg = await utils.custom_followup(interaction, "Progress status: 1%.\n(I will update you after every 10%)",
                                           file=File(self.bot.typing_gif_path))
         count = 0
-        output = StringIO()
-        csv_writer = writer(output)
+        rows = []
         break_main = False
         for page in range(1, last_page):
             tree = await utils.get_content(f'{link}&page={page}')
@@ -78,28 +76,26 @@ class Stats(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra":
                 profile_tree = await utils.get_content(f"{base_url}profile.html?id={user_id}")
                 bh_medals = profile_tree.xpath("//*[@id='medals']//ul//li[7]//div")[0].text.replace("x", "")
                 cs = profile_tree.xpath("//div[@class='profile-data newProfileData']//div[12]//span[1]//span[1]")
-                csv_writer.writerow([nick, cs[0].text if cs else "Unknown", bh_medals])
+                rows.append([nick, cs[0].text if cs else "Unknown", bh_medals])
                 await utils.custom_delay(interaction)
             if break_main:
                 break
 
         headers = ("#", "Nick", "Citizenship", "BHs")
-        await self.__send_csv_file_and_preview(interaction, output, headers, server, link, -1)
+        await self.__send_csv_file_and_preview(interaction, rows, headers, server, link, -1)
 
     @staticmethod
-    async def __send_csv_file_and_preview(interaction: Interaction, output: StringIO, headers: tuple[str, ...],
+    async def __send_csv_file_and_preview(interaction: Interaction, rows: list, headers: tuple[str, ...],
                                           server: str, link: str, sort_by: int) -> None:
         """__send_csv_file_and_preview."""
-        output.seek(0)
-        sorted_list = sorted(reader(output), key=lambda row: int(row[sort_by]), reverse=True)
-        output = StringIO()
-        csv_writer = writer(output)
+        sorted_list = sorted(rows, key=lambda row: int(row[sort_by]), reverse=True)
+        output = CsvExport()
+        csv_writer = output.writer
         csv_writer.writerow(headers)
         csv_writer.writerows([[index + 1] + row for index, row in enumerate(sorted_list)])
-        output.seek(0)
         await utils.custom_followup(interaction, f'All players listed here: <{link}>', files=[
-            File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"),
-            File(fp=BytesIO(output.getvalue().encode()), filename=f"{server}.csv")], mention_author=True)
+            await output.preview(f"Preview_{server}.png"),
+            output.to_file(f"{server}.csv")], mention_author=True)
 
     @checks.dynamic_cooldown(CoolDownModified(10))
     @command()
@@ -163,8 +159,8 @@ class Stats(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra":
             await utils.custom_followup(interaction, "Key Error", ephemeral=True)
             return
 
-        output = StringIO()
-        csv_writer = writer(output)
+        output = CsvExport()
+        csv_writer = output.writer
         if extra_premium_info:
             csv_writer.writerow(("Id", "Link", "Nick", "Citizenship", "MU Id", "Inactive Since", "ES", "XP", "Strength",
                                  "Per limit", "Per Berserk", "Crit", "Avoid", "Miss", "Dmg", "Max", "Total Dmg",
@@ -236,15 +232,67 @@ class Stats(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra":
                           ""] + profile_medals
                 csv_writer.writerow(row)
             await utils.custom_delay(interaction)
-        output.seek(0)
         if errors:
             await utils.custom_followup(interaction, f"Couldn't convert the following: {', '.join(errors)}")
         msg = "For duplicated values, use the following excel formula: `=FILTER(A:G, COUNTIF(I2, A:A))`, where `A:G`" \
               " is the range of values in the file bellow, `I2` is the cell containing the id, and `A:A`" \
               " is the column with all ids.\nExample: <https://prnt.sc/12w4p3m> Result: <https://prnt.sc/12w4qgs>"
         await utils.custom_followup(interaction, msg, mention_author=index > 30, files=[
-            File(fp=await utils.csv_to_image(output), filename=f"Preview_{server}.png"),
-            File(fp=BytesIO(output.getvalue().encode()), filename=f"Converted_{key}_{server}.csv")])
+            await output.preview(f"Preview_{server}.png"),
+            output.to_file(f"Converted_{key}_{server}.csv")])
+
+    async def __dmg_stats_in_blocks(self, interaction: Interaction, server: str, api_battles_df: pd.DataFrame,
+                                    queries: tuple, base_url: str, fast_server: bool, verified_rounds: dict,
+                                    checkpoint: dict | None) -> tuple[tuple, dict | None]:
+        """Calculate the dmg-stats block after block of battles, folding each block into the totals.
+
+        The blocks are sized so that their rounds and windows stay under the dmg_stats_memory_limit config (MB),
+        and a block is at most twice the previous one (in case its battles are bigger).
+        The totals of the first blocks whose battles are all over are returned as a checkpoint, and a later run
+        (of the same battles) continues from it. The rounds after the checkpoint are always selected again.
+        Returns (the output of write_dmg_stats, the checkpoint or None).
+        """
+        memory_limit = self.bot.config.get("dmg_stats_memory_limit", 1024) * 2 ** 20
+        battle_ids = api_battles_df["battle_id"].tolist()
+        group_by_list = [list(group_by) for group_by, _ in queries]
+        sums = [None] * (len(queries) - 2)
+        totals = None
+        block_size = max(1, min(dmg_stats_utils.first_block_size,
+                                int(memory_limit / 8 / dmg_stats_utils.battle_memory_estimate)))
+        max_battle_memory = index = 0
+        if checkpoint and checkpoint["battle_ids"] == battle_ids[:checkpoint["index"]]:
+            index, sums, totals, max_battle_memory = (
+                checkpoint["index"], checkpoint["sums"], checkpoint["totals"], checkpoint["max_battle_memory"])
+            block_size = max(1, int(memory_limit / 8 / max(max_battle_memory, 1)))
+            self.bot.logger.info(f"dmg_stats: continuing after {index}/{len(battle_ids)} battles")
+        else:
+            checkpoint = None
+        while index < len(battle_ids):
+            block_ids = battle_ids[index:index + block_size]
+            player_rounds_df, *block_sums, windows_df = await gather(*(
+                battle_db_utils.select_api_fights_aggregates(server, block_ids, group_by, aggregates)
+                for group_by, aggregates in queries))
+            sums = await results_cache.merge_many((sums, block_sums), group_by_list[1:-1])
+            totals = await self.bot.workers.run(
+                dmg_stats_utils.get_block_stats, player_rounds_df, windows_df,
+                api_battles_df.iloc[index:index + len(block_ids)], fast_server, totals, interaction=interaction)
+
+            # The block is copied to the worker, and expands there to a few times its size, so it should take a fraction
+            #  of the limit
+            block_memory = player_rounds_df.memory_usage(deep=True).sum() + windows_df.memory_usage(deep=True).sum()
+            max_battle_memory = max(max_battle_memory, block_memory / len(block_ids))
+            del player_rounds_df, windows_df
+            if (checkpoint or {"index": 0})["index"] == index and all(
+                    verified_rounds.get(battle_id) is None for battle_id in block_ids):  # those battles are final
+                checkpoint = {"index": index + len(block_ids), "battle_ids": battle_ids[:index + len(block_ids)],
+                              "sums": sums, "totals": totals, "max_battle_memory": max_battle_memory}
+            index += len(block_ids)
+            block_size = max(1, min(2 * len(block_ids), int(memory_limit / 8 / max(max_battle_memory, 1))))
+            self.bot.logger.info(f"dmg_stats: {index}/{len(battle_ids)} battles, next {block_size=}")
+
+        rounds_stats, medkits, restores, _ = totals
+        return await self.bot.workers.run(dmg_stats_utils.write_dmg_stats, rounds_stats, *sums, medkits, restores,
+                                          api_battles_df, base_url, interaction=interaction), checkpoint
 
     @checks.dynamic_cooldown(CoolDownModified(20))
     @command(name="dmg-stats")
@@ -305,218 +353,83 @@ class Stats(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra":
         await battle_db_utils.cache_api_battles(interaction, server, battle_ids)
         where = get_where_dmg_stats()
         api_battles_df = await battle_db_utils.select_many_api_battles(server, battle_ids, custom_condition=where)
-        restore_battles_types = ('COUNTRY_TOURNAMENT', 'CUP_EVENT_BATTLE',
-                                 'MILITARY_UNIT_CUP_EVENT_BATTLE', 'TEAM_TOURNAMENT')
-        api_battles_df["is_restore_battle"] = api_battles_df["type"].isin(restore_battles_types)
-        await battle_db_utils.cache_api_fights(interaction, server, api_battles_df)
-        api_fights_df = await battle_db_utils.select_many_api_fights(server, battle_ids)
-
-        side_dmg = api_fights_df.groupby(['battle_id', 'round_id', 'defenderSide'])['damage'].sum().unstack().fillna(
-            0).rename_axis(None, axis=1)
-
-        # Group by the specified columns and sum the damage for each player
-        player_damage_per_round = api_fights_df.groupby(['citizenId', 'battle_id', 'round_id', 'defenderSide'])[
-            'damage'].sum()
-
-        # Calculate how many times the player was the best damage dealer in a round for each side
-        bhs_count = player_damage_per_round.groupby(['battle_id', 'round_id', 'defenderSide']).idxmax().apply(
-            lambda x: x[0]).value_counts().fillna(0)
-
-        # Calculate how many times the round would have been lost without the player.
-        #  (side_dmg > other_side_dmg AND (side_dmg - player_dmg_in_that_round) < other_side_dmg ?)
-        unstacked_player = player_damage_per_round.unstack().fillna(0).rename_axis(None, axis=1)
-        clutches_defender = (side_dmg[0] > side_dmg[1]) & (((side_dmg[0] - unstacked_player[0]) - side_dmg[1]) < 0)
-        clutches_attacker = (side_dmg[1] > side_dmg[0]) & (((side_dmg[1] - unstacked_player[1]) - side_dmg[0]) < 0)
-        # TODO: remove events?
-        # Sum per citizen (clutches is a series with index (battle_id, round_id, citizenId) and value True/False)
-        clutches_count = clutches_defender.groupby('citizenId').sum() + clutches_attacker.groupby('citizenId').sum()
-
-        def get_sum_df(df: pd.DataFrame, column: str):
-            """Returns df with the following columns:
-
-            index, `column`, 'damage', 'Q0 weps', 'Q1 weps', 'Q2 weps', 'Q3 weps', 'Q4 weps', 'Q5 weps'
-            """
-            if 'hits' not in df.columns:
-                df['hits'] = df['berserk'].apply(lambda x: 5 if x else 1)
-
-            weps_count = df.groupby([column, 'weapon'])['hits'].sum().unstack(fill_value=0)
-            result_df = df.groupby(column)['damage'].sum().to_frame().sort_values('damage', ascending=False)
-            for wep_q in range(6):
-                if wep_q in weps_count.columns:
-                    result_df[f'Q{wep_q} weps'] = weps_count[wep_q]
-            return result_df
-
-        player_sum_df = get_sum_df(api_fights_df, 'citizenId')
-
-        best_damage_battle = api_fights_df.groupby(['citizenId', 'battle_id'])['damage'].sum().groupby(
-            'citizenId').max()
-        best_damage_round = api_fights_df.groupby(['citizenId', 'battle_id', 'round_id'])['damage'].sum().groupby(
-            'citizenId').max()
-        best_single_hit = api_fights_df.groupby('citizenId')['damage'].max().groupby('citizenId').max()
-
-        player_stats = pd.DataFrame({
-            'Clutches': clutches_count,
-            'BHs': bhs_count,
-            'Damage record in single battle': best_damage_battle,
-            'Damage record in single round': best_damage_round,
-            'Single hit record': best_single_hit
-        }).join(player_sum_df).sort_values(by='damage', ascending=False)
-
-        battle_stats = api_fights_df.merge(api_battles_df, on='battle_id', how='left')
-        battle_stats['date'] = battle_stats['time'].dt.date
-
-        date_df = get_sum_df(battle_stats, 'date')
-        country_df = get_sum_df(battle_stats, 'citizenship')
-        mu_df = get_sum_df(battle_stats, 'militaryUnit')
-        defender_df = get_sum_df(battle_stats, 'defenderId')
-        attacker_df = get_sum_df(battle_stats, 'attackerId')
-        side_df = defender_df.add(attacker_df, fill_value=0)
-        side_df.index.name = 'Side'
-
-        battle_df = get_sum_df(battle_stats, 'battle_id')
-        battle_df['defenderId'] = api_battles_df.set_index('battle_id').loc[battle_df.index]['defenderId'].values
-        battle_df['attackerId'] = api_battles_df.set_index('battle_id').loc[battle_df.index]['attackerId'].values
-        # reorder cols, so that defenderId and attackerId are next to battle_id
-        cols = battle_df.columns.tolist()
-        battle_df = battle_df[cols[:1] + cols[-2:] + cols[1:-2]]
-        battle_df.index = battle_df.index.map(lambda x: f"{base_url}battleStatistics.html?id={x}")
-        battle_df.index.name = 'Battle Link'
-
-        # get number of battles won and lost by each country
-        # (country in defenderId and defenderScore == 8) or (country in attackerId and attackerScore == 8)
-        # TODO: skip events?
-        scores_df = api_battles_df[['defenderId', 'attackerId', 'defenderScore', 'attackerScore']]
-        country_ids = pd.concat([scores_df['attackerId'], scores_df['defenderId']]).unique()
-        countries_df = pd.DataFrame(index=country_ids, columns=['won', 'lost'], data=0)
-        countries_df.index.name = 'Country'
-        # TODO: vectorize this
-        for row in scores_df.to_dict(orient="index").values():
-            if row['attackerScore'] == 8:
-                countries_df.at[row['attackerId'], 'won'] += 1
-                countries_df.at[row['defenderId'], 'lost'] += 1
-            elif row['defenderScore'] == 8:
-                countries_df.at[row['defenderId'], 'won'] += 1
-                countries_df.at[row['attackerId'], 'lost'] += 1
-
-        # Each player has 32 daily limit. With each limit he can hit 1 berserk, or 5 non berserks. He has 40% chance to not lose a limit while hitting.
-        # Every 10 minutes (or every day in some servers), the player get 2 limits, up to 32. This is called a restore.
-        # In restore_battle, the player gets extra 22 limits per round, but only if he dealt 30 hits before that round.
-        # If the player used all his limits plus some more, it means he opened a medkit, which gives him 20 limits.
-        #
-        # The goal is to calculate total medkits used per player, and total restores the player participated in every day
-        #   (i.e. number of times per day that he hit at least 1 hit in 10 minutes windows [00:00-00:10, 00:10-00:20, ...])
-        # TODO: rewrite this
-        player_dict = defaultdict(lambda: {'limits': 0, 'medkits': 0,
-                                           'last_hit': pd.Timestamp("2000-01-01"),
-                                           'restores': {}})
-        battles = api_battles_df[['battle_id', 'type', 'is_restore_battle']]
-        days = []
-        seconds_in_10_minutes = 10 * 60
-        health_limits = limits_per_restore = 2
-        full_limits = 15 + 15 + health_limits
-        medkit_limits = 10 + 10
-        avoid = 0.4
-        hits_per_limit = 5
-        threshold = -10
-        slow_servers = ("primera", "secura", "suna")
-        for battle_id, battle_type, is_restore_battle in battles.itertuples(index=False, name=None):
-            # Extract relevant data for the current battle
-            battle_data = api_fights_df[api_fights_df['battle_id'] == battle_id]
-            for hit in battle_data.itertuples(index=False):
-                key = hit.citizenId
-                user = player_dict[key]
-                seconds_from_last = (utils.get_time(hit.time, floor_to_10=True) -
-                                     utils.get_time(user['last_hit'], floor_to_10=True)).total_seconds()
-
-                day_month_year = hit.time.strftime("%d-%m-%Y")
-                if user['last_hit'].strftime("%d-%m-%Y") != day_month_year:  # day change
-                    user['limits'] = full_limits
-                    if day_month_year not in days:
-                        days.append(day_month_year)
-                if seconds_from_last > 0:
-                    if day_month_year not in user['restores']:
-                        user['restores'][day_month_year] = 0
-                    user['restores'][day_month_year] += 1
-                    # fast server has limits restore, but sometimes also slow servers have it.
-                    if fast_server or (fast_server is None and server not in slow_servers):
-                        user['limits'] = min(user['limits'] + np.floor(seconds_from_last / seconds_in_10_minutes)
-                                             * limits_per_restore + health_limits, full_limits)
-                if is_restore_battle and user.get("has_restore"):
-                    user['limits'] = medkit_limits + health_limits
-                    user["has_restore"] = False
-                user['limits'] -= hit.hits / (1 - avoid) / hits_per_limit
-                if user['limits'] < threshold:
-                    user['medkits'] += 1
-                    user['limits'] += medkit_limits
-                user['last_hit'] = hit.time
-
-            # Calculate for each player if he participated in a restore battle with at least 30 hits
-            restores = battle_data.groupby('citizenId').apply(
-                lambda x: is_restore_battle & (x['hits'].sum() >= 30), include_groups=False).reset_index(
-                name='has_restore')
-
-            # Update player_dict with restores
-            for row in restores.itertuples(index=False):
-                player_dict[row.citizenId]['has_restore'] = row.has_restore
-
-        # Write the data to csv
-
-        player_stats_buffer = StringIO()
-        player_stats = player_stats.reset_index().rename(columns={'index': 'citizenId'})
-        player_stats = player_stats.merge(pd.DataFrame(player_dict).T, left_on='citizenId', right_index=True,
-                                          how='left')
-        columns_to_drop = ['limits', 'last_hit', 'restores', 'has_restore']
-        player_stats.rename(columns={'medkits': 'Medkits used (rough estimation)'}).drop(
-            columns=columns_to_drop).to_csv(player_stats_buffer, index=False, lineterminator='\n')
-
-        battle_stats_buffer = StringIO()
-
-        # Convert country ids to country names
-        countries_columns = ('citizenship', 'Side', 'Country', 'defenderId', 'attackerId')
-        for df in (country_df, side_df, defender_df, attacker_df):
-            if df.index.name in countries_columns:
-                df.index = df.index.map(all_countries)
-            for col in df.columns:
-                if col in countries_columns:
-                    df[col] = df[col].map(all_countries)
-
-        date_df.to_csv(battle_stats_buffer, lineterminator='\n')
-        battle_stats_buffer.write("\n\n")
-        country_df.to_csv(battle_stats_buffer, mode='a', lineterminator='\n')
-        battle_stats_buffer.write("\n\n")
-        mu_df.to_csv(battle_stats_buffer, mode='a', lineterminator='\n')
-        battle_stats_buffer.write("\n\n")
-        side_df.to_csv(battle_stats_buffer, mode='a', lineterminator='\n')
-        battle_stats_buffer.write("\n\n")
-        battle_df.to_csv(battle_stats_buffer, mode='a', lineterminator='\n')
-        battle_stats_buffer.write("\n\n")
-
-        countries_df["won %"] = round(countries_df["won"] / (countries_df["won"] + countries_df["lost"]) * 100, 2)
-        countries_df["lost %"] = round(countries_df["lost"] / (countries_df["won"] + countries_df["lost"]) * 100, 2)
-        countries_df.sort_values("won", ascending=False).to_csv(battle_stats_buffer, mode='a', lineterminator='\n')
-
-        restores_per_day_buffer = StringIO()
-        restores_per_day = player_stats[['citizenId', 'restores']].set_index('citizenId')['restores'].apply(pd.Series)
-        restores_per_day["Average Per Day"] = restores_per_day.mean(axis=1)
-        restores_per_day["Median"] = restores_per_day.median(axis=1)
-        restores_per_day["Max"] = restores_per_day.max(axis=1)
-        restores_per_day.to_csv(restores_per_day_buffer, lineterminator='\n')
-
-        player_stats_buffer.seek(0)
-        battle_stats_buffer.seek(0)
-        restores_per_day_buffer.seek(0)
+        api_battles_df["is_restore_battle"] = api_battles_df["type"].isin(dmg_stats_utils.restore_battles_types)
+        fast_server = dmg_stats_utils.is_fast_server(server, fast_server)
+        cache_key = results_cache.get_key("dmg-stats", server, battle_ids, where=where, fast_server=fast_server)
+        cached = await results_cache.load(cache_key)
+        if cached and "artifacts" in cached and (  # all battles were over already
+                cached["verified_rounds"].keys() == set(api_battles_df["battle_id"].tolist())):
+            csv_files = cached["artifacts"]["csv"]
+            previews = cached["artifacts"]["previews"]
+        else:
+            await battle_db_utils.cache_api_fights(interaction, server, api_battles_df)
+            verified_rounds = await results_cache.refresh_verified_rounds(server, api_battles_df)
+            # (the rounds verified later can only be added to the cached entry)
+            if cached and not results_cache.is_valid(cached, verified_rounds):
+                cached = None
+            # Only the battles that passed the filters
+            filtered_ids = battle_ids if len(api_battles_df) == len(battle_ids) else api_battles_df[
+                'battle_id'].tolist()
+            sums = ("damage", *(f"Q{wep_q} weps" for wep_q in range(6)))
+            queries = (
+                ({"citizenId": "citizenId", "battle_id": "battle_id", "round_id": "round_id",
+                  "defenderSide": "defenderSide"}, ("damage",)),
+                ({"citizenId": "citizenId"}, (*sums, "max_hit")),
+                ({"date": "DATE(time)"}, sums),
+                ({"citizenship": "citizenship"}, sums),
+                ({"militaryUnit": "militaryUnit"}, sums),
+                ({"battle_id": "battle_id"}, sums),
+                # the medkits estimation needs the hits sequence, but the limits can change only between windows
+                ({"citizenId": "citizenId", "battle_id": "battle_id", "time": battle_db_utils.api_fights_window},
+                 ("hits",)))
+            group_by_list = [list(group_by) for group_by, _ in queries]
+
+            async def select_aggregates(condition: str) -> list:
+                return await gather(*(battle_db_utils.select_api_fights_aggregates(
+                    server, filtered_ids, group_by, aggregates, custom_condition=condition)
+                    for group_by, aggregates in queries))
+
+            checkpoint = None
+            if len(filtered_ids) > dmg_stats_utils.first_block_size:
+                # Too many rounds to hold at once (or to keep in the cache), so only the blocks of finished
+                # battles are cached, as a checkpoint of their totals
+                outputs, checkpoint = await self.__dmg_stats_in_blocks(
+                    interaction, server, api_battles_df, queries, base_url, fast_server, verified_rounds,
+                    cached and cached.get("checkpoint"))
+                verified_aggregates = None
+            else:
+                # The verified rounds are aggregated once, and later runs only add the rounds verified since
+                if cached:
+                    verified_aggregates = cached["aggregates"]
+                    new_rounds = results_cache.new_rounds_condition(cached["verified_rounds"], verified_rounds)
+                    if new_rounds:
+                        verified_aggregates = await results_cache.merge_many(
+                            (verified_aggregates, await select_aggregates(new_rounds)), group_by_list)
+                else:
+                    verified_aggregates = await select_aggregates(results_cache.verified_condition(verified_rounds))
+                unverified_rounds = results_cache.unverified_condition(verified_rounds)
+                aggregates = verified_aggregates if not unverified_rounds else await results_cache.merge_many(
+                    (verified_aggregates, await select_aggregates(unverified_rounds)), group_by_list)
+
+                outputs = await self.bot.workers.run(
+                    dmg_stats_utils.get_dmg_stats, *aggregates, api_battles_df, base_url, fast_server,
+                    interaction=interaction)
+            csv_files = [content for content, _ in outputs]
+            previews = [(await export_utils.preview_image(preview_rows)).getvalue() for _, preview_rows in outputs]
+            entry = {"verified_rounds": verified_rounds, "aggregates": verified_aggregates, "checkpoint": checkpoint}
+            if results_cache.is_complete(verified_rounds):
+                entry["artifacts"] = {"csv": csv_files, "previews": previews}
+            if verified_aggregates is not None or checkpoint is not None or "artifacts" in entry:
+                await results_cache.save(cache_key, entry)
 
         battles_range = f"{battle_ids[0]}_{battle_ids[-1]}" if len(battle_ids) > 1 else battle_ids[0]
         await utils.custom_followup(interaction, mention_author=len(battle_ids) > 50, files=[
-            File(fp=await utils.csv_to_image(player_stats_buffer), filename=f"Preview_{server}.png"),
-            File(fp=await utils.csv_to_image(battle_stats_buffer), filename=f"Preview1_{server}.png"),
-            File(fp=await utils.csv_to_image(restores_per_day_buffer), filename=f"Preview2_{server}.png"),
-            File(fp=BytesIO(player_stats_buffer.getvalue().encode()),
-                 filename=f"PlayersStats_{battles_range}_{server}.csv"),
-            File(fp=BytesIO(battle_stats_buffer.getvalue().encode()),
-                 filename=f"BattleStats_{battles_range}_{server}.csv"),
-            File(fp=BytesIO(restores_per_day_buffer.getvalue().encode()),
-                 filename=f"RestoresStats_{battles_range}_{server}.csv")])
+            File(fp=BytesIO(previews[0]), filename=f"Preview_{server}.png"),
+            File(fp=BytesIO(previews[1]), filename=f"Preview1_{server}.png"),
+            File(fp=BytesIO(previews[2]), filename=f"Preview2_{server}.png"),
+            export_utils.to_file(csv_files[0], f"PlayersStats_{battles_range}_{server}.csv"),
+            export_utils.to_file(csv_files[1], f"BattleStats_{battles_range}_{server}.csv"),
+            export_utils.to_file(csv_files[2], f"RestoresStats_{battles_range}_{server}.csv")])
 
     @command(name="drops-stats")
     @check(utils.is_premium_level_1)
@@ -533,9 +446,8 @@ class Stats(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra":
         base_url = f'https://{server}.e-sim.org/'
         lucky = False
         index = current_id = 0
-        filename = os.path.join(self.bot.root, f"temp_files/{time()}.csv")
-        f = open(filename, "w", newline="")
-        csv_writer = writer(f)
+        # (nick, link): [Q1-Q6, upgrade, reshuffle, Q1-Q6 LC]
+        drops_per_player = defaultdict(lambda: [0] * 14)
         for index, current_id in enumerate(battles):
             my_dict = defaultdict(lambda: {"Q": [0, 0, 0, 0, 0, 0]})
             try:
@@ -575,39 +487,24 @@ class Stats(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra":
             except Exception as error:
                 await utils.send_error(interaction, error, current_id)
                 break
+            # Only complete battles are added
             for k, v in my_dict.items():
-                row = list(k) + [x or "0" for x in v["Q"]] + [
-                    v.get("upgrade", "0"), v.get("reshuffle", "0")] + v.get("LC", [])
-                csv_writer.writerow(row)
+                add_drops(drops_per_player[k], v)
             await utils.custom_delay(interaction)
-        f.close()
-        headers = ("Nick", "Link", "Q1", "Q2", "Q3", "Q4", "Q5", "Q6", "Upgrade", "Reshuffle")
-        if lucky:
-            headers += ("Q1 LC", "Q2 LC", "Q3 LC", "Q4 LC", "Q5 LC", "Q6 LC")
-        my_dict = {}
-        with open(filename) as csvfile:
-            for row in reader(csvfile):
-                nick = (row[0], row[1])
-                if nick not in my_dict:
-                    my_dict[nick] = [0] * (len(headers) - 2)
-                for i in range(len(headers) - 2):
-                    try:
-                        if row[i + 2]:
-                            my_dict[nick][i] += int(row[i + 2])
-                    except IndexError:
-                        pass
-
-        with open(filename, 'w', newline='') as csvfile:
-            csv_writer = writer(csvfile)
+
+        if drops_per_player:
+            headers = ("Nick", "Link", "Q1", "Q2", "Q3", "Q4", "Q5", "Q6", "Upgrade", "Reshuffle")
+            if lucky:
+                headers += ("Q1 LC", "Q2 LC", "Q3 LC", "Q4 LC", "Q5 LC", "Q6 LC")
+            output = CsvExport()
+            csv_writer = output.writer
             csv_writer.writerow(headers)
-            for nick, row in my_dict.items():
-                csv_writer.writerow(list(nick) + [str(x) if x else "" for x in row])
-        if my_dict:
-            await utils.custom_followup(interaction, mention_author=index > 100, file=File(
-                filename, filename=f"Drops_{battles[0]}_{current_id}_{server}.csv"))
+            csv_writer.writerows(list(nick) + [str(x) if x else "" for x in row[:len(headers) - 2]]
+                                 for nick, row in drops_per_player.items())
+            await utils.custom_followup(interaction, mention_author=index > 100, file=output.to_file(
+                f"Drops_{battles[0]}_{current_id}_{server}.csv"))
         else:
             await utils.custom_followup(interaction, "No drops were found")
-        os.remove(filename)
 
     @checks.dynamic_cooldown(CoolDownModified(60))
     @command()
@@ -625,8 +522,7 @@ class Stats(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra":
             return
 
         base_url = f'https://{server}.e-sim.org/'
-        output = StringIO()
-        csv_writer = writer(output)
+        rows = []
         link, last_page = await self.__get_achievements_link_and_last_page(
             "LEGENDARY_EQUIPMENT", "EQUIPPED_V", scan_more_players, server)
         msg = await utils.custom_followup(interaction, "Progress status: 1%.\n(I will update you after every 10%)",
@@ -647,13 +543,13 @@ class Stats(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra":
                         self.bot.logger.error(f"error in sets for user_id={user_id}: {error}")
                         continue
                 dmg = dmg_calculator(api)
-                csv_writer.writerow([api["login"], api['citizenship'], api['eqCriticalHit'], api['eqReduceMiss'],
-                                     api['eqAvoidDamage'], api['eqIncreaseMaxDamage'], api['eqIncreaseDamage'],
-                                     dmg["avoid"], dmg["clutch"], api['eqIncreaseEcoSkill']])
+                rows.append([api["login"], api['citizenship'], api['eqCriticalHit'], api['eqReduceMiss'],
+                             api['eqAvoidDamage'], api['eqIncreaseMaxDamage'], api['eqIncreaseDamage'],
+                             dmg["avoid"], dmg["clutch"], api['eqIncreaseEcoSkill']])
                 await utils.custom_delay(interaction)
 
         headers = ("#", "Nick", "Citizenship", "Crit", "Miss", "Avoid", "Max", "Dmg", "Per limit", "Per berserk", "Eco")
-        await self.__send_csv_file_and_preview(interaction, output, headers, server, link, -3)
+        await self.__send_csv_file_and_preview(interaction, rows, headers, server, link, -3)
 
     @checks.dynamic_cooldown(CoolDownModified(5))
     @command()
@@ -687,8 +583,8 @@ class Stats(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra":
             lists_headers = tuple(k for k, v in api[0].items() if isinstance(v, list))
             headers = [k for k, v in api[0].items() if not isinstance(v, list)]
             await update_missing_keys(link, headers)
-            output = StringIO()
-            csv_writer = writer(output)
+            output = CsvExport()
+            csv_writer = output.writer
             csv_writer.writerow(headers)
             for row in api:
                 csv_writer.writerow([row.get(header, "") for header in headers])
@@ -715,8 +611,7 @@ class Stats(Cog, command_attrs={"cooldown_after_parsing": True, "ignore_extra":
                                 [(inner_header, inner_row.get(inner_header, "")) for inner_header in inner_headers])
                     csv_writer.writerow([])
 
-            output.seek(0)
-            files.append(File(fp=BytesIO(output.getvalue().encode()), filename=f"{link}_{server}.csv"))
+            files.append(output.to_file(f"{link}_{server}.csv"))
             await utils.custom_delay(interaction)
 
         await utils.custom_followup(interaction, files=files)
@@ -731,6 +626,15 @@ async def update_missing_keys(link: str, headers: list) -> None:
                     for header in expected_headers if header not in headers])
 
 
+def add_drops(totals: list[int], battle_drops: dict) -> None:
+    """Add the drops of a player in one battle to his totals ([Q1-Q6, upgrade, reshuffle, Q1-Q6 LC])."""
+    totals[:6] = map(add, totals[:6], battle_drops["Q"])
+    totals[6] += battle_drops.get("upgrade", 0)
+    totals[7] += battle_drops.get("reshuffle", 0)
+    if "LC" in battle_drops:
+        totals[8:] = map(add, totals[8:], battle_drops["LC"])
+
+
 async def setup(bot) -> None:
     """Setup."""
     await bot.add_cog(Stats(bot))
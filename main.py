@@ -4,22 +4,39 @@ import importlib
 import logging
 import os
 import subprocess
+from functools import partial
 from sys import exc_info, modules
+from time import time
 
 import matplotlib
 from discord import Interaction
 from discord.app_commands import guilds
 from discord.utils import setup_logging
 
-from Utils import utils
+from Utils import battles_list, utils
+from Utils.battle_utils import (motivate_func, ping_func, prewarm_cups,
+                                refresh_cup_leaderboards, schedule_auction,
+                                schedule_motivate, schedule_ping, schedule_watch,
+                                watch_auction_func, watch_func)
 from Utils.constants import all_servers
+from Utils.notifier import Notifier
+from Utils.scheduler import Scheduler
+from Utils.workers import RenderPool, WorkerPool
 from bot.bot import bot, load_extensions
-from exts.Battle import (motivate_func, ping_func, watch_auction_func,
-                         watch_func)
-from exts.General import remind_func
+from exts.General import remind_func, schedule_reminder
 
+boot_time = time()
 matplotlib.use('Agg')
 bot.utils = utils
+bot.workers = WorkerPool(bot.config.get("worker_processes"), bot.config.get("worker_timeout", 600))
+bot.renderer = RenderPool(bot.config.get("render_processes"), bot.config.get("render_concurrency"),
+                          bot.config.get("render_timeout", 60))
+bot.notifier = Notifier(bot.config.get("notify_concurrency", 5), bot.config.get("notify_bundle_window", 0.5))
+bot.scheduler = Scheduler(bot.store, bot.config.get("scheduler_tick", 1), bot.config.get("scheduler_workers", 10),
+                          bot.config.get("scheduler_start_rate", 5))
+for kind, handler in (("remind", remind_func), ("watch", watch_func), ("auction", watch_auction_func),
+                      ("ping", ping_func), ("motivate", motivate_func)):
+    bot.scheduler.register(kind, partial(handler, bot))
 
 
 @bot.event
@@ -33,77 +50,49 @@ async def on_error(*args, **kwargs) -> None:
 
 
 async def activate_reminder() -> None:
-    """Activating Reminder Function at Restart."""
-    db_dict = await utils.find_one("collection", "remind")
-    for reminder_id in list(db_dict):
-        inner_dict = db_dict[reminder_id]
-        channel = bot.get_channel(int(reminder_id.split()[0]))
-        if channel:
-            bot.loop.create_task(
-                remind_func(channel, inner_dict["when"], reminder_id, inner_dict["msg"]))
-            await asyncio.sleep(1)
-        else:
-            db_dict = await utils.find_one("collection", "remind")
-            del db_dict[reminder_id]
-            await utils.replace_one("collection", "remind", db_dict)
-    await utils.replace_one("collection", "remind", db_dict)
+    """Scheduling the reminders that aren't in the scheduler (it keeps its jobs across restarts)."""
+    # The jobs are scheduled after the edit block, so they can write to the collection
+    async with utils.edit("collection", "remind") as db_dict:
+        for reminder_id in list(db_dict):
+            if not bot.get_channel(int(reminder_id.split()[0])):
+                del db_dict[reminder_id]
+        reminders = dict(db_dict)
+    for reminder_id, reminder_dict in reminders.items():
+        await schedule_reminder(bot, reminder_id, reminder_dict, replace=False)
 
 
 async def activate_watch_and_ping() -> None:
-    """Activating Watch, Auction and Ping Function at Restart."""
-    db_dict = await utils.find_one("collection", "auctions") or {"auctions": []}
-    for inner_dict in list(db_dict["auctions"]):
-        channel = bot.get_channel(inner_dict["channel_id"])
-        if channel and not inner_dict.get("removed"):
-            bot.loop.create_task(
-                watch_auction_func(channel, inner_dict['link'], inner_dict['t'],
-                                   inner_dict['custom'], inner_dict["author_id"]))
-            await asyncio.sleep(1.5)
-        else:
-            db_dict = await utils.find_one("collection", "auctions") or {"auctions": []}
-            db_dict["auctions"].remove(inner_dict)
-            await utils.replace_one("collection", "auctions", db_dict)
-        await asyncio.sleep(5)
-
-    db_dict = await utils.find_one("collection", "watch") or {"watch": []}
-    for inner_dict in list(db_dict["watch"]):
-        channel = bot.get_channel(inner_dict["channel_id"])
-        if channel and not inner_dict.get("removed"):
-            bot.loop.create_task(
-                watch_func(bot, channel, inner_dict['link'], inner_dict['t'],
-                           inner_dict['role'], inner_dict['custom'], inner_dict["author_id"]))
-            await asyncio.sleep(1.5)  # To avoid race condition and ratelimit
-        else:
-            # It may have changed in the meantime
-            db_dict = await utils.find_one("collection", "watch") or {"watch": []}
-            db_dict["watch"].remove(inner_dict)
-            await utils.replace_one("collection", "watch", db_dict)
-
-        await asyncio.sleep(5)
-
-    db_dict = await utils.find_one("collection", "ping")
-    for key in list(db_dict):
-        # channel_id, reminder_id = key.split()
-        channel = bot.get_channel(int(key.split()[0]))
-        if channel:
-            bot.loop.create_task(ping_func(
-                channel=channel, t=db_dict[key]["t"], server=db_dict[key]["server"],
-                ping_id=key, country=db_dict[key]["country"],
-                role=db_dict[key]["role"], author_id=db_dict[key]["author_id"]))
-            await asyncio.sleep(10)
-        else:
-            db_dict = await utils.find_one("collection", "ping")
-            del db_dict[key]
-            await utils.replace_one("collection", "ping", db_dict)
+    """Scheduling the watches, auctions and pings that aren't in the scheduler (spread, to avoid ratelimit)."""
+    async with utils.edit("collection", "auctions") as db_dict:
+        db_dict["auctions"] = [inner_dict for inner_dict in db_dict.get("auctions", [])
+                               if bot.get_channel(inner_dict["channel_id"]) and not inner_dict.get("removed")]
+        auctions = list(db_dict["auctions"])
+    for inner_dict in auctions:
+        await schedule_auction(bot, inner_dict, replace=False)
+
+    async with utils.edit("collection", "watch") as db_dict:
+        db_dict["watch"] = [inner_dict for inner_dict in db_dict.get("watch", [])
+                            if bot.get_channel(inner_dict["channel_id"]) and not inner_dict.get("removed")]
+        watches = list(db_dict["watch"])
+    for inner_dict in watches:
+        await schedule_watch(bot, inner_dict, replace=False)
+
+    async with utils.edit("collection", "ping") as db_dict:
+        for key in list(db_dict):
+            # channel_id, reminder_id = key.split()
+            if not bot.get_channel(int(key.split()[0])):
+                del db_dict[key]
+        pings = dict(db_dict)
+    for key, ping_dict in pings.items():
+        await schedule_ping(bot, key, ping_dict, replace=False)
 
 
 async def activate_motivate() -> None:
-    """Activating Motivate Function at Restart."""
+    """Scheduling the motivate jobs that aren't in the scheduler."""
     db_dict = await utils.find_one("collection", "motivate")
     for server in db_dict:
         if server in all_servers:
-            bot.loop.create_task(motivate_func(bot, server, db_dict))
-            await asyncio.sleep(20)
+            await schedule_motivate(bot, server, replace=False)
 
 
 async def start() -> None:
@@ -114,11 +103,15 @@ async def start() -> None:
     if bot.config.get("test_mode"):
         return
 
+    bot.store.on_replace("price", utils.on_price_replace)
     utils.alert.start()
-    await activate_reminder()
-    await activate_watch_and_ping()
-    await activate_motivate()
-    print("Bot is ready")
+    refresh_cup_leaderboards.start()
+    battles_list.refresh_battles_lists.start()
+    prewarm_cups.start(bot)
+    bot.scheduler.start()
+    await asyncio.gather(activate_reminder(), activate_watch_and_ping(), activate_motivate())
+    print(f"Bot is ready ({time() - boot_time:.1f}s after boot, {len(bot.scheduler.jobs)} jobs restored,"
+          f" their first runs are spread over {max(0.0, bot.scheduler.next_slot - time()):.0f}s)")
 
 
 @bot.tree.command()
@@ -148,4 +141,5 @@ async def main() -> None:
         await bot.start(token)
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main())
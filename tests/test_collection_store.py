@@ -0,0 +1,55 @@
+"""Tests for Utils.collection_store (run with `python -m unittest discover tests`)."""
+import asyncio
+import unittest
+from tempfile import TemporaryDirectory
+
+from Utils.collection_store import CollectionStore, FileBackend
+
+
+class TestEdit(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.db_dir = TemporaryDirectory()
+        self.store = CollectionStore(self.db_dir.name, backend=FileBackend(self.db_dir.name))
+
+    def tearDown(self) -> None:
+        self.db_dir.cleanup()
+
+    async def test_concurrent_edits(self) -> None:
+        async def increment() -> None:
+            async with self.store.edit("collection", "counter") as data:
+                count = data.get("count", 0)
+                await asyncio.sleep(0.001)
+                data["count"] = count + 1
+
+        await asyncio.gather(*(increment() for _ in range(20)))
+        self.assertEqual((await self.store.find_one("collection", "counter"))["count"], 20)
+
+    async def test_write_inside_edit_raises(self) -> None:
+        """A write to the collection that is being edited (by the same task) would wait for the block forever."""
+        async def edit_and_write(write: callable) -> None:
+            async with self.store.edit("collection", "ping") as data:
+                data["a"] = 1
+                await write()
+
+        for write in (lambda: self.store.replace_one("collection", "other", {}),
+                      lambda: self.store.update_keys("collection", "other", {"a": 1}),
+                      lambda: self.store.edit("collection", "other").__aenter__()):
+            with self.subTest(write=write):
+                with self.assertRaises(RuntimeError):
+                    await asyncio.wait_for(edit_and_write(write), 1)
+                # the block was left (and unlocked) without writing
+                self.assertEqual(await self.store.find_one("collection", "ping"), {})
+                await asyncio.wait_for(self.store.replace_one("collection", "ping", {}), 1)
+
+    async def test_other_task_waits(self) -> None:
+        async with self.store.edit("collection", "ping") as data:
+            data["a"] = 1
+            task = asyncio.create_task(self.store.replace_one("collection", "ping", {"a": 2}))
+            await asyncio.sleep(0.01)
+            self.assertFalse(task.done())
+        await task
+        self.assertEqual(await self.store.find_one("collection", "ping"), {"a": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+"""Tests for Utils.dmg_stats_utils (run with `python -m unittest discover tests`)."""
+import pickle
+import unittest
+from collections import defaultdict
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+
+from Utils import dmg_stats_utils
+
+
+def get_battle(battle_id: int, citizens: int = 6, rounds: int = 3) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """The player rounds and windows aggregates of a battle, as selected by dmg-stats."""
+    rng = np.random.default_rng(battle_id)
+    player_rounds = pd.DataFrame([(citizen, battle_id, round_id, side, int(rng.integers(1, 10 ** 6)))
+                                  for citizen in range(citizens) for round_id in range(1, rounds + 1)
+                                  for side in (0, 1) if rng.random() < 0.7],
+                                 columns=["citizenId", "battle_id", "round_id", "defenderSide", "damage"])
+    start = pd.Timestamp("2024-01-01") + pd.Timedelta(hours=battle_id)
+    windows = pd.DataFrame([(citizen, battle_id, start + pd.Timedelta(minutes=10 * window),
+                             int(rng.integers(1, 200))) for citizen in range(citizens) for window in range(6)],
+                           columns=["citizenId", "battle_id", "time", "hits"])
+    return player_rounds, windows
+
+
+def get_hits(battle_ids: list[int], citizens: int = 6, hits: int = 6000) -> pd.DataFrame:
+    """Hits (api_fights rows) of the given battles, in the 10 minutes windows around midnight (with a gap)."""
+    rng = np.random.default_rng(sum(battle_ids))
+    windows = 24 * 6 + np.r_[-8:-3, -2:8]
+    hits_df = pd.DataFrame({
+        "citizenId": rng.integers(0, citizens, hits), "battle_id": rng.choice(battle_ids, hits),
+        "time": pd.Timestamp("2024-01-01") + pd.to_timedelta(
+            rng.choice(windows, hits) * 600_000 + rng.integers(0, 600_000, hits), unit="ms"),
+        "berserk": rng.random(hits) < 0.6})
+    return hits_df.drop_duplicates(["citizenId", "time"]).sort_values(["battle_id", "citizenId", "time"],
+                                                                      ignore_index=True)
+
+
+def get_medkits_and_restores_loop(hits_df: pd.DataFrame, api_battles_df: pd.DataFrame,
+                                  fast_server: bool) -> tuple[pd.Series, pd.Series]:
+    """The estimation hit by hit (as dmg-stats did before it was vectorized), to compare with."""
+    players = defaultdict(lambda: {"limits": Fraction(0), "medkits": 0, "last_hit": None, "has_restore": False})
+    restores = defaultdict(int)
+    for battle_id, is_restore_battle in api_battles_df[["battle_id", "is_restore_battle"]].itertuples(index=False):
+        battle_hits = hits_df[hits_df["battle_id"] == battle_id]
+        for hit in battle_hits.itertuples(index=False):
+            player = players[hit.citizenId]
+            last_hit = player["last_hit"]
+            if last_hit is None or last_hit.normalize() != hit.time.normalize():
+                player["limits"] = dmg_stats_utils.full_limits
+            windows_from_last = (hit.time.floor("10min") - last_hit.floor("10min")) // pd.Timedelta("10min") \
+                if last_hit is not None else 1
+            if windows_from_last > 0:
+                restores[(hit.citizenId, hit.time.normalize())] += 1
+                if fast_server:
+                    player["limits"] = min(player["limits"] + windows_from_last * dmg_stats_utils.limits_per_restore
+                                           + dmg_stats_utils.health_limits, dmg_stats_utils.full_limits)
+            if is_restore_battle and player["has_restore"]:
+                player["limits"] = dmg_stats_utils.medkit_limits + dmg_stats_utils.health_limits
+                player["has_restore"] = False
+            player["limits"] -= Fraction(5 if hit.berserk else 1, 3)  # hits / (1 - avoid) / hits_per_limit
+            if player["limits"] < dmg_stats_utils.threshold:
+                player["medkits"] += 1
+                player["limits"] += dmg_stats_utils.medkit_limits
+            player["last_hit"] = hit.time
+        hits_per_citizen = battle_hits.assign(hits=np.where(battle_hits["berserk"], 5, 1)).groupby("citizenId")["hits"]
+        for citizen_id, hits in hits_per_citizen.sum().items():
+            players[citizen_id]["has_restore"] = is_restore_battle and hits >= dmg_stats_utils.restore_battle_min_hits
+    medkits = pd.Series({citizen_id: player["medkits"] for citizen_id, player in players.items()})
+    return medkits.sort_index(), pd.Series(restores).sort_index()
+
+
+class TestMedkitsAndRestores(unittest.TestCase):
+    def setUp(self) -> None:
+        self.battle_ids = [1, 2, 3, 4, 5]
+        self.hits_df = get_hits(self.battle_ids)
+        self.api_battles_df = pd.DataFrame({"battle_id": self.battle_ids,
+                                            "is_restore_battle": [True, True, False, True, True]})
+
+    def assert_same_as_loop(self, blocks: list[list[int]], windows: bool) -> None:
+        """The medkits and restores of the blocks, with the state carried over between them, as the loop's."""
+        hits_df = self.hits_df
+        if windows:  # the hits per 10 minutes window, as dmg-stats selects them
+            hits_df = hits_df.assign(hits=np.where(hits_df["berserk"], 5, 1), time=hits_df["time"].dt.floor("10min"))
+            hits_df = hits_df.groupby(["citizenId", "battle_id", "time"], as_index=False)["hits"].sum()
+        for fast_server in (True, False):
+            medkits, restores, state = pd.Series(dtype=int), [], None
+            for block in blocks:
+                block_medkits, block_restores, state = dmg_stats_utils.get_medkits_and_restores(
+                    hits_df[hits_df["battle_id"].isin(block)],
+                    self.api_battles_df[self.api_battles_df["battle_id"].isin(block)], fast_server, state)
+                medkits = medkits.add(block_medkits, fill_value=0)
+                restores.append(block_restores)
+            restores = pd.concat(restores).groupby(level=[0, 1]).sum()
+            expected_medkits, expected_restores = get_medkits_and_restores_loop(
+                self.hits_df, self.api_battles_df, fast_server)
+            self.assertGreater(expected_medkits.sum(), 0)
+            self.assertEqual(medkits.astype(int).to_dict(), expected_medkits.to_dict())
+            self.assertEqual(restores.astype(int).to_dict(), expected_restores.to_dict())
+
+    def test_one_pass(self) -> None:
+        self.assert_same_as_loop([self.battle_ids], windows=False)
+
+    def test_windows(self) -> None:
+        self.assert_same_as_loop([self.battle_ids], windows=True)
+
+    def test_blocks(self) -> None:
+        self.assert_same_as_loop([[1], [2, 3], [4, 5]], windows=True)
+
+
+class TestBlockStats(unittest.TestCase):
+    def setUp(self) -> None:
+        self.battle_ids = [1, 2, 3, 4]
+        self.battles = [get_battle(battle_id) for battle_id in self.battle_ids]
+        self.api_battles_df = pd.DataFrame({"battle_id": self.battle_ids,
+                                            "is_restore_battle": [False, True, True, False]})
+
+    def fold(self, blocks: list[list[int]], totals: tuple = None) -> tuple:
+        for block in blocks:
+            indexes = [self.battle_ids.index(battle_id) for battle_id in block]
+            totals = dmg_stats_utils.get_block_stats(
+                pd.concat([self.battles[i][0] for i in indexes], ignore_index=True),
+                pd.concat([self.battles[i][1] for i in indexes], ignore_index=True),
+                self.api_battles_df.iloc[indexes], True, totals)
+        return totals
+
+    def assert_same_totals(self, totals: tuple, expected: tuple) -> None:
+        rounds_stats, medkits, restores, state = totals
+        pd.testing.assert_frame_equal(rounds_stats.sort_index(), expected[0].sort_index())
+        pd.testing.assert_series_equal(medkits.sort_index(), expected[1].sort_index())
+        pd.testing.assert_series_equal(restores.sort_index(), expected[2].sort_index())
+        pd.testing.assert_frame_equal(state.sort_index(), expected[3].sort_index())
+
+    def test_blocks_match_one_pass(self) -> None:
+        self.assert_same_totals(self.fold([[1, 2], [3, 4]]), self.fold([[1, 2, 3, 4]]))
+
+    def test_continue_from_checkpoint(self) -> None:
+        """A checkpoint (the cached totals of the first blocks) continues like the run that saved it."""
+        checkpoint = pickle.loads(pickle.dumps(self.fold([[1], [2]])))
+        self.assert_same_totals(self.fold([[3, 4]], checkpoint), self.fold([[1], [2], [3, 4]]))
+
+
+class TestDmgStats(unittest.TestCase):
+    def test_csv_and_previews(self) -> None:
+        battle_ids = [1, 2]
+        battles = [get_battle(battle_id) for battle_id in battle_ids]
+        player_rounds_df = pd.concat([battle[0] for battle in battles], ignore_index=True)
+        windows_df = pd.concat([battle[1] for battle in battles], ignore_index=True)
+        api_battles_df = pd.DataFrame({"battle_id": battle_ids, "defenderId": [1, 2], "attackerId": [2, 1],
+                                       "defenderScore": [8, 3], "attackerScore": [5, 8],
+                                       "is_restore_battle": [False, False]}, index=battle_ids)
+        weps = {f"Q{wep_q} weps": 10 * wep_q for wep_q in range(6)}
+
+        def get_sums(column: str, values: list) -> pd.DataFrame:
+            return pd.DataFrame([{column: value, "damage": 1000 * (i + 1), **weps} for i, value in enumerate(values)])
+
+        citizen_sum_df = get_sums("citizenId", list(range(6))).assign(max_hit=500)
+        outputs = dmg_stats_utils.get_dmg_stats(
+            player_rounds_df, citizen_sum_df, get_sums("date", ["2024-01-01"]), get_sums("citizenship", [1, 2]),
+            get_sums("militaryUnit", [7]), get_sums("battle_id", battle_ids), windows_df, api_battles_df,
+            "https://alpha.e-sim.org/", True)
+        self.assertEqual(len(outputs), 3)
+        for content, preview_rows in outputs:
+            self.assertIsInstance(content, bytes)
+            # The preview is the header and the first rows of the csv
+            first_lines = content.decode().split("\n")[:len(preview_rows)]
+            self.assertEqual([",".join(row) for row in preview_rows], first_lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
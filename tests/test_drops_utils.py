@@ -0,0 +1,113 @@
+"""Tests for Utils.drops_utils (run with `python -m unittest discover tests`)."""
+import math
+import unittest
+
+import numpy as np
+
+from Utils import drops_utils
+
+
+def get_percentages_loop(n: int, p: float) -> list[float]:
+    """The chance (in %) to get each amount of drops out of n, one amount at a time."""
+    mean = n * p
+    std = math.sqrt(mean * (1 - p))
+    if mean >= 5 and n * (1 - p) >= 5:
+        return [math.exp(-((k - mean) / std) ** 2 / 2) / (math.sqrt(2 * math.pi) * std) * 100 for k in range(n + 1)]
+    if p <= 0 or p >= 1:
+        return [100.0 if k == (n if p >= 1 else 0) else 0.0 for k in range(n + 1)]
+    log_pmf = [math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1) + k * math.log(p)
+               + (n - k) * math.log1p(-p) for k in range(n + 1)]
+    pmf = [math.exp(x - max(log_pmf)) for x in log_pmf]
+    return [x / sum(pmf) * 100 for x in pmf]
+
+
+def get_drops_chances_loop(tops_per_player: dict, drops_per_q: dict, hits: int, bonus: int,
+                           player_id: int = None) -> tuple[dict, set, list, list, int]:
+    """get_drops_chances player by player (as /drops did before it was vectorized)."""
+    indexes = {"Q3": 2, "Q4": 1, "Q5": 0, "Q6": 0}
+    final, qualities, plots, mean_values, max_k = {}, set(), [], [], 0
+    for user_id, value in tops_per_player.items():
+        if player_id is not None and player_id != user_id:
+            continue
+        final[user_id] = {}
+        for quality, (n, _) in drops_per_q.items():
+            if quality in indexes:
+                total_tops = sum(x['tops'][indexes[quality]] for x in tops_per_player.values())
+                my_tops = value['tops'][indexes[quality]]
+            elif "upg" in quality:
+                total_tops, my_tops = hits, value['hits']
+            else:
+                total_tops, my_tops = hits + hits * bonus / 100, value['hits'] + value['hits'] * bonus / 100
+            p = my_tops / total_tops if total_tops else 0
+            mean, std = n * p, math.sqrt(n * p * (1 - p))
+            mean_values.append(mean)
+            percentages = get_percentages_loop(n, p)
+            cum_sum = np.cumsum(percentages)
+            percentages = [x for x, total in zip(percentages, cum_sum) if total < 99.9] or percentages
+            max_k = max(max_k, len(percentages))
+            first, last = round(mean - std), round(mean + std)
+            if n and my_tops:
+                if first == 0:
+                    drops_range, chances = ("1" if n == 1 else "1+"), 100 - percentages[0]
+                else:
+                    drops_range = f"{first}-{last}" if first != last else str(first)
+                    chances = sum(percentages[first:last + 1])
+                final[user_id][quality] = (drops_range, f"{round(chances)}%")
+                qualities.add(quality)
+            else:
+                final[user_id][quality] = (0, "100%")
+            if player_id is not None and len(percentages) > 1:
+                plots.append((quality, percentages))
+    return final, qualities, plots, mean_values, max_k
+
+
+class TestGetPercentages(unittest.TestCase):
+    def test_same_as_loop(self) -> None:
+        n = 200
+        p = np.array([0, 0.001, 0.01, 0.02, 0.1, 0.5, 0.97, 0.99, 1])  # binomial and normal, and the edges
+        percentages = drops_utils.get_percentages(n, p, np.tile(np.arange(n + 1), (len(p), 1)))
+        for row, chance in zip(percentages, p):
+            np.testing.assert_allclose(row, get_percentages_loop(n, chance), rtol=1e-9, atol=1e-12)
+
+    def test_window(self) -> None:
+        """The amounts of a window (some above n) get the chances of the full range."""
+        n, p = 50, np.array([0.05, 0.3])
+        k = np.array([[0, 1, 2, 3], [48, 49, 50, 51]])
+        percentages = drops_utils.get_percentages(n, p, k)
+        np.testing.assert_allclose(percentages[0], get_percentages_loop(n, 0.05)[:4])
+        np.testing.assert_allclose(percentages[1], get_percentages_loop(n, 0.3)[48:] + [0])
+
+
+class TestDropsChances(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        self.tops_per_player = {
+            citizen_id: {'hits': int(rng.choice([5, 50, 500, 5000]) * rng.random()) + 1,
+                         'tops': sorted(rng.integers(0, 15, 3).tolist())} for citizen_id in range(100)}
+        self.hits = sum(x['hits'] for x in self.tops_per_player.values())
+        self.drops_per_q = {"Q1": (self.hits // 40, 1), "Q2": (self.hits // 200, 1), "Q3": (30, 1), "Q4": (12, 1),
+                            "Q5": (3, 1), "Q6": (1, 1), "Q7": (0, 1), "upgrades": (7, 1)}
+
+    def assert_same_as_loop(self, player_id: int | None) -> None:
+        final, qualities, plots, mean_values, max_k = drops_utils.get_drops_chances(
+            self.tops_per_player, self.drops_per_q, self.hits, 10, player_id)
+        expected = get_drops_chances_loop(self.tops_per_player, self.drops_per_q, self.hits, 10, player_id)
+        self.assertEqual(final, expected[0])
+        self.assertEqual(qualities, expected[1])
+        self.assertEqual([quality for quality, _ in plots], [quality for quality, _ in expected[2]])
+        for (_, percentages), (_, expected_percentages) in zip(plots, expected[2]):
+            np.testing.assert_allclose(percentages, expected_percentages, rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(sorted(mean_values), sorted(expected[3]))
+        self.assertEqual(max_k, expected[4])
+
+    def test_all_players(self) -> None:
+        self.assert_same_as_loop(None)
+
+    def test_one_player(self) -> None:
+        for player_id in (0, 3, 7):
+            with self.subTest(player_id=player_id):
+                self.assert_same_as_loop(player_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
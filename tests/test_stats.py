@@ -0,0 +1,83 @@
+"""Tests for exts.Stats (run with `python -m unittest discover tests`)."""
+import asyncio
+import logging
+import sys
+import tracemalloc
+import unittest
+from types import ModuleType, SimpleNamespace
+from unittest import mock
+
+import pandas as pd
+
+# The cog gets its bot as an argument, and the real bot needs a config file and a database
+sys.modules.setdefault("bot.bot", ModuleType("bot.bot"))
+sys.modules["bot.bot"].bot = None
+
+from test_dmg_stats_utils import get_battle  # noqa: E402
+
+try:
+    from exts.Stats import Stats
+    from Utils import battle_db_utils, results_cache
+except ImportError:  # one of the requirements is not installed
+    Stats = None
+
+memory_limit = 2  # MB
+
+
+class FakeWorkers:
+    @staticmethod
+    async def run(func: callable, *args, interaction=None) -> object:
+        return func(*args)
+
+
+@unittest.skipIf(Stats is None, "the requirements of exts.Stats are not installed")
+class TestDmgStatsInBlocks(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.battle_ids = list(range(1, 61))
+        self.battles = {battle_id: get_battle(battle_id, citizens=100) for battle_id in self.battle_ids}
+        self.api_battles_df = pd.DataFrame({
+            "battle_id": self.battle_ids, "defenderId": 1, "attackerId": 2, "defenderScore": 8,
+            "attackerScore": 5, "is_restore_battle": False}, index=self.battle_ids)
+        self.bot = SimpleNamespace(config={"dmg_stats_memory_limit": memory_limit},
+                                   logger=logging.getLogger(__name__), workers=FakeWorkers())
+
+    async def select_api_fights_aggregates(self, server: str, battle_ids: list, group_by: dict,
+                                           aggregates: tuple) -> pd.DataFrame:
+        """The aggregates of the given battles, like the db would return them."""
+        if "round_id" in group_by:
+            return pd.concat([self.battles[battle_id][0] for battle_id in battle_ids], ignore_index=True)
+        if "time" in group_by:
+            return pd.concat([self.battles[battle_id][1] for battle_id in battle_ids], ignore_index=True)
+        (column, _), = group_by.items()
+        values = {"citizenId": range(100), "date": ["2024-01-01"], "citizenship": [1, 2],
+                  "militaryUnit": [7], "battle_id": battle_ids}[column]
+        return pd.DataFrame([{column: value, **{aggregate: 1000 for aggregate in aggregates}} for value in values])
+
+    async def dmg_stats_in_blocks(self, api_battles_df: pd.DataFrame) -> tuple:
+        sums = ("damage", *(f"Q{wep_q} weps" for wep_q in range(6)))
+        queries = (({"citizenId": "", "battle_id": "", "round_id": "", "defenderSide": ""}, ("damage",)),
+                   ({"citizenId": ""}, (*sums, "max_hit")), ({"date": ""}, sums), ({"citizenship": ""}, sums),
+                   ({"militaryUnit": ""}, sums), ({"battle_id": ""}, sums),
+                   ({"citizenId": "", "battle_id": "", "time": ""}, ("hits",)))
+        with mock.patch.object(battle_db_utils, "select_api_fights_aggregates", self.select_api_fights_aggregates), \
+                mock.patch.object(results_cache, "bot", SimpleNamespace(loop=asyncio.get_running_loop())):
+            return await Stats(self.bot)._Stats__dmg_stats_in_blocks(
+                None, "alpha", api_battles_df, queries, "https://alpha.e-sim.org/", True, {}, None)
+
+    async def test_peak_memory_under_limit(self) -> None:
+        all_battles_memory = sum(df.memory_usage(deep=True).sum() for battle in self.battles.values() for df in battle)
+        self.assertGreater(all_battles_memory, memory_limit * 2 ** 20)  # so it takes a few blocks
+
+        await self.dmg_stats_in_blocks(self.api_battles_df.iloc[:2])  # the modules that pandas imports lazily
+        tracemalloc.start()
+        try:
+            outputs, _ = await self.dmg_stats_in_blocks(self.api_battles_df)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(outputs), 3)
+        self.assertLess(peak, memory_limit * 2 ** 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
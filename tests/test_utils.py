@@ -0,0 +1,41 @@
+"""Tests for Utils.utils (run with `python -m unittest discover tests`)."""
+import sys
+import unittest
+from types import ModuleType
+
+import numpy as np
+
+# The real bot needs a config file and a database
+sys.modules.setdefault("bot.bot", ModuleType("bot.bot"))
+sys.modules["bot.bot"].bot = None
+
+try:
+    from Utils import utils
+except ImportError:  # one of the requirements is not installed
+    utils = None
+
+
+@unittest.skipIf(utils is None, "the requirements of Utils.utils are not installed")
+class TestAlerts(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        prices = [0.5, 0.99, 1, 1.01, 2, 2.5, 10]
+        self.alerts = {f"{server} {product}": [f"{rng.integers(10 ** 17, 10 ** 18)} {rng.choice(prices):g}"
+                                               for _ in range(int(rng.integers(1, 20)))]
+                       for server in ("alpha", "luxia") for product in ("Q5 Weapon", "Q1 Iron", "Gift")}
+        self.best_prices = [0.4, 0.99, 1, 1.005, 2.5, 10, 11]
+
+    def test_triggered_alerts(self) -> None:
+        """The alerts whose price is above the best price fire, like the check over every alert did."""
+        alerts_index = utils.get_alerts_index(self.alerts)
+        for name_for_db, list_of_requests in self.alerts.items():
+            server, product_name = name_for_db.split(" ", 1)
+            for best_price in self.best_prices:
+                expected = sorted((float(price), channel_id) for channel_id, price in
+                                  (string.split()[-2:] for string in list_of_requests) if best_price < float(price))
+                self.assertEqual(
+                    utils.get_triggered_alerts(alerts_index[(server, product_name)], best_price), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+"""Tests for Utils.workers (run with `python -m unittest discover tests`)."""
+import asyncio
+import math
+import sys
+import time
+import unittest
+from types import ModuleType
+
+# Utils.workers only needs bot.should_cancel, and the real bot needs a config file and a database
+sys.modules.setdefault("bot.bot", ModuleType("bot.bot"))
+sys.modules["bot.bot"].bot = None
+
+from Utils.workers import WorkerPool  # noqa: E402
+
+
+class TestWorkerPool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.pool = WorkerPool(max_workers=1, cancel_check_interval=0.1)
+
+    def tearDown(self) -> None:
+        self.pool.shutdown()
+
+    async def test_run(self) -> None:
+        self.assertEqual(await self.pool.run(math.factorial, 5), 120)
+
+    async def test_pending_job_is_resubmitted_after_abort(self) -> None:
+        slow = asyncio.create_task(self.pool.run(time.sleep, 5, timeout=1))
+        await asyncio.sleep(0.3)  # the slow job is running, so the next one waits in the executor's queue
+        pending = [asyncio.create_task(self.pool.run(math.factorial, n)) for n in range(5)]
+        with self.assertRaises(TimeoutError):
+            await slow
+        self.assertEqual(await asyncio.gather(*pending), [1, 1, 2, 6, 24])
+
+    async def test_cancelled_job_is_resubmitted(self) -> None:
+        slow = asyncio.create_task(self.pool.run(time.sleep, 1))
+        await asyncio.sleep(0.3)
+        # The executor feeds its workers ahead, so only the last jobs are still cancellable
+        pending = [asyncio.create_task(self.pool.run(math.factorial, n)) for n in range(5)]
+        await asyncio.sleep(0.3)
+        # Drop the queued jobs without their callers asking for it
+        executor, self.pool.executor = self.pool.executor, None
+        executor.shutdown(wait=False, cancel_futures=True)
+        self.assertEqual(await asyncio.gather(*pending), [1, 1, 2, 6, 24])
+        await slow
+
+    async def test_job_is_not_resubmitted_after_shutdown(self) -> None:
+        slow = asyncio.create_task(self.pool.run(time.sleep, 1))
+        await asyncio.sleep(0.3)
+        pending = [asyncio.create_task(self.pool.run(math.factorial, n)) for n in range(5)]
+        await asyncio.sleep(0.3)
+        self.pool.shutdown()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending[-1]
+        await slow
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -29,6 +29,20 @@ async def update_buffs(server: str) -> None:
     ELIXIRS = ["jinxed", "finese", "bloodymess", "lucky"]
     base_columns = 8
     LINK, CITIZENSHIP, DMG, LAST_SEEN, PREMIUM, BUFFED_AT, DEBUFF_ENDS, TILL_CHANGE = range(base_columns)
+    # The profile of an online player is fetched again only when it may have changed:
+    #  right away if it's new or just came online, every cycle if it has a buff or an elixir (a new elixir
+    #  must be seen before the shortest one, 15 minutes, could end), and otherwise every other cycle.
+    UNBUFFED_RECHECK = 10 * 60  # they can buff at any time
+    PROFILES_CONCURRENCY = 3  # overlaps the responses, but the requests still start 0.37 seconds apart
+    CYCLE_BUDGET = 240  # seconds (of the 300 seconds interval)
+    next_check: dict[str, float] = {}  # nick -> when to fetch the profile again
+    was_online = set()
+
+    def get_next_check(row: list | None) -> float:
+        if row:  # buffed, or drinking elixirs
+            return 0
+        return loop_start_time + UNBUFFED_RECHECK  # from the cycle start, so it's due exactly 2 cycles later
+
     is_first_update = True
     while True:
         loop_start_time = time.time()
@@ -37,18 +51,31 @@ async def update_buffs(server: str) -> None:
             buffs_data = await utils.find_one("buffs", server) or {}
             now = utils.current_datetime()
             now_s = utils.current_datetime_str()
+            now_ts = time.time()
             last_update = buffs_data.get("Last update:", [now_s])[0]
             buffs_data.pop("Nick", None)
             buffs_data.pop("Last update:", None)
 
-            for player_info in await utils.get_content(f"{base_url}apiOnlinePlayers.html"):
-                player = json.loads(player_info)
-                nick = player['login']
-                profile_link = f"{base_url}profile.html?id={player['id']}"
-
-                # Pause to comply with server request limits
-                await asyncio.sleep(0.37)
-                tree = await utils.get_content(profile_link)
+            online_players = [json.loads(player_info) for player_info in
+                              await utils.get_content(f"{base_url}apiOnlinePlayers.html")]
+            online_nicks = {player['login'] for player in online_players}
+            # Only the due profiles are fetched: the new players and those who just came online first
+            due_players = sorted((player for player in online_players if next_check.get(player['login'], 0) <= now_ts),
+                                 key=lambda player: (player['login'] in was_online, next_check.get(player['login'], 0)))
+            semaphore = asyncio.Semaphore(PROFILES_CONCURRENCY)
+            request_lock = asyncio.Lock()
+
+            async def refresh_player(player: dict) -> None:
+                async with semaphore:
+                    if time.time() - loop_start_time > CYCLE_BUDGET:
+                        return  # still due, so it will be first in the next cycle
+                    nick = player['login']
+                    profile_link = f"{base_url}profile.html?id={player['id']}"
+
+                    # Pause to comply with server request limits
+                    async with request_lock:
+                        await asyncio.sleep(0.37)
+                    tree = await utils.get_content(profile_link)
                 player_details = utils.extract_player_details(profile_link, tree)
 
                 # Update the player data if they are buffed
@@ -84,8 +111,20 @@ async def update_buffs(server: str) -> None:
                             timedelta(minutes=(1 + elixir_bonus / 100) * BUFF_SIZES[size]))
                         buffs_data[nick][base_columns + index + len(ELIXIRS)] = now_s
 
-                if player["login"] in buffs_data:  # update last seen
-                    buffs_data[player["login"]][LAST_SEEN] = now_s
+                next_check[nick] = get_next_check(buffs_data.get(nick))
+
+            async def safe_refresh_player(player: dict) -> None:
+                try:
+                    await refresh_player(player)
+                except Exception:
+                    print(server, player['login'], traceback.format_exc()[-MAX_ERROR_LENGTH:])
+
+            await asyncio.gather(*(safe_refresh_player(player) for player in due_players))
+            for nick in online_nicks & buffs_data.keys():  # update last seen
+                buffs_data[nick][LAST_SEEN] = now_s
+            # The offline players are fetched as soon as they come back
+            next_check = {nick: when for nick, when in next_check.items() if nick in online_nicks}
+            was_online = online_nicks
 
             # Update the buffed and debuffed times
             day_seconds = 24 * 60 * 60  # seconds in a day
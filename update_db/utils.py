@@ -14,6 +14,7 @@ from dotenv import load_dotenv
 from google.oauth2.service_account import Credentials
 from lxml.html import fromstring
 
+from Utils.collection_store import CollectionStore
 from Utils.constants import countries_per_id, countries_per_server
 
 load_dotenv()
@@ -196,25 +197,30 @@ def get_eqs(tree) -> iter:
         yield slot, parameters, values, eq_link
 
 
-def get_file_path(collection: str, _id: str) -> str:
+def get_db_dir() -> str:
     """db/ is in the parent directory of the root directory of the project."""
     root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    return os.path.join(os.path.dirname(root), f"db/{collection}_{_id}.json")
+    return os.path.join(os.path.dirname(root), "db")
+
+
+# The bot reads the documents written here, so nothing is cached (every write is atomic, though)
+store = CollectionStore(get_db_dir())
 
 
 async def find_one(collection: str, _id: str) -> dict:
-    filename = get_file_path(collection, _id)
-    if os.path.exists(filename):
-        with open(filename, encoding='utf-8') as file:
-            return json.load(file)
-    else:
-        return {}
+    return await store.find_one(collection, _id)
 
 
 async def replace_one(collection: str, _id: str, data: dict) -> None:
-    filename = get_file_path(collection, _id)
-    with open(filename, "w", encoding='utf-8', errors='ignore') as file:
-        json.dump(data, file)
+    await store.replace_one(collection, _id, data)
+
+
+async def find_keys(collection: str, _id: str, keys: iter) -> dict:
+    return await store.find_keys(collection, _id, keys)
+
+
+async def update_keys(collection: str, _id: str, data: dict, removed: iter = ()) -> None:
+    await store.update_keys(collection, _id, data, removed)
 
 
 def format_seconds(seconds):